@@ -1,140 +1,298 @@
-from ultralytics import YOLO
-import cv2
-import pyttsx3  
+import logging
+import numpy as np
 import time
 import psutil
 
-# Text-to-speech
-engine = pyttsx3.init()
-engine.setProperty('rate', 200)  # Speed of speech
-engine.setProperty('volume', 1.0)  
-
-# Load YOLO model
-model = YOLO('yolov8n.pt')
-
-def log_metrics(detections, start_time):
-    #latency
-    end_time = time.time()
-    latency = end_time - start_time  
-    #memory usage (in MB)
-    process = psutil.Process()
-    memory_info = process.memory_info()
-    memory_usage = memory_info.rss / (1024 * 1024)  #byte to mb
-    # Log metrics
-    print(f"Latency: {latency:.4f} seconds")
-    print(f"Memory Usage: {memory_usage:.2f} MB")
-
-
-def calculate_distance(bbox_height, frame_height, actual_height=1.7):
-    focal_length = 700  
-    if bbox_height > 0:
-        distance = (actual_height * focal_length) / (bbox_height / frame_height)
-        return distance  
-    return float('inf') 
+import config
+from capture import MultiCapture, release_all
+from detections import HAZARD_AHEAD, HAZARD_CLOSE, HAZARD_NONE, DetectionBatch, hazard_levels, names_array
+from inference_service import DetectionClient
+from metrics import metrics, setup_logging
+from model_manager import ModelManager
+from motion import KeyframeScheduler
+from pipeline import InferenceResult, LatestQueue, Stage
+from preview import Preview
+from roi import CorridorPlanner
+from traces import FLAG_STALE, TraceRecorder, trace_path
+from speech import PRIORITY_ALERT, PRIORITY_WARNING, SpeechService
+from tracker import HazardTracker
+
+log = logging.getLogger("hazard")
+
+# Text-to-speech, started together with the detection loop
+speech = SpeechService(rate=200, volume=1.0)
+
+HAZARD_WEIGHTS = 'yolov8n.pt'
+
+detector = None  # DetectionClient when the shared inference service is used
+model = None
+class_names = None
+hazard_class_ids = None
+
+def load_model(weights=HAZARD_WEIGHTS, **manager_options):
+    """Load the YOLO model, or share the one already resident in the inference service"""
+    global detector, model, class_names, hazard_class_ids
+    if config.USE_INFERENCE_SERVICE:
+        detector = DetectionClient(weights)
+        names = detector.names
+    else:
+        # Switches between model tiers and input sizes to stay within TARGET_LATENCY
+        model = ModelManager(weights, **manager_options)
+        names = model.names
+    class_names = names_array(names)
+    # Only these classes are treated as hazards, all classes when HAZARD_CLASSES is empty
+    hazard_class_ids = [i for i, name in enumerate(class_names) if name in config.HAZARD_CLASSES] or None
+    # Have every possible announcement rendered ahead of time
+    speech.prepare(feedback_phrases(class_names))
+
+process = psutil.Process()
+#memory usage (in MB), sampled when metrics are exported rather than every frame
+metrics.gauge('rss_mb', lambda: process.memory_info().rss / (1024 * 1024))
+
+capture_to_detection = metrics.histogram('capture_to_detection_seconds')
+inference_time = metrics.histogram('inference_seconds')
+# how long frames wait between capture and the model, which grows when capture falls behind
+capture_to_inference = metrics.histogram('capture_to_inference_seconds')
+detections_per_frame = metrics.histogram('detections_per_frame')
+frames_skipped = metrics.counter('frames_skipped')
+batch_size = metrics.histogram('inference_batch_size')
+input_size = metrics.histogram('inference_imgsz')
+
+def log_metrics(detections, capture_time):
+    #latency from frame capture to detections ready
+    latency = time.monotonic() - capture_time
+    capture_to_detection.observe(latency)
+    detections_per_frame.observe(len(detections))
+    if log.isEnabledFor(logging.DEBUG):
+        log.debug("Latency: %.4f seconds, %d detections", latency, len(detections))
+
 
 def filter_detections(detections):
-    filtered = []
-    for detection in detections:
-        class_id = int(detection[5])  
-        class_name = model.names[class_id]  
-        filtered.append(detection)  
-    return filtered
-
-
-last_feedback_time = 0  # Store the last feedback time
-
-def give_audio_feedback(detections, frame_height):
-    global last_feedback_time
-    current_time = time.time()
-
-    #feedback every 0.5 seconds
-    if current_time - last_feedback_time < 0.5:
-        return
-
-    if not detections:
-        return
-
-    for detection in detections:
-        confidence = detection[4] * 100  #accuracy
-        class_id = int(detection[5]) 
-        class_name = model.names[class_id]  
-        bbox_height = detection[3] - detection[1] 
-
-        #distance
-        distance = calculate_distance(bbox_height, frame_height)
-
-        feedback_fast = ""
-        feedback = ""
-        
-        # Warnings for different objects
-        if confidence > 80 and distance < 4000:  
-            if class_name == "person":
-                if distance > 1700 and distance <= 4000:
-                    feedback = f"Caution! Person ahead"
-                    #print(feedback)
-                    engine.say(feedback)
-                    engine.runAndWait()
-                elif distance <= 1700:
-                    feedback_fast = f"Alert! Person very close"
-                    print(feedback_fast)
-                    engine.say(feedback_fast)
-                    engine.runAndWait()
+    return detections.filter(classes=hazard_class_ids)
+
+
+# Tracks objects across frames so each one is announced once per hazard level, one tracker per camera
+trackers = {}
+
+def camera_suffix(camera):
+    """Where a hazard was seen, only said when there is more than one camera"""
+    if len(config.CAMERA_SOURCES) < 2:
+        return ""
+    name = config.CAMERA_NAMES[camera] if camera < len(config.CAMERA_NAMES) else str(camera + 1)
+    return f" on the {name} camera"
+
+def feedback_message(class_name, level, where=""):
+    """The announcement for a hazard at `level`"""
+    if class_name == "person":
+        if level == HAZARD_AHEAD:
+            return f"Caution! Person ahead{where}"
+        return f"Alert! Person very close{where}"
+    if level == HAZARD_AHEAD:
+        return f"Warning! {class_name} ahead{where}"
+    return f" danger! {class_name} {class_name}{class_name}{class_name}{class_name}{where}"
+
+def feedback_phrases(names):
+    """Every announcement give_audio_feedback can make for these class names"""
+    ids = [i for i, name in enumerate(names) if name in config.HAZARD_CLASSES] or range(len(names))
+    wheres = sorted({camera_suffix(camera) for camera in range(len(config.CAMERA_SOURCES))})
+    return [feedback_message(names[i], level, where) for i in ids if names[i]
+            for level in (HAZARD_AHEAD, HAZARD_CLOSE) for where in wheres]
+
+def give_audio_feedback(detections, frame_height, camera=0, now=None):
+    """Announce new hazards; returns the level announced for each detection, 0 where nothing was said"""
+    current_time = time.monotonic() if now is None else now
+    if camera not in trackers:
+        trackers[camera] = HazardTracker()
+    tracks = trackers[camera].update(detections.boxes, detections.class_ids, current_time)
+    announced = np.zeros(len(detections), dtype=np.int8)
+
+    if not len(detections):
+        return announced
+
+    #distance and hazard level for every box at once
+    distances = detections.distances(frame_height)
+    levels = hazard_levels(detections.scores * 100, distances, min_confidence=80)
+    for track, distance in zip(tracks, distances.tolist()):
+        track.add_distance(distance, current_time)
+
+    for i in np.flatnonzero(levels != HAZARD_NONE):
+        track = tracks[i]
+        level = levels[i]
+        # Only speak when this object's hazard level changed since it was last announced
+        if not track.announce(level, current_time):
+            continue
+
+        announced[i] = level
+        class_name = class_names[detections.class_ids[i]]
+        feedback = feedback_message(class_name, level, camera_suffix(camera))
+        log.info(feedback.strip())
+        speech.say(feedback, PRIORITY_ALERT if level == HAZARD_CLOSE else PRIORITY_WARNING, config.ALERT_TTL)
+        log.debug("Track %d: distance %.0f, trend %.0f/s", track.id, distances[i], track.distance_trend())
+    return announced
+
+
+def detect_from_camera(active=None, stopping=None):
+    """
+    Run until 'q' is pressed or the feed ends. Under the supervisor, `active` pauses and
+    resumes the loop with the model kept loaded, and `stopping` ends it.
+    """
+    def paused():
+        return active is not None and not active.is_set()
+
+    # Room for one result per camera, so a batch isn't overwritten before it is handled
+    cameras = len(detector.rings) if detector is not None else len(config.CAMERA_SOURCES)
+    feedback_queue = LatestQueue(maxsize=cameras, on_drop=lambda result: result.frame.release())
+    # Annotation and display run on their own thread at a capped rate, or not at all when headless
+    preview = Preview("YOLOv8 Real-Time Detection")
+
+    def publish(frame, result, boxes):
+        # Filter detections; on a copy, the motion scheduler keeps the keyframe's array
+        filtered_detections = filter_detections(DetectionBatch.from_array(np.array(boxes), class_names))
+        log_metrics(filtered_detections, frame.timestamp)
+
+        result = InferenceResult(frame, result, filtered_detections)
+        feedback_queue.put(result)
+        preview.submit(frame.camera, frame.image, filtered_detections)
+        return filtered_detections
+
+    # Motion gating is per camera, each keeps its own keyframe
+    schedulers = [KeyframeScheduler() for _ in range(cameras)] if config.MOTION_GATING else None
+    # Walking-corridor crops and input sizes, per camera
+    planners = [CorridorPlanner() for _ in range(cameras)] if config.ROI_MODE else None
+
+    def run_inference(frames):
+        if paused():
+            release_all(frames)
+            return
+        pending = []
+        for frame in frames:
+            scheduler = schedulers[frame.camera] if schedulers is not None else None
+            if scheduler is not None and not scheduler.should_infer(frame.image):
+                # Scene unchanged since the last keyframe, reuse its detections
+                frames_skipped.inc()
+                publish(frame, None, scheduler.propagate())
             else:
-                if distance > 1700 and distance <= 4000:
-                    feedback = f"Warning! {class_name} ahead"
-                    print(feedback)
-                    engine.say(feedback)
-                    engine.runAndWait()
-                elif distance <= 1700:
-                    feedback_fast = f" danger! {class_name} {class_name}{class_name}{class_name}{class_name}"
-                    print(feedback_fast)
-                    engine.say(feedback_fast)
-                    engine.runAndWait()
-    print(f"Bounding box height: {bbox_height}")
-    print(f"Frame height: {frame_height}")
-    print("Distance is ", distance)
-    
-    last_feedback_time = current_time
-    
-
-
-# Real-Time Detection
-def detect_from_camera():
-    cap = cv2.VideoCapture(0)  #0 is system camera
-
-    if not cap.isOpened():
-        print("Error: Unable to access the camera.")
-        return
-
-    while True:
-        ret, frame = cap.read()
-        if not ret:
-            print("Error: Unable to read the camera feed.")
-            break
+                pending.append(frame)
+        if not pending:
+            return
+        if planners is not None:
+            plans = [planners[frame.camera].plan(frame.image.shape, frame.timestamp) for frame in pending]
+            images = [plan.apply(frame.image) for plan, frame in zip(plans, pending)]
+            # One input size per call; a full-frame scan in the batch needs the model's own size
+            sizes = [plan.imgsz for plan in plans]
+            imgsz = None if None in sizes else max(sizes)
+        else:
+            plans = None
+            images = [frame.image for frame in pending]
+            imgsz = None
+        # Run YOLOv8 inference once for every camera that needs it
+        now = time.monotonic()
+        for frame in pending:
+            capture_to_inference.observe(now - frame.timestamp)
+        start = time.perf_counter()
+        results = model.predict(images, imgsz=imgsz, verbose=False)
+        inference_time.observe(time.perf_counter() - start)
+        batch_size.observe(len(pending))
+        input_size.observe(imgsz or model.imgsz)
+        for i, (frame, result) in enumerate(zip(pending, results)):
+            boxes = result.boxes.data.cpu().numpy()
+            if plans is not None and plans[i].crop is not None:
+                # Detected on a crop: move the boxes back onto the full frame
+                boxes = plans[i].to_frame(boxes)
+                result = None
+            if schedulers is not None:
+                schedulers[frame.camera].keyframe(frame.image, boxes)
+            detections = publish(frame, result, boxes)
+            if planners is not None:
+                planners[frame.camera].observe(detections.boxes,
+                                               detections.hazard_levels(frame.image.shape[0], min_confidence=80))
 
-        
-        frame_height = frame.shape[0]
+    def run_feedback(result):
+        # Last stage to see the frame: its capture buffer can be reused afterwards
+        try:
+            handle_feedback(result)
+        finally:
+            result.frame.release()
 
-        # Run YOLOv8 inference
-        results = model.predict(frame)
-        # Filter detections
-        filtered_detections = filter_detections(results[0].boxes.data.tolist())
+    def handle_feedback(result):
+        if paused():
+            return
+        # The frame and the detections made from it travel together; the trace records exactly this pair
+        frame, detections = result.frame, result.detections
+        now = time.monotonic()
+        # Skip results that went stale while the previous warning was spoken
+        if now - frame.timestamp > config.MAX_RESULT_AGE:
+            if recorder is not None:
+                recorder.record(frame.camera, now, frame.timestamp, frame.image.shape, detections, flags=FLAG_STALE)
+            return
         # Provide audio feedback for hazards
-        give_audio_feedback(filtered_detections, frame_height)
-        start_time = time.time()
-        log_metrics(filtered_detections, start_time)
+        announced = give_audio_feedback(detections, frame.image.shape[0], frame.camera, now)
+        if recorder is not None:
+            recorder.record(frame.camera, now, frame.timestamp, frame.image.shape, detections, announced)
 
-        # Annotate frame with detections
-        annotated_frame = results[0].plot()
+    if detector is not None:
+        # The inference service already captured and ran the model
+        source = detector
+        inference_stage = Stage("postprocess", detector.results, lambda item: publish(item[0], None, item[1]))
+    else:
+        source = MultiCapture(config.CAMERA_SOURCES)
+        if not source.open():
+            log.error("Unable to access the camera.")
+            return
+        inference_stage = Stage("inference", source.frames, run_inference)
 
-        # Display the annotated frame
-        cv2.imshow("YOLOv8 Real-Time Detection", annotated_frame)
+    # What the model saw and what was said, for looking into missed or spurious alerts later
+    recorder = TraceRecorder(trace_path('hazard'), 'hazard', class_names) if config.TRACE_DIR else None
+    feedback_stage = Stage("feedback", feedback_queue, run_feedback)
+    speech.start()
+    source.start()
+    inference_stage.start()
+    feedback_stage.start()
+    preview.start()
+    if recorder is not None:
+        recorder.start()
 
-        if cv2.waitKey(1) & 0xFF == ord('q'):
+    # Windows are shown from the main thread, OpenCV's GUI is not thread safe
+    was_paused = False
+    while inference_stage.is_alive() and not (stopping is not None and stopping.is_set()):
+        if paused() != was_paused:
+            was_paused = paused()
+            if detector is not None:
+                # Let the inference service skip this model while paused
+                detector.pause(was_paused)
+            if was_paused:
+                speech.clear(PRIORITY_ALERT)
+                preview.close_windows()
+        if not preview.show():
             break
 
-    cap.release()
-    cv2.destroyAllWindows()
+    inference_stage.stop()
+    feedback_stage.stop()
+    source.stop()
+    if detector is None:
+        log.info("Frames dropped by capture: %d", source.dropped)
+    preview.stop()
+    if recorder is not None:
+        recorder.stop()
+    speech.stop()
+    log.info("Speech stats: %s", speech.stats())
+    for camera, scheduler in enumerate(schedulers or ()):
+        log.info("Keyframe ratio (camera %d): %.2f", camera, scheduler.keyframe_ratio())
+    for camera, planner in enumerate(planners or ()):
+        log.info("Corridor crop ratio (camera %d): %.2f", camera, planner.crop_ratio())
+    if model is not None:
+        log.info("Final model tier: %s @ %dpx after %d switches", model.weights, model.imgsz, model.switches)
+
+# Supervisor hooks: load everything up front, then run paused until activated
+def warm_up():
+    load_model()
+
+def serve(active, stopping):
+    detect_from_camera(active, stopping)
 
 # Run the detection
-detect_from_camera()
+if __name__ == "__main__":
+    setup_logging()
+    metrics.start_exporter()
+    load_model()
+    detect_from_camera()
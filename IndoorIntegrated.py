@@ -1,20 +1,69 @@
-import pyttsx3
-import speech_recognition as sr
-from ultralytics import YOLO
-import cv2
+import logging
 import numpy as np
-from typing import Dict, List, Tuple
+from typing import Dict, Tuple
 import time
 import psutil
 
+import config
+from capture import CaptureThread
+from detections import HAZARD_AHEAD, HAZARD_CLOSE, HAZARD_NONE, DetectionBatch, names_array
+from indoor_routing import IndoorRouter, meters_to_steps
+from inference_service import DetectionClient
+from metrics import metrics, setup_logging
+from model_manager import ModelManager, PeriodicDetector
+from motion import KeyframeScheduler
+from preview import Preview
+from room_belief import RoomBelief
+from speech import PRIORITY_ALERT, PRIORITY_INFO, PRIORITY_WARNING, SpeechService
+from traces import STREAM_ROOM, TraceRecorder, trace_path
+from tracker import HazardTracker
+from voice import VoiceCommands
+
+log = logging.getLogger("indoor")
+
+INDOOR_WEIGHTS = 'yolov8x.pt'  # room classification
+HAZARD_WEIGHTS = 'yolov8n.pt'  # per-frame hazard detection
+
+
+def feedback_message(class_name: str, level: int) -> str:
+    """The announcement for a hazard at `level`"""
+    if class_name == "person":
+        return "Caution! Person ahead" if level == HAZARD_AHEAD else "Alert! Person very close"
+    return f"Warning! {class_name} ahead" if level == HAZARD_AHEAD else f"Danger! {class_name}"
+
+
+def feedback_phrases(names) -> list:
+    """Every announcement give_audio_feedback can make for these class names"""
+    return [feedback_message(name, level) for name in names if name for level in (HAZARD_AHEAD, HAZARD_CLOSE)]
+
 
 class RoomAndHazardClassifier:
-    def __init__(self):
+    def __init__(self, detector: DetectionClient = None, speaker: SpeechService = None,
+                 model: ModelManager = None, room_weights: str = INDOOR_WEIGHTS):
         # Initialize text-to-speech engine
-        self.speaker = pyttsx3.init()
+        if speaker is None:
+            speaker = SpeechService()
+            speaker.start()
+        self.speaker = speaker
+        
+        # Load the YOLOv8 model, unless detections come from the inference service
+        if detector is not None:
+            self.model = None
+            self.room_detector = None
+            self.names = names_array(detector.names)
+        else:
+            # Cascade: a small adaptive model every frame for hazards,
+            # the large model every few seconds in the background for the room
+            self.model = model or ModelManager(HAZARD_WEIGHTS)
+            self.room_detector = PeriodicDetector(room_weights) if room_weights else None
+            self.names = names_array(self.model.names)
+        self.speaker.prepare(feedback_phrases(self.names))
         
-        # Load the YOLOv8 model
-        self.model = YOLO('yolov8x.pt')
+        self.inference_time = metrics.histogram('inference_seconds')
+        self.detections_per_frame = metrics.histogram('detections_per_frame')
+
+        # Tracks objects across frames so each one is announced once per hazard level
+        self.tracker = HazardTracker()
         
         # Define room classification rules based on objects
         self.room_rules = {
@@ -26,36 +75,38 @@ class RoomAndHazardClassifier:
             'office': ['desk', 'chair', 'laptop', 'monitor']
         }
         
-        # Predefined layout (positions and dimensions of rooms in the house)
-        self.house_layout = {
-            'living_room': {'coords': (0, 0), 'dimensions': (4, 5)},  # x, y, width, height
-            'kitchen': {'coords': (5, 0), 'dimensions': (3, 4)},
-            'bedroom': {'coords': (0, 6), 'dimensions': (4, 4)},
-            'bathroom': {'coords': (5, 5), 'dimensions': (2, 3)},
-            'dining_room': {'coords': (8, 0), 'dimensions': (3, 4)},
-            'office': {'coords': (8, 5), 'dimensions': (3, 4)}
-        }
+        # Room decision smoothed over time from the rules above
+        self.room_belief = RoomBelief(self.room_rules, self.names)
+        
+        # Building layout as a graph of rooms, doors, corridors and stairs, with routes precomputed
+        self.router = IndoorRouter.load(config.INDOOR_LAYOUT)
+        
+        # Room names are the whole vocabulary when asking for a destination
+        self.voice = VoiceCommands([name for room in self.router.rooms
+                                    for name in (room, self.router.label(room))])
         
-    def detect_objects(self, image: np.ndarray) -> List[Dict]:
+    def detect_objects(self, image: np.ndarray) -> DetectionBatch:
         """
         Detect objects in the image using YOLOv8
         """
-        results = self.model(image)
-        detections = []
-        
-        for result in results[0].boxes.data:
-            x1, y1, x2, y2, conf, cls = result
-            class_name = self.model.names[int(cls)]
-            
-            detections.append({
-                'class': class_name,
-                'confidence': float(conf),
-                'bbox': (int(x1), int(y1), int(x2), int(y2))
-            })
-            
-        return detections
+        return self.to_detections(self.detect_boxes(image))
+
+    def detect_boxes(self, image: np.ndarray) -> np.ndarray:
+        """
+        Run YOLOv8 and return raw (x1, y1, x2, y2, conf, cls) rows
+        """
+        start = time.perf_counter()
+        results = self.model.predict(image, verbose=False)
+        self.inference_time.observe(time.perf_counter() - start)
+        return results[0].boxes.data.cpu().numpy()
+
+    def to_detections(self, boxes) -> DetectionBatch:
+        """
+        Wrap raw (x1, y1, x2, y2, conf, cls) rows in a columnar detection batch
+        """
+        return DetectionBatch.from_array(boxes, self.names)
     
-    def classify_room(self, objects: List[Dict]) -> Tuple[str, float]:
+    def classify_room(self, objects: DetectionBatch) -> Tuple[str, float]:
         """
         Classify room type based on detected objects
         Returns room type and confidence score
@@ -63,7 +114,7 @@ class RoomAndHazardClassifier:
         room_scores = {room: 0 for room in self.room_rules.keys()}
         
         # Count matching objects for each room type
-        detected_classes = [obj['class'] for obj in objects]
+        detected_classes = set(objects.class_names())
         for room, required_objects in self.room_rules.items():
             matches = sum(obj in detected_classes for obj in required_objects)
             if matches > 0:
@@ -73,70 +124,66 @@ class RoomAndHazardClassifier:
         best_room = max(room_scores.items(), key=lambda x: x[1])
         return best_room[0], best_room[1]
     
-    def process_frame(self, frame: np.ndarray) -> Dict:
+    def process_frame(self, frame: np.ndarray, boxes: np.ndarray = None, now: float = None) -> Dict:
         """
-        Process a single frame and classify the room
+        Process a single frame and classify the room.
+        `boxes` are detections already computed by the inference service.
         """
         # Detect objects
-        detections = self.detect_objects(frame)
+        if boxes is not None:
+            detections = self.to_detections(boxes)
+        else:
+            detections = self.detect_objects(frame)
         
-        # Classify room based on detected objects
-        room_type, confidence = self.classify_room(detections)
+        # Classify room based on the large model's latest detections when available
+        room_objects = detections
+        room_boxes = None
+        if self.room_detector is not None:
+            self.room_detector.submit(frame)
+            # Read once, the room model's thread may replace them at any time
+            room_boxes = self.room_detector.boxes
+            if room_boxes is not None:
+                room_objects = self.to_detections(room_boxes)
+        # Accumulate evidence across frames instead of deciding from this one alone
+        room_changed = self.room_belief.update(room_objects, now)
         
         return {
-            'room_type': room_type,
-            'confidence': confidence,
-            'detected_objects': detections
+            'room_type': self.room_belief.room,
+            'confidence': self.room_belief.confidence,
+            'room_changed': room_changed,
+            'detected_objects': detections,
+            'room_boxes': room_boxes,  # the room model output this decision used
         }
 
-    def calculate_distance(self, bbox_height, frame_height, actual_height=1.7):
-        focal_length = 700  
-        if bbox_height > 0:
-            distance = (actual_height * focal_length) / (bbox_height / frame_height)
-            return distance  
-        return float('inf')  
-
-    def give_audio_feedback(self, detections, frame_height):
-        last_feedback_time = 0  # Store the last feedback time
-        current_time = time.time()
-
-        # Allow feedback every 0.5 seconds for faster warnings
-        if current_time - last_feedback_time < 0.5:
-            return
-
-        if not detections:
-            return
+    def give_audio_feedback(self, detections: DetectionBatch, frame_height, now: float = None) -> np.ndarray:
+        """
+        Announce new hazards; returns the level announced for each detection, 0 where nothing was said
+        """
+        current_time = time.monotonic() if now is None else now
+        tracks = self.tracker.update(detections.boxes, detections.class_ids, current_time)
+        announced = np.zeros(len(detections), dtype=np.int8)
 
-        for detection in detections:
-            confidence = detection['confidence'] * 100  # Confidence score in percentage
-            class_name = detection['class']  # Class Name
-            bbox_height = detection['bbox'][3] - detection['bbox'][1]  # Bounding box height in pixels
+        if not len(detections):
+            return announced
 
-            # Calculate distance
-            distance = self.calculate_distance(bbox_height, frame_height)
+        # Distance and hazard level for every box at once
+        distances = detections.distances(frame_height)
+        levels = detections.hazard_levels(frame_height, min_confidence=85)
+        for track, distance in zip(tracks, distances.tolist()):
+            track.add_distance(distance, current_time)
 
-            feedback_fast = ""
-            feedback = ""
-            
-            # Warnings for different objects
-            if confidence > 85 and distance < 4000:  # Distance threshold: 50 meters
-                if class_name == "person":
-                    if distance > 1700 and distance <= 4000:
-                        feedback = f"Caution! Person ahead"
-                        self.speak(feedback)
-                    elif distance <= 1700:
-                        feedback_fast = f"Alert! Person very close"
-                        self.speak(feedback_fast)
-                else:
-                    if distance > 1700 and distance <= 4000:
-                        feedback = f"Warning! {class_name} ahead"
-                        self.speak(feedback)
-                    elif distance <= 1700:
-                        feedback_fast = f"Danger! {class_name}"
-                        self.speak(feedback_fast)
+        for i in np.flatnonzero(levels != HAZARD_NONE):
+            track = tracks[i]
+            level = levels[i]
+            # Only speak when this object's hazard level changed since it was last announced
+            if not track.announce(level, current_time):
+                continue
 
-        # Update the last feedback time
-        last_feedback_time = current_time
+            announced[i] = level
+            class_name = self.names[detections.class_ids[i]]
+            priority = PRIORITY_ALERT if level == HAZARD_CLOSE else PRIORITY_WARNING
+            self.speak(feedback_message(class_name, level), priority, config.ALERT_TTL)
+        return announced
 
     def navigate_to_room(self, current_room: str, target_room: str) -> str:
         """
@@ -148,138 +195,210 @@ class RoomAndHazardClassifier:
             self.speak(navigation_message)
             return navigation_message
         
-        current_coords = self.house_layout[current_room]['coords']
-        target_coords = self.house_layout[target_room]['coords']
-        
-        # Simple navigation logic: direction based on x and y coordinates
-        direction = []
-        if target_coords[0] > current_coords[0]:
-            direction.append("Move right")
-        elif target_coords[0] < current_coords[0]:
-            direction.append("Move left")
-        
-        if target_coords[1] > current_coords[1]:
-            direction.append("Move down")
-        elif target_coords[1] < current_coords[1]:
-            direction.append("Move up")
+        steps = self.router.route(current_room, target_room)
+        if not steps:
+            navigation_message = f"Sorry, I don't know a way to the {self.router.label(target_room)}."
+            self.speak(navigation_message)
+            return navigation_message
         
-        navigation_message = " -> ".join(direction)
-        self.speak(navigation_message)
+        navigation_message = " ".join(f"{instruction}. Walk {meters_to_steps(distance)} steps."
+                                      for instruction, distance in steps)
+        self.speak(navigation_message, PRIORITY_INFO, ttl=10.0)
         return navigation_message
 
-    def speak(self, message: str):
+    def speak(self, message: str, priority: int = PRIORITY_INFO, ttl: float = 2.0):
         """
-        Convert the navigation message to speech
+        Queue a message for speech without blocking the frame loop
         """
-        self.speaker.say(message)
-        self.speaker.runAndWait()
+        self.speaker.say(message, priority, ttl)
 
-    def ask_for_target_room(self) -> str:
+    def speak_and_wait(self, message: str):
         """
-        Ask the user which room they want to go to, using voice input.
+        Speak a prompt and wait until it has finished, so the microphone doesn't pick it up
         """
-        print("Please say the name of the room you want to go to.")
-        self.speak("Please say the name of the room you want to go to.")
-        
-        recognizer = sr.Recognizer()
-        microphone = sr.Microphone()
-
-        try:
-            with microphone as source:
-                recognizer.adjust_for_ambient_noise(source)
-                print("Listening for room name...")
-                audio = recognizer.listen(source, timeout=5)
-            
-            room_name = recognizer.recognize_google(audio).lower()
-            print(f"You said: {room_name}")
+        self.speaker.say(message, PRIORITY_INFO, ttl=10.0)
+        self.speaker.wait_until_idle(timeout=10.0)
 
-            # Validate room selection
-            while room_name not in self.house_layout:
-                self.speak("Invalid room name. Please try again.")
-                print("Invalid room name. Please try again.")
-                
-                # Listen again
-                with microphone as source:
-                    recognizer.adjust_for_ambient_noise(source)
-                    audio = recognizer.listen(source, timeout=5)
-                
-                room_name = recognizer.recognize_google(audio).lower()
-                print(f"You said: {room_name}")
-            
-            return room_name
-        except sr.UnknownValueError:
-            self.speak("Sorry, I couldn't understand that. Please try again.")
-            print("Sorry, I couldn't understand that.")
-            return self.ask_for_target_room()
-        except sr.RequestError:
-            self.speak("Sorry, I'm having trouble with the speech service. Please try again later.")
-            print("Sorry, I'm having trouble with the speech service.")
-            return self.ask_for_target_room()
+    def ask_for_target_room(self, cancelled=None) -> str:
+        """
+        Ask the user which room they want to go to, using voice input, until a known room is named.
+        Returns None if `cancelled()` becomes true in between.
+        """
+        prompt = "Please say the name of the room you want to go to."
+        while cancelled is None or not cancelled():
+            self.speak_and_wait(prompt)
+            log.info("Listening for room name...")
+            room_name = self.voice.listen(timeout=5)
+            if room_name is None:
+                prompt = "Sorry, I couldn't understand that. Please try again."
+                continue
+            log.info("You said: %s", room_name)
+            room = self.router.find_room(room_name)
+            if room is not None:
+                return room
+            prompt = "Invalid room name. Please try again."
+        return None
 
 # Main program logic
-def main():
-    # Initialize the classifier
-    classifier = RoomAndHazardClassifier()
-    
-    # Open the video capture
-    cap = cv2.VideoCapture(0)  # 0 for default camera
-    
-    if not cap.isOpened():
-        print("Error: Could not open camera.")
-        return
+def main(active=None, stopping=None, classifier=None, detector=None):
+    """
+    Run until 'q' is pressed or the feed ends. Under the supervisor the classifier comes
+    preloaded, `active` pauses and resumes the loop and `stopping` ends it.
+    """
+    if classifier is None:
+        # Subscribe to the shared inference service when it is running
+        detector = DetectionClient(INDOOR_WEIGHTS) if config.USE_INFERENCE_SERVICE else None
+
+        # Initialize the classifier
+        classifier = RoomAndHazardClassifier(detector)
     
-    # Ask user for target room via voice
-    target_room = classifier.ask_for_target_room()
+    if detector is not None:
+        capture = None
+        detector.start()
+    else:
+        # Capture on its own thread, so the frame we get is the newest even after a long voice prompt
+        capture = CaptureThread(config.CAMERA_SOURCES[0])
+        
+        if not capture.open():
+            log.error("Could not open camera.")
+            return
+        capture.start()
     
+    target_room = None
     current_room = None
+    paused = False
+    scheduler = KeyframeScheduler() if config.MOTION_GATING else None
+    frames_skipped = metrics.counter('frames_skipped')
+    capture_to_inference = metrics.histogram('capture_to_inference_seconds')
+    # Annotation and display run on their own thread at a capped rate, or not at all when headless
+    preview = Preview('Room and Hazard Classifier', port=config.PREVIEW_PORT + 1)
+    preview.start()
+    # What the models saw and what was said, for looking into missed or spurious alerts later
+    recorder = None
+    if config.TRACE_DIR:
+        recorder = TraceRecorder(trace_path('indoor'), 'indoor', classifier.names, list(classifier.room_rules))
+        recorder.start()
+    room_boxes = None
     
-    while True:
-        # Capture a frame from the camera
-        ret, frame = cap.read()
-        if not ret:
-            print("Error: Failed to capture frame.")
-            break
+    while stopping is None or not stopping.is_set():
+        if active is not None and not active.is_set():
+            if not paused:
+                # Just paused: keep the models and camera, stop listening and talking
+                paused = True
+                target_room = None
+                if detector is not None:
+                    detector.pause(True)
+                classifier.speaker.clear(PRIORITY_ALERT)
+                preview.close_windows()
+            time.sleep(0.1)
+            continue
         
-        # Process the frame
-        results = classifier.process_frame(frame)
+        if target_room is None:
+            if detector is not None and paused:
+                detector.pause(False)
+            paused = False
+            # Ask user for target room via voice
+            target_room = classifier.ask_for_target_room(
+                lambda: (stopping is not None and stopping.is_set()) or (active is not None and not active.is_set()))
+            current_room = None
+            if target_room is None:
+                continue
+            if classifier.room_belief.room is not None:
+                # Already know where we are: give directions now rather than on the next room change
+                current_room = classifier.room_belief.room
+                navigation = classifier.navigate_to_room(current_room, target_room)
+                log.info("Navigation from %s to %s: %s", current_room, target_room, navigation)
         
-        # Display results on the frame
-        room_type = results['room_type']
-        confidence = results['confidence']
-        cv2.putText(frame, f"Room: {room_type} ({confidence:.2f})", (10, 30),
-                    cv2.FONT_HERSHEY_SIMPLEX, 1, (0, 255, 0), 2)
+        if detector is not None:
+            # Take the newest frame and its detections from the inference service
+            item = detector.results.get(timeout=0.1)
+            if item is None:
+                if detector.results.closed:
+                    break
+                continue
+            if item[0].camera != 0:
+                continue  # rooms are recognized from the forward camera only
+            frame, boxes = item[0].image, item[1]
+        else:
+            # Take the newest frame from the camera
+            item = capture.frames.get(timeout=0.1)
+            if item is None:
+                if capture.frames.closed:
+                    log.error("Failed to capture frame.")
+                    break
+                continue
+            frame = item.image
+            capture_to_inference.observe(time.monotonic() - item.timestamp)
+            if scheduler is not None and not scheduler.should_infer(frame):
+                # Scene unchanged since the last keyframe, reuse its detections
+                frames_skipped.inc()
+                boxes = scheduler.propagate()
+            else:
+                boxes = classifier.detect_boxes(frame)
+                if scheduler is not None:
+                    scheduler.keyframe(frame, boxes)
         
-        for obj in results['detected_objects']:
-            class_name = obj['class']
-            conf = obj['confidence']
-            bbox = obj['bbox']
-            cv2.rectangle(frame, (bbox[0], bbox[1]), (bbox[2], bbox[3]), (255, 0, 0), 2)
-            cv2.putText(frame, f"{class_name} ({conf:.2f})", (bbox[0], bbox[1] - 10),
-                        cv2.FONT_HERSHEY_SIMPLEX, 0.5, (255, 0, 0), 2)
+        # Process the frame
+        now = time.monotonic()
+        results = classifier.process_frame(frame, boxes, now)
+        classifier.detections_per_frame.observe(len(results['detected_objects']))
         
-        # Update current room
-        if current_room != room_type:
-            current_room = room_type
-            print(f"Current room: {current_room}")
+        # Hand the frame and results to the preview, which draws them off this thread
+        preview.submit(0, frame, results['detected_objects'],
+                       f"Room: {results['room_type']} ({results['confidence']:.2f})")
         
-        # Provide navigation suggestion based on user input
-        if current_room:
+        # Provide navigation suggestion only when the smoothed room decision changes
+        if results['room_changed']:
+            current_room = results['room_changed']
+            log.info("Current room: %s", current_room)
             navigation = classifier.navigate_to_room(current_room, target_room)
-            print(f"Navigation from {current_room} to {target_room}: {navigation}")
+            log.info("Navigation from %s to %s: %s", current_room, target_room, navigation)
         
         # Give audio feedback for any detected hazards
-        classifier.give_audio_feedback(results['detected_objects'], frame.shape[0])
+        announced = classifier.give_audio_feedback(results['detected_objects'], frame.shape[0], now)
+        if recorder is not None:
+            if results['room_boxes'] is not None and results['room_boxes'] is not room_boxes:
+                # The room decision used new room model output; replay needs it to reproduce the decisions
+                room_boxes = results['room_boxes']
+                recorder.record(STREAM_ROOM, now, now, frame.shape, classifier.to_detections(room_boxes))
+            recorder.record(0, now, now, frame.shape, results['detected_objects'], announced, results['room_type'])
 
-        # Show the frame
-        cv2.imshow('Room and Hazard Classifier', frame)
-        
-        # Break the loop on 'q' key press
-        if cv2.waitKey(1) & 0xFF == ord('q'):
+        if capture is not None:
+            # Done with the image, the capture may reuse its buffer
+            item.release()
+
+        # Show a new preview frame if one is ready; break the loop on 'q' key press
+        if not preview.show(timeout=0):
             break
     
     # Release the capture and close windows
-    cap.release()
-    cv2.destroyAllWindows()
+    if detector is not None:
+        detector.stop()
+    else:
+        capture.stop()
+        log.info("Frames dropped by capture: %d", capture.dropped)
+        if classifier.room_detector is not None:
+            classifier.room_detector.stop()
+        log.info("Final model tier: %s @ %dpx", classifier.model.weights, classifier.model.imgsz)
+    classifier.speaker.stop()
+    log.info("Speech stats: %s", classifier.speaker.stats())
+    if scheduler is not None:
+        log.info("Keyframe ratio: %.2f", scheduler.keyframe_ratio())
+    preview.stop()
+    if recorder is not None:
+        recorder.stop()
+
+# Supervisor hooks: load everything up front, then run paused until activated
+_warm = {}
+
+def warm_up():
+    detector = DetectionClient(INDOOR_WEIGHTS) if config.USE_INFERENCE_SERVICE else None
+    _warm.update(detector=detector, classifier=RoomAndHazardClassifier(detector))
+
+def serve(active, stopping):
+    main(active, stopping, _warm['classifier'], _warm['detector'])
 
 if __name__ == "__main__":
+    setup_logging()
+    metrics.start_exporter()
     main()
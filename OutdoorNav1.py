@@ -1,19 +1,59 @@
-import requests
-import geocoder
-import speech_recognition as sr
-import pyttsx3
-import time
+import asyncio
+import logging
+import threading
 
-# Initialize the text-to-speech engine globally
-engine = pyttsx3.init()
+import config
+from location import LocationProvider
+from mapbox_client import MapboxClient
+from metrics import metrics, setup_logging
+from osm_router import OfflineRouter
+from route_follower import RouteFollower, parse_coords
+from speech import PRIORITY_INFO, PRIORITY_WARNING, SpeechService
+from voice import VoiceCommands
 
-def speak_text(text):
-    """Convert text to speech."""
-    try:
-        engine.say(text)
-        engine.runAndWait()
-    except RuntimeError:
-        print("Error: Text-to-speech engine is busy.")
+log = logging.getLogger("outdoor")
+
+# One keep-alive session and on-disk cache for every Mapbox lookup
+mapbox = MapboxClient()
+
+# Local pedestrian graph for routing without a connection
+offline_router = OfflineRouter(config.OSM_GRAPH) if config.OSM_GRAPH and config.ROUTING_ENGINE != 'mapbox' else None
+
+# Text-to-speech on its own thread, so speaking never blocks the event loop
+speech = SpeechService()
+
+# Spoken commands; anything after a navigation prefix is the new destination
+STOP_WORDS = ('stop', 'cancel')
+EXIT_WORDS = ('exit', 'quit')
+NAVIGATE_PREFIXES = ('navigate to ', 'take me to ', 'go to ')
+
+# Created on first use; with the on-device recognizer only saved places can be named as destinations
+voice = None
+
+# Set when main() ends, so the listening thread lets go of the microphone instead of finishing its window
+stop_listening = threading.Event()
+
+def voice_commands():
+    global voice
+    if voice is None:
+        places = list(config.SAVED_PLACES)
+        voice = VoiceCommands(STOP_WORDS + EXIT_WORDS + tuple(places) +
+                              tuple(prefix + place for prefix in NAVIGATE_PREFIXES for place in places))
+    return voice
+
+# Reads and smooths GPS fixes on its own thread from first use on, so a fix is ready before it is needed
+location = None
+
+def location_provider():
+    global location
+    if location is None:
+        location = LocationProvider()
+        location.start()
+    return location
+
+def speak_text(text, priority=PRIORITY_INFO):
+    """Queue text to be spoken without waiting for it."""
+    speech.say(text, priority, ttl=30.0)
 
 def meters_to_steps(distance_meters):
     """Convert meters to steps based on an average step length (0.762 meters per step)."""
@@ -21,110 +61,206 @@ def meters_to_steps(distance_meters):
     return int(distance_meters / step_length)
 
 def get_navigation_steps(origin_coords, destination_coords):
-    API_KEY = "sk.eyJ1Ijoia2VlMzMiLCJhIjoiY200bG03ZDJuMDNoMjJtc2NqeDdubHN1eiJ9.N2Vp8nb5VFjWdCk5K0_GPA"
-
-    MAPBOX_DIRECTIONS_URL = "https://api.mapbox.com/directions/v5/mapbox/walking"
-    url = f"{MAPBOX_DIRECTIONS_URL}/{origin_coords};{destination_coords}"
-    params = {
-        'access_token': API_KEY,
-        'geometries': 'geojson',
-        'overview': 'full',
-        'steps': 'true'
-    }
-
-    response = requests.get(url, params=params)
-
-    if response.status_code == 200:
-        data = response.json()
-        if 'routes' in data and data['routes']:
-            steps = data['routes'][0]['legs'][0]['steps']
-            return [(step['maneuver']['instruction'], step['distance']) for step in steps]
-        else:
-            print("Error: No routes found.")
-            return None
-    else:
-        print("HTTP Error:", response.status_code, response.text)
+    """Walking directions as (instruction, meters) tuples, from the cache when this trip was asked for before."""
+    route = get_directions(origin_coords, destination_coords)
+    return [tuple(step) for step in route['steps']] if route else None
+
+def get_current_coords(timeout=config.LOCATION_FALLBACK_AFTER + config.HTTP_READ_TIMEOUT):
+    """Current position as "longitude,latitude", waiting up to `timeout` seconds for a fix, or None."""
+    fix = location_provider().current(timeout)
+    return fix.coords if fix else None
+
+def get_directions(origin_coords, destination_coords):
+    """Route with its geometry from Mapbox, or from the offline graph when configured or when Mapbox fails."""
+    if offline_router is not None and config.ROUTING_ENGINE == 'offline':
+        return offline_router.directions(origin_coords, destination_coords)
+    route = mapbox.directions(origin_coords, destination_coords)
+    if route is None and offline_router is not None:
+        log.info("Mapbox unavailable, routing offline")
+        route = offline_router.directions(origin_coords, destination_coords)
+    return route
+
+def follow_route(origin_coords, destination_coords):
+    """Fetch a route with its geometry and wrap it in a follower, or None if there is no route."""
+    route = get_directions(origin_coords, destination_coords)
+    if not route or not route['steps']:
         return None
-def navigate(origin_coords,destination_address):
-            if destination_address:
-                # Convert destination address to coordinates
-                mapbox_api_key = "sk.eyJ1Ijoia2VlMzMiLCJhIjoiY200bG03ZDJuMDNoMjJtc2NqeDdubHN1eiJ9.N2Vp8nb5VFjWdCk5K0_GPA"
-                destination_coords = get_destination_coordinates(destination_address, mapbox_api_key)
-                
-                
-                
-                if destination_coords:
-                    speak_text("Fetching navigation steps...")
-                    steps = get_navigation_steps(origin_coords, destination_coords)
-                
-                    if steps:
-                        for instruction, distance in steps:
-                            distance_steps = meters_to_steps(distance)  # Convert meters to steps
-                            step_instruction = f"{instruction}. Walk {distance_steps} steps."
-                            print(step_instruction)
-                            speak_text(step_instruction)
-    
-                            # Simulate real-time delay (e.g., waiting until user completes this step)
-                            time.sleep(5)
-                            current_location = geocoder.ip('me')
-                            if current_location.ok:
-                                origin_coords = f"{current_location.latlng[1]},{current_location.latlng[0]}"
-                                # Adjust this delay as needed
-                                navigate(origin_coords,destination_address)
-                    
-                    
-                    
-                    else:
-                        speak_text("Failed to fetch navigation steps.")
-                else:
-                    speak_text("Could not find coordinates for the destination address.")
-            else:
-                speak_text("No destination address provided.")
-
-def get_destination_coordinates(destination_address, api_key):
-    MAPBOX_GEOCODING_URL = "https://api.mapbox.com/geocoding/v5/mapbox.places"
-    url = f"{MAPBOX_GEOCODING_URL}/{destination_address}.json"
-    params = {
-        'access_token': api_key
-    }
-    response = requests.get(url, params=params)
-    if response.status_code == 200:
-        data = response.json()
-        if 'features' in data and data['features']:
-            coordinates = data['features'][0]['geometry']['coordinates']
-            return f"{coordinates[0]},{coordinates[1]}"  # longitude,latitude
-        else:
-            print("Error: No matching location found.")
-            return None
-    else:
-        print("HTTP Error:", response.status_code, response.text)
+    return RouteFollower(route['coordinates'], route['steps'])
+
+def announce(follower):
+    """Speak every maneuver the wearer has reached since the last update."""
+    for instruction, distance in follower.due_steps():
+        distance_steps = meters_to_steps(distance)  # Convert meters to steps
+        step_instruction = f"{instruction}. Walk {distance_steps} steps."
+        log.info(step_instruction)
+        speak_text(step_instruction)
+
+async def call(function, *args, timeout=config.HTTP_READ_TIMEOUT):
+    """Run a blocking call on a worker thread; None if it doesn't finish within `timeout` seconds."""
+    try:
+        return await asyncio.wait_for(asyncio.to_thread(function, *args), timeout)
+    except asyncio.TimeoutError:
+        log.warning("%s timed out after %.0f s", function.__name__, timeout)
         return None
 
-def get_voice_input():
-    recognizer = sr.Recognizer()
-    with sr.Microphone() as source:
-        print("Listening for the destination address...")
-        try:
-            audio = recognizer.listen(source)
-            destination = recognizer.recognize_google(audio)
-            print(f"You said: {destination}")
-            return destination
-        except sr.UnknownValueError:
-            print("Sorry, I could not understand your voice.")
-            return None
-        except sr.RequestError as e:
-            print(f"Speech recognition error: {e}")
-            return None
+async def location_updates():
+    """Yield every new position from the location provider as it arrives, until it stops."""
+    provider = location_provider()
+    fixes = provider.subscribe()
+    try:
+        while True:
+            # Short waits, so cancelling the navigation doesn't wait for the next fix
+            fix = await asyncio.to_thread(fixes.get, 1.0)
+            if fix is not None:
+                yield fix.coords
+            elif fixes.closed:
+                return
+    finally:
+        provider.unsubscribe(fixes)
+
+async def navigate(destination_address):
+    if not destination_address:
+        speak_text("No destination address provided.")
+        return
+
+    # Geocode the destination and find where we are at the same time
+    speak_text("Fetching navigation steps...")
+    destination_coords, origin_coords = await asyncio.gather(
+        call(get_destination_coordinates, destination_address), call(get_current_coords, timeout=None))
+    if not destination_coords:
+        speak_text("Could not find coordinates for the destination address.")
+        return
+    if not origin_coords:
+        speak_text("Error: Unable to fetch current location.")
+        return
+
+    follower = await call(follow_route, origin_coords, destination_coords)
+    if follower is None:
+        speak_text("Failed to fetch navigation steps.")
+        return
+
+    # Follow the route locally; only go back to the network when drifting off it
+    announce(follower)
+    reroute = None
+    try:
+        async for current_coords in location_updates():
+            progress = follower.update(*parse_coords(current_coords))
+            if progress.arrived:
+                speak_text("You have arrived at your destination.")
+                return
+            if progress.deviation > follower.off_route_distance / 2 and reroute is None:
+                # Drifting away: start fetching a route from here before it is needed
+                reroute = asyncio.create_task(call(follow_route, current_coords, destination_coords))
+            if progress.off_route:
+                log.info("Off route by %.0f m, switching to a new route", progress.deviation)
+                speak_text("Recalculating route.", PRIORITY_WARNING)
+                if reroute is None:
+                    reroute = asyncio.create_task(call(follow_route, current_coords, destination_coords))
+                rerouted = await reroute
+                reroute = None
+                if rerouted is None:
+                    speak_text("Failed to fetch navigation steps.")
+                    continue
+                follower = rerouted
+            elif reroute is not None and progress.deviation < follower.off_route_distance / 4:
+                # Back on the route, the prefetched one is not needed
+                reroute.cancel()
+                reroute = None
+            announce(follower)
+    finally:
+        if reroute is not None:
+            reroute.cancel()
+
+def get_destination_coordinates(destination_address):
+    """Geocode an address or saved place to "longitude,latitude", from the cache when it was looked up before."""
+    return mapbox.geocode(config.SAVED_PLACES.get(destination_address, destination_address))
+
+async def listen_for_commands(commands):
+    """Put every recognized phrase on `commands`, listening in short windows so the task can be cancelled."""
+    listener = voice_commands()
+    while True:
+        # Listen only while nothing is being said, or the app's own prompts come back as commands
+        if not await asyncio.to_thread(speech.wait_until_idle, 0.5):
+            continue
+        spoken = speech.spoken
+        phrase = await asyncio.to_thread(listener.listen, 3, 8, stop_listening.is_set)
+        if phrase and (speech.spoken != spoken or not speech.is_idle()):
+            log.info("Ignoring %r, heard while speaking", phrase)
+            continue
+        if phrase:
+            log.info("You said: %s (decided in %.0f ms)", phrase, listener.latency * 1000)
+            await commands.put(phrase)
+
+async def main():
+    if not speech.is_alive():
+        speech.start()
+    commands = asyncio.Queue()
+    stop_listening.clear()
+    listener = asyncio.create_task(listen_for_commands(commands))
+    navigation = None
+    speak_text("Where would you like to go?")
+    try:
+        while True:
+            command = await commands.get()
+            if command in EXIT_WORDS:
+                break
+            if command in STOP_WORDS:
+                if navigation is not None:
+                    navigation.cancel()
+                    speech.clear()
+                    speak_text("Navigation stopped.")
+                continue
+            destination = next((command[len(prefix):] for prefix in NAVIGATE_PREFIXES
+                                if command.startswith(prefix)), None)
+            if destination is None:
+                if navigation is not None and not navigation.done():
+                    continue  # chatter while walking, not a command
+                destination = command
+            # A new destination replaces the route in progress
+            if navigation is not None:
+                navigation.cancel()
+                speech.clear()
+            navigation = asyncio.create_task(navigate(destination))
+    finally:
+        # Wind down the worker threads too, asyncio.run() would otherwise wait for them on exit
+        stop_listening.set()
+        listener.cancel()
+        tasks = [listener]
+        if navigation is not None:
+            navigation.cancel()
+            tasks.append(navigation)
+        await asyncio.gather(*tasks, return_exceptions=True)
+
+# Supervisor hooks: everything is loaded at import, run main() only while active
+def warm_up():
+    speech.start()
+    voice_commands()
+    location_provider()
+
+async def run_while_active(active, stopping):
+    task = asyncio.create_task(main())
+    while not task.done():
+        if stopping.is_set() or not active.is_set():
+            stop_listening.set()
+            task.cancel()
+            speech.clear()
+            break
+        await asyncio.sleep(0.1)
+    await asyncio.gather(task, return_exceptions=True)
+
+def serve(active, stopping):
+    while not stopping.is_set():
+        if active.wait(timeout=0.1):
+            asyncio.run(run_while_active(active, stopping))
+    if location is not None:
+        location.stop()
+    speech.stop()
 
 if __name__ == "__main__":
-    # Fetch current location
-    current_location = geocoder.ip('me')
-    if current_location.ok:
-        origin_coords = f"{current_location.latlng[1]},{current_location.latlng[0]}"  # longitude,latitude
-
-        # Get destination address from user's voice input
-        destination_address = get_voice_input()
-        navigate(origin_coords,destination_address)
-        
-    else:
-        speak_text("Error: Unable to fetch current location. Check your internet connection.")
\ No newline at end of file
+    setup_logging()
+    metrics.start_exporter()
+    asyncio.run(main())
+    speech.wait_until_idle(timeout=5.0)
+    if location is not None:
+        location.stop()
+    speech.stop()
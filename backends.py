@@ -0,0 +1,255 @@
+"""
+CPU inference backends for the YOLO models.
+
+load_model() is what every detector calls instead of YOLO(weights). With
+INFERENCE_BACKEND = 'torch' it is exactly that. With 'onnx' or 'openvino'
+the weights are exported once (dynamic input size, so every rung of the
+ModelManager ladder can use the same file), and the exported model is
+loaded through ultralytics, which returns the same Results objects, so
+`results[0].boxes.data` and everything downstream stay unchanged.
+
+With INT8 on, the export is quantized after training with frames from
+CALIBRATION_DATA (a video or a directory of images): OpenVINO through
+ultralytics' own int8 export, ONNX through ONNX Runtime static
+quantization.
+
+    python backends.py export yolov8n.pt --backend openvino --int8 --calibration walk.mp4
+    python backends.py compare walk.mp4 --weights yolov8n.pt --backends torch onnx openvino --int8
+"""
+import argparse
+import json
+import logging
+import multiprocessing
+import os
+import sys
+import tempfile
+import time
+
+import cv2
+import numpy as np
+import psutil
+
+import config
+from tracker import match_detections
+
+log = logging.getLogger(__name__)
+
+BACKENDS = ('torch', 'onnx', 'openvino')
+
+
+def export_path(weights: str, backend: str, int8: bool = False) -> str:
+    """Where the exported model lives, next to the weights and named the way ultralytics names it"""
+    stem = os.path.splitext(weights)[0]
+    if backend == 'onnx':
+        return f"{stem}_int8.onnx" if int8 else f"{stem}.onnx"
+    if backend == 'openvino':
+        return f"{stem}_int8_openvino_model" if int8 else f"{stem}_openvino_model"
+    return weights
+
+
+def calibration_frames(source: str, count: int = config.CALIBRATION_FRAMES):
+    """Up to `count` frames spread evenly over a video file or a directory of images"""
+    if os.path.isdir(source):
+        files = sorted(f for f in os.listdir(source) if f.lower().endswith(('.jpg', '.jpeg', '.png', '.bmp')))
+        for name in files[::max(len(files) // count, 1)][:count]:
+            yield cv2.imread(os.path.join(source, name))
+        return
+    cap = cv2.VideoCapture(source)
+    total = int(cap.get(cv2.CAP_PROP_FRAME_COUNT)) or count
+    stride = max(total // count, 1)
+    index = 0
+    yielded = 0
+    while yielded < count:
+        ret, frame = cap.read()
+        if not ret:
+            break
+        if index % stride == 0:
+            yield frame
+            yielded += 1
+        index += 1
+    cap.release()
+
+
+def letterbox(image: np.ndarray, size: int) -> np.ndarray:
+    """Resize keeping the aspect ratio and pad to size x size, as a 1x3xHxW float tensor in [0, 1]"""
+    h, w = image.shape[:2]
+    scale = size / max(h, w)
+    resized = cv2.resize(image, (round(w * scale), round(h * scale)), interpolation=cv2.INTER_LINEAR)
+    canvas = np.full((size, size, 3), 114, dtype=np.uint8)
+    top, left = (size - resized.shape[0]) // 2, (size - resized.shape[1]) // 2
+    canvas[top:top + resized.shape[0], left:left + resized.shape[1]] = resized
+    return (canvas[:, :, ::-1].transpose(2, 0, 1)[None] / 255.0).astype(np.float32)
+
+
+def _calibration_dataset(source: str, names, directory: str) -> str:
+    """Write calibration frames and a dataset yaml for ultralytics' int8 export"""
+    images = os.path.join(directory, 'images')
+    os.makedirs(images, exist_ok=True)
+    for i, frame in enumerate(calibration_frames(source)):
+        cv2.imwrite(os.path.join(images, f"{i:05d}.jpg"), frame)
+    yaml_path = os.path.join(directory, 'calibration.yaml')
+    with open(yaml_path, 'w') as f:
+        f.write(f"path: {directory}\ntrain: images\nval: images\nnames:\n")
+        for class_id, name in dict(names).items():
+            f.write(f"  {class_id}: {json.dumps(name)}\n")
+    return yaml_path
+
+
+def _quantize_onnx(fp32_path: str, int8_path: str, source: str, imgsz: int):
+    from onnxruntime import InferenceSession
+    from onnxruntime.quantization import CalibrationDataReader, QuantFormat, QuantType, quantize_static
+
+    input_name = InferenceSession(fp32_path, providers=['CPUExecutionProvider']).get_inputs()[0].name
+
+    class FrameReader(CalibrationDataReader):
+        def __init__(self):
+            self.frames = calibration_frames(source)
+
+        def get_next(self):
+            frame = next(self.frames, None)
+            return None if frame is None else {input_name: letterbox(frame, imgsz)}
+
+    quantize_static(fp32_path, int8_path, FrameReader(), quant_format=QuantFormat.QDQ,
+                    activation_type=QuantType.QUInt8, weight_type=QuantType.QInt8)
+
+
+def export(weights: str, backend: str = config.INFERENCE_BACKEND, int8: bool = config.INT8,
+           calibration: str = config.CALIBRATION_DATA, imgsz: int = 640) -> str:
+    """Export `weights` for `backend` unless that was already done; returns the model path"""
+    path = export_path(weights, backend, int8)
+    if backend == 'torch' or os.path.exists(path):
+        return path
+    if int8 and not calibration:
+        raise ValueError("INT8 export needs CALIBRATION_DATA (a video or a directory of frames)")
+
+    from ultralytics import YOLO
+    model = YOLO(weights)
+    log.info("Exporting %s to %s%s", weights, backend, " (INT8)" if int8 else "")
+    if backend == 'onnx':
+        fp32_path = model.export(format='onnx', dynamic=True, imgsz=imgsz)
+        if int8:
+            _quantize_onnx(fp32_path, path, calibration, imgsz)
+    elif backend == 'openvino':
+        with tempfile.TemporaryDirectory() as directory:
+            data = _calibration_dataset(calibration, model.names, directory) if int8 else None
+            model.export(format='openvino', dynamic=True, imgsz=imgsz, int8=int8, data=data)
+    else:
+        raise ValueError(f"Unknown inference backend {backend!r}, expected one of {BACKENDS}")
+    return path
+
+
+def load_model(weights: str, backend: str = config.INFERENCE_BACKEND, int8: bool = config.INT8):
+    """A YOLO model for `weights` running on `backend`, exporting it first if needed"""
+    from ultralytics import YOLO
+    if backend == 'torch':
+        return YOLO(weights)
+    return YOLO(export(weights, backend, int8), task='detect')
+
+
+def _run_backend(weights, backend, int8, source, limit, imgsz, queue):
+    # Each backend runs in its own process so its memory is measured on its own
+    from benchmark import FrameReader
+    process = psutil.Process()
+    baseline = process.memory_info().rss
+    started = time.perf_counter()
+    model = load_model(weights, backend, int8)
+    load_seconds = time.perf_counter() - started
+    reader = FrameReader(source, limit)
+    outputs, timings = [], []
+    peak = process.memory_info().rss
+    while True:
+        image = reader.read()
+        if image is None:
+            break
+        start = time.perf_counter()
+        results = model.predict(image, imgsz=imgsz, verbose=False)
+        timings.append(time.perf_counter() - start)
+        outputs.append(results[0].boxes.data.cpu().numpy())
+        peak = max(peak, process.memory_info().rss)
+    reader.close()
+    queue.put((outputs, timings, load_seconds, (peak - baseline) / (1024 * 1024)))
+
+
+def compare(source: str, weights: str, backends, int8: bool = False, limit: int = None,
+            imgsz: int = 640) -> list:
+    """
+    Run each backend over the same frames and report latency, memory and agreement
+    with the PyTorch model's detections (matched by class at IoU >= 0.5)
+    """
+    from benchmark import summarize
+    context = multiprocessing.get_context('spawn')
+    runs = []
+    for backend in ('torch',) + tuple(b for b in backends if b != 'torch'):
+        for quantized in ((False, True) if int8 and backend != 'torch' else (False,)):
+            queue = context.Queue()
+            worker = context.Process(target=_run_backend,
+                                     args=(weights, backend, quantized, source, limit, imgsz, queue))
+            worker.start()
+            outputs, timings, load_seconds, memory = queue.get()
+            worker.join()
+            runs.append((backend, quantized, outputs, timings, load_seconds, memory))
+
+    reference, reference_timings = runs[0][2], runs[0][3]
+    reports = []
+    for backend, quantized, outputs, timings, load_seconds, memory in runs:
+        matched = iou_total = detected = expected = 0
+        for ref, boxes in zip(reference, outputs):
+            m, total = match_detections(ref, boxes)
+            matched += m
+            iou_total += total
+            detected += len(boxes)
+            expected += len(ref)
+        reports.append({
+            'backend': backend,
+            'int8': quantized,
+            'frames': len(timings),
+            'latency': summarize(timings),
+            'speedup': float(np.median(reference_timings) / np.median(timings)) if timings else 0.0,
+            'load_seconds': load_seconds,
+            'memory_mb': memory,
+            'recall_vs_torch': matched / expected if expected else 1.0,
+            'precision_vs_torch': matched / detected if detected else 1.0,
+            'mean_iou': iou_total / matched if matched else 0.0,
+        })
+    return reports
+
+
+def main():
+    parser = argparse.ArgumentParser(description=__doc__, formatter_class=argparse.RawDescriptionHelpFormatter)
+    commands = parser.add_subparsers(dest='command', required=True)
+
+    export_parser = commands.add_parser('export', help="export weights for a backend")
+    export_parser.add_argument('weights')
+    export_parser.add_argument('--backend', choices=BACKENDS[1:], default='onnx')
+    export_parser.add_argument('--int8', action='store_true')
+    export_parser.add_argument('--calibration', default=config.CALIBRATION_DATA,
+                               help="video or directory of frames for INT8 calibration")
+    export_parser.add_argument('--imgsz', type=int, default=640)
+
+    compare_parser = commands.add_parser('compare', help="compare backends on recorded frames")
+    compare_parser.add_argument('source', help="video file or directory of images")
+    compare_parser.add_argument('--weights', default='yolov8n.pt')
+    compare_parser.add_argument('--backends', nargs='+', choices=BACKENDS, default=list(BACKENDS))
+    compare_parser.add_argument('--int8', action='store_true', help="also compare INT8 exports")
+    compare_parser.add_argument('--calibration', help="calibration frames, defaults to the source")
+    compare_parser.add_argument('--limit', type=int, help="stop after this many frames")
+    compare_parser.add_argument('--imgsz', type=int, default=640)
+    args = parser.parse_args()
+
+    logging.basicConfig(level=logging.INFO)
+    if args.command == 'export':
+        print(export(args.weights, args.backend, args.int8, args.calibration, args.imgsz))
+        return
+
+    if args.int8:
+        # Export up front so calibration isn't timed and the worker processes find the files
+        for backend in args.backends:
+            if backend != 'torch':
+                export(args.weights, backend, True, args.calibration or args.source, args.imgsz)
+    json.dump(compare(args.source, args.weights, args.backends, args.int8, args.limit, args.imgsz),
+              sys.stdout, indent=2)
+    print()
+
+
+if __name__ == "__main__":
+    main()
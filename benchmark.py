@@ -0,0 +1,358 @@
+"""
+Headless, replayable benchmark for the hazard and indoor pipelines.
+
+Feeds a recorded video file or a directory of images through the same
+inference, post-processing and feedback code the live scripts use, with
+speech replaced by a recorder. Reports per-stage latency percentiles,
+end-to-end FPS and peak RSS as JSON, one entry per model tier.
+
+    python benchmark.py walk.mp4 --mode hazard --tiers yolov8n.pt@320 yolov8n.pt@640 yolov8s.pt@640
+    python benchmark.py walk.mp4 --output new.json --baseline old.json
+    python benchmark.py walk.mp4 --roi --check-recall
+    python benchmark.py walk.mp4 --render inline
+
+--render measures what drawing costs: 'inline' annotates and JPEG-encodes
+every frame on the loop, as the scripts used to before every imshow;
+'preview' hands frames to the rate-limited preview thread instead.
+"""
+import argparse
+import contextlib
+import json
+import os
+import sys
+import time
+
+import cv2
+import numpy as np
+import psutil
+
+import config
+from detections import HAZARD_NONE, DetectionBatch
+from model_manager import ModelManager
+from motion import KeyframeScheduler
+from preview import Preview, draw_detections
+from roi import CorridorPlanner
+from speech import PRIORITY_INFO
+from tracker import match_detections
+
+STAGES = ('decode', 'inference', 'postprocess', 'feedback', 'render')
+RENDER_MODES = ('none', 'inline', 'preview')
+IMAGE_EXTENSIONS = ('.jpg', '.jpeg', '.png', '.bmp')
+
+
+class RecordingSpeech:
+    """Stands in for SpeechService and records what would have been said"""
+
+    def __init__(self):
+        self.messages = []
+
+    def say(self, message: str, priority: int = PRIORITY_INFO, ttl: float = 2.0):
+        self.messages.append((message, priority))
+
+    def prepare(self, messages):
+        pass
+
+    def clear(self, priority: int = PRIORITY_INFO):
+        pass
+
+    def start(self):
+        pass
+
+    def stop(self):
+        pass
+
+    def wait_until_idle(self, timeout: float = None) -> bool:
+        return True
+
+    def stats(self) -> dict:
+        return {'spoken': len(self.messages)}
+
+
+class FrameReader:
+    """Frames from a video file or a directory of images, with their timestamps in seconds"""
+
+    def __init__(self, path: str, limit: int = None):
+        self.path = path
+        self.limit = limit
+        if os.path.isdir(path):
+            files = sorted(f for f in os.listdir(path) if f.lower().endswith(IMAGE_EXTENSIONS))
+            self.files = [os.path.join(path, f) for f in files]
+            self.cap = None
+            self.fps = 30.0
+        else:
+            self.files = None
+            self.cap = cv2.VideoCapture(path)
+            if not self.cap.isOpened():
+                raise SystemExit(f"Error: Unable to open {path}")
+            self.fps = self.cap.get(cv2.CAP_PROP_FPS) or 30.0
+        self.index = 0
+
+    def read(self):
+        if self.limit is not None and self.index >= self.limit:
+            return None
+        if self.files is not None:
+            if self.index >= len(self.files):
+                return None
+            frame = cv2.imread(self.files[self.index])
+        else:
+            ret, frame = self.cap.read()
+            if not ret:
+                return None
+        self.index += 1
+        return frame
+
+    @property
+    def timestamp(self) -> float:
+        return self.index / self.fps
+
+    def close(self):
+        if self.cap is not None:
+            self.cap.release()
+
+
+def fixed_model(weights: str, imgsz: int) -> ModelManager:
+    # A one-rung ladder with no latency target never switches tiers
+    return ModelManager(weights, ladder=[(weights, imgsz)], target_latency=0)
+
+
+class HazardBenchmark:
+    def __init__(self, weights: str, imgsz: int, motion_gating: bool, roi: bool = False,
+                 check_recall: bool = False):
+        import Hazard
+        self.hazard = Hazard
+        Hazard.load_model(weights, ladder=[(weights, imgsz)], target_latency=0)
+        Hazard.speech = RecordingSpeech()
+        Hazard.trackers = {}
+        self.speech = Hazard.speech
+        self.scheduler = KeyframeScheduler() if motion_gating else None
+        self.planner = CorridorPlanner() if roi else None
+        self.check_recall = check_recall
+        self.input_pixels = []  # model input area per inference, relative to the full input size
+        self.hazards_expected = 0
+        self.hazards_found = 0
+
+    def hazards(self, boxes, frame_height: int) -> np.ndarray:
+        detections = self.hazard.filter_detections(DetectionBatch.from_array(boxes, self.hazard.class_names))
+        levels = detections.hazard_levels(frame_height, min_confidence=80)
+        return detections.rows()[levels != HAZARD_NONE], detections, levels
+
+    def process(self, image, now: float, timings: dict):
+        start = time.perf_counter()
+        model = self.hazard.model
+        inferred_now = False
+        if self.scheduler is not None and not self.scheduler.should_infer(image, now):
+            boxes = self.scheduler.propagate()
+        else:
+            plan = self.planner.plan(image.shape, now) if self.planner is not None else None
+            if plan is not None and plan.crop is not None:
+                results = model.predict(plan.apply(image), imgsz=plan.imgsz, verbose=False)
+                boxes = plan.to_frame(results[0].boxes.data.cpu().numpy())
+                self.input_pixels.append((min(plan.imgsz, model.imgsz) / model.imgsz) ** 2)
+            else:
+                results = model.predict(image, verbose=False)
+                boxes = results[0].boxes.data.cpu().numpy()
+                self.input_pixels.append(1.0)
+            inferred_now = True
+            if self.scheduler is not None:
+                self.scheduler.keyframe(image, boxes, now)
+        inferred = time.perf_counter()
+        hazards, detections, levels = self.hazards(boxes, image.shape[0])
+        if self.planner is not None and inferred_now:
+            self.planner.observe(detections.boxes, levels)
+        processed = time.perf_counter()
+        if self.check_recall:
+            # Hazards a full-frame pass finds, and how many of them this configuration also found
+            reference = model.predict(image, verbose=False)[0].boxes.data.cpu().numpy()
+            expected = self.hazards(reference, image.shape[0])[0]
+            self.hazards_expected += len(expected)
+            self.hazards_found += match_detections(expected, hazards)[0]
+        feedback_start = time.perf_counter()
+        self.hazard.give_audio_feedback(detections, image.shape[0])
+        done = time.perf_counter()
+
+        timings['inference'].append(inferred - start)
+        timings['postprocess'].append(processed - inferred)
+        timings['feedback'].append(done - feedback_start)
+        return detections, None
+
+    def extra(self) -> dict:
+        report = {'relative_input_pixels': float(np.mean(self.input_pixels)) if self.input_pixels else 1.0}
+        if self.check_recall:
+            report['close_hazard_recall'] = (self.hazards_found / self.hazards_expected
+                                             if self.hazards_expected else 1.0)
+        return report
+
+
+class IndoorBenchmark:
+    def __init__(self, weights: str, imgsz: int, motion_gating: bool, target_room: str):
+        from IndoorIntegrated import RoomAndHazardClassifier
+        self.speech = RecordingSpeech()
+        # No background room model, so every stage is measured in line
+        self.classifier = RoomAndHazardClassifier(speaker=self.speech, model=fixed_model(weights, imgsz),
+                                                  room_weights=None)
+        self.target_room = target_room
+        self.scheduler = KeyframeScheduler() if motion_gating else None
+
+    def process(self, image, now: float, timings: dict):
+        start = time.perf_counter()
+        if self.scheduler is not None and not self.scheduler.should_infer(image, now):
+            boxes = self.scheduler.propagate()
+        else:
+            boxes = self.classifier.detect_boxes(image)
+            if self.scheduler is not None:
+                self.scheduler.keyframe(image, boxes, now)
+        inferred = time.perf_counter()
+        results = self.classifier.process_frame(image, boxes)
+        processed = time.perf_counter()
+        if results['room_changed']:
+            self.classifier.navigate_to_room(results['room_changed'], self.target_room)
+        self.classifier.give_audio_feedback(results['detected_objects'], image.shape[0])
+        done = time.perf_counter()
+
+        timings['inference'].append(inferred - start)
+        timings['postprocess'].append(processed - inferred)
+        timings['feedback'].append(done - processed)
+        return results['detected_objects'], f"Room: {results['room_type']} ({results['confidence']:.2f})"
+
+
+def summarize(samples) -> dict:
+    values = np.asarray(samples) * 1000.0
+    if not len(values):
+        return {}
+    p50, p95, p99 = np.percentile(values, [50, 95, 99])
+    return {'mean_ms': float(values.mean()), 'p50_ms': float(p50), 'p95_ms': float(p95),
+            'p99_ms': float(p99), 'max_ms': float(values.max())}
+
+
+def run(path: str, mode: str, weights: str, imgsz: int, motion_gating: bool,
+        limit: int = None, target_room: str = 'kitchen', roi: bool = False, check_recall: bool = False,
+        render: str = 'none') -> dict:
+    if mode == 'hazard':
+        bench = HazardBenchmark(weights, imgsz, motion_gating, roi, check_recall)
+    else:
+        bench = IndoorBenchmark(weights, imgsz, motion_gating, target_room)
+
+    process = psutil.Process()
+    reader = FrameReader(path, limit)
+    timings = {stage: [] for stage in STAGES}
+    end_to_end = []
+    peak_rss = process.memory_info().rss
+    # The MJPEG preview renders and encodes like the live one; port 0 picks any free port
+    preview = Preview('benchmark', mode='mjpeg', port=0) if render == 'preview' else None
+    if preview is not None:
+        preview.start()
+
+    started = time.perf_counter()
+    while True:
+        frame_start = time.perf_counter()
+        image = reader.read()
+        if image is None:
+            break
+        timings['decode'].append(time.perf_counter() - frame_start)
+        detections, label = bench.process(image, reader.timestamp, timings)
+        render_start = time.perf_counter()
+        if render == 'inline':
+            cv2.imencode('.jpg', draw_detections(image.copy(), detections, label))
+        elif preview is not None:
+            preview.submit(0, image, detections, label)
+        timings['render'].append(time.perf_counter() - render_start)
+        end_to_end.append(time.perf_counter() - frame_start)
+        if reader.index % 10 == 0:
+            peak_rss = max(peak_rss, process.memory_info().rss)
+    elapsed = time.perf_counter() - started
+    reader.close()
+    if preview is not None:
+        preview.stop()
+    peak_rss = max(peak_rss, process.memory_info().rss)
+
+    frames = len(end_to_end)
+    report = {
+        'mode': mode,
+        'weights': weights,
+        'imgsz': imgsz,
+        'motion_gating': motion_gating,
+        'roi': roi,
+        'render': render,
+        'frames': frames,
+        'fps': frames / elapsed if elapsed > 0 else 0.0,
+        'peak_rss_mb': peak_rss / (1024 * 1024),
+        'announcements': len(bench.speech.messages),
+        'keyframe_ratio': bench.scheduler.keyframe_ratio() if bench.scheduler is not None else 1.0,
+        'stages': {stage: summarize(samples) for stage, samples in timings.items()},
+        'end_to_end': summarize(end_to_end),
+    }
+    if hasattr(bench, 'extra'):
+        report.update(bench.extra())
+    return report
+
+
+def find_regressions(reports, baseline, tolerance: float):
+    """Configurations whose p95 end-to-end latency grew by more than `tolerance` over the baseline"""
+    def key(report):
+        return (report['mode'], report['weights'], report['imgsz'], report['motion_gating'], report.get('roi', False),
+                report.get('render', 'none'))
+
+    previous = {key(report): report for report in baseline}
+    regressions = []
+    for report in reports:
+        old = previous.get(key(report))
+        if old is None:
+            continue
+        before, after = old['end_to_end']['p95_ms'], report['end_to_end']['p95_ms']
+        if after > before * (1 + tolerance):
+            regressions.append(f"{report['weights']}@{report['imgsz']}: p95 {before:.1f} -> {after:.1f} ms")
+    return regressions
+
+
+def parse_tier(tier: str):
+    weights, _, imgsz = tier.partition('@')
+    return weights, int(imgsz or 640)
+
+
+def main():
+    parser = argparse.ArgumentParser(description=__doc__, formatter_class=argparse.RawDescriptionHelpFormatter)
+    parser.add_argument('source', help="video file or directory of images")
+    parser.add_argument('--mode', choices=('hazard', 'indoor'), default='hazard')
+    parser.add_argument('--tiers', nargs='+', default=['yolov8n.pt@640'], help="weights@imgsz to compare")
+    parser.add_argument('--no-motion-gating', action='store_true')
+    parser.add_argument('--limit', type=int, help="stop after this many frames")
+    parser.add_argument('--roi', action='store_true', help="hazard mode: crop to the walking corridor")
+    parser.add_argument('--check-recall', action='store_true',
+                        help="hazard mode: also run full frames and report recall of close hazards")
+    parser.add_argument('--render', choices=RENDER_MODES, default='none',
+                        help="also draw the detections: on the loop (inline) or on the preview thread")
+    parser.add_argument('--target-room', default='kitchen', help="indoor mode navigation target")
+    parser.add_argument('--output', help="write the JSON report here instead of stdout")
+    parser.add_argument('--baseline', help="earlier JSON report to check for regressions")
+    parser.add_argument('--tolerance', type=float, default=0.1, help="allowed p95 growth over the baseline")
+    args = parser.parse_args()
+
+    # Always run the models in-process
+    config.USE_INFERENCE_SERVICE = False
+
+    reports = []
+    for tier in args.tiers:
+        weights, imgsz = parse_tier(tier)
+        # Keep the pipelines' own prints out of the JSON on stdout
+        with contextlib.redirect_stdout(sys.stderr):
+            reports.append(run(args.source, args.mode, weights, imgsz, not args.no_motion_gating,
+                               args.limit, args.target_room, args.roi, args.check_recall, args.render))
+
+    report_json = json.dumps(reports, indent=2)
+    if args.output:
+        with open(args.output, 'w') as f:
+            f.write(report_json)
+    else:
+        print(report_json)
+
+    if args.baseline:
+        with open(args.baseline) as f:
+            regressions = find_regressions(reports, json.load(f), args.tolerance)
+        for regression in regressions:
+            print(f"Regression: {regression}", file=sys.stderr)
+        if regressions:
+            sys.exit(1)
+
+
+if __name__ == "__main__":
+    main()
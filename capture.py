@@ -0,0 +1,255 @@
+"""
+Camera capture running on its own thread so slow consumers never stall reading.
+
+Frames are decoded into a small pool of preallocated buffers. Each frame
+holds a lease on its buffer, and the buffer is reused only after the frame
+is released, by whichever stage handled it last or by the queue that
+dropped it. Steady-state capture allocates nothing, and a frame that is
+never released just keeps its buffer out of the pool. On live sources each read first grabs past any frames
+queued up in the driver, and only the newest is decoded. The camera is
+asked for the resolution, pixel format and rate the models need
+(CAPTURE_WIDTH, CAPTURE_HEIGHT, CAPTURE_FOURCC, CAPTURE_FPS) rather than
+its largest mode. Frames grabbed past or replaced before anyone took them
+are counted in `dropped`.
+
+MultiCapture runs one such thread per camera and groups frames captured
+within BATCH_WINDOW of each other, so several cameras can share one batched
+forward pass.
+"""
+import logging
+import threading
+import time
+from typing import Optional
+
+import cv2
+import numpy as np
+
+import config
+from metrics import metrics
+from pipeline import Frame, LatestQueue
+
+log = logging.getLogger(__name__)
+
+
+class Lease:
+    """One pool buffer in use; release() returns it, and only the first call counts"""
+
+    def __init__(self, pool: 'FramePool', slot: int, generation: int):
+        self.buffer = pool._buffers[slot]
+        self._pool = pool
+        self._slot = slot
+        self._generation = generation
+        self._released = False
+
+    def release(self):
+        with self._pool._lock:
+            if self._released:
+                return
+            self._released = True
+            # Buffers from before a resolution change are simply dropped
+            if self._generation == self._pool._generation:
+                self._pool._free.append(self._slot)
+
+
+class FramePool:
+    """Image buffers handed out by acquire() and reused only once their lease is released"""
+
+    def __init__(self, size: int = config.FRAME_POOL_SIZE):
+        self.size = size
+        self._buffers = []
+        self._free = []  # slots released and ready for reuse
+        self._generation = 0
+        self._lock = threading.Lock()
+        self.allocations = 0
+        self.misses = 0  # every buffer was in use
+
+    def acquire(self, shape, dtype=np.uint8) -> Optional[Lease]:
+        with self._lock:
+            if self._buffers and self._buffers[0].shape != shape:
+                # The source changed resolution
+                self._buffers, self._free = [], []
+                self._generation += 1
+            if self._free:
+                slot = self._free.pop()
+            elif len(self._buffers) < self.size:
+                self._buffers.append(np.empty(shape, dtype=dtype))
+                self.allocations += 1
+                slot = len(self._buffers) - 1
+            else:
+                self.misses += 1
+                return None
+            return Lease(self, slot, self._generation)
+
+
+def is_live(source) -> bool:
+    """Cameras and network streams keep producing frames; files can be read as fast as we like"""
+    return isinstance(source, int) or str(source).startswith(('rtsp://', 'rtmp://', 'http://', 'https://'))
+
+
+def negotiate(cap, width: int = config.CAPTURE_WIDTH, height: int = config.CAPTURE_HEIGHT,
+              fps: float = config.CAPTURE_FPS, fourcc: str = config.CAPTURE_FOURCC) -> dict:
+    """Ask the camera for the mode the models use and return what it actually gave; 0 or '' leaves a setting alone"""
+    if fourcc:
+        cap.set(cv2.CAP_PROP_FOURCC, cv2.VideoWriter_fourcc(*fourcc))
+    if width and height:
+        cap.set(cv2.CAP_PROP_FRAME_WIDTH, width)
+        cap.set(cv2.CAP_PROP_FRAME_HEIGHT, height)
+    if fps:
+        cap.set(cv2.CAP_PROP_FPS, fps)
+    # Keep the driver's queue short so frames don't age in it
+    cap.set(cv2.CAP_PROP_BUFFERSIZE, 1)
+    code = int(cap.get(cv2.CAP_PROP_FOURCC))
+    return {
+        'width': int(cap.get(cv2.CAP_PROP_FRAME_WIDTH)),
+        'height': int(cap.get(cv2.CAP_PROP_FRAME_HEIGHT)),
+        'fps': cap.get(cv2.CAP_PROP_FPS),
+        'fourcc': ''.join(chr((code >> 8 * i) & 0xFF) for i in range(4)) if code else '',
+    }
+
+
+class CaptureThread(threading.Thread):
+    """
+    Reads frames continuously and keeps only the most recent one in `frames`
+    """
+
+    def __init__(self, source=0, camera: int = 0, frames: LatestQueue = None):
+        super().__init__(name=f"capture-{camera}", daemon=True)
+        self.source = source
+        self.camera = camera
+        self.frames = frames if frames is not None else LatestQueue(maxsize=1, on_drop=Frame.release)
+        self.cap = None
+        self.pool = FramePool()
+        self.live = is_live(source)
+        self.mode = None
+        self.dropped = 0
+        self._stop_event = threading.Event()
+
+    def open(self) -> bool:
+        self.cap = cv2.VideoCapture(self.source)
+        if not self.cap.isOpened():
+            return False
+        if isinstance(self.source, int):
+            self.mode = negotiate(self.cap)
+            log.info("Camera %d: %dx%d %s at %.0f fps", self.camera, self.mode['width'], self.mode['height'],
+                     self.mode['fourcc'] or '?', self.mode['fps'])
+        return True
+
+    def _grab_newest(self, interval: float) -> bool:
+        """Grab until a grab has to wait for the camera, i.e. nothing older is queued"""
+        for _ in range(8):
+            started = time.monotonic()
+            if not self.cap.grab():
+                return False
+            if not self.live or time.monotonic() - started > interval / 2:
+                return True
+            # Returned at once: that frame was already waiting, so there may be a newer one
+            self.dropped += 1
+            self._frames_dropped.inc()
+        return True
+
+    def run(self):
+        capture_interval = metrics.histogram('capture_interval_seconds')
+        frames_captured = metrics.counter('frames_captured')
+        self._frames_dropped = metrics.counter('frames_dropped')
+        fps = self.cap.get(cv2.CAP_PROP_FPS) if self.live else 0
+        interval = 1.0 / fps if fps and fps > 0 else 1.0 / 30
+        index = 0
+        last = None
+        shape = None
+        while not self._stop_event.is_set():
+            if not self._grab_newest(interval):
+                log.error("Unable to read the camera feed.")
+                break
+            lease = self.pool.acquire(shape) if shape is not None else None
+            ret, image = self.cap.retrieve(lease.buffer) if lease is not None else self.cap.retrieve()
+            if lease is not None and image is not lease.buffer:
+                # OpenCV allocated instead, e.g. the resolution changed
+                lease.release()
+                lease = None
+            if not ret:
+                log.error("Unable to read the camera feed.")
+                break
+            # Only the first frame, or one after a resolution change, lands outside the pool
+            shape = image.shape
+            now = time.monotonic()
+            if last is not None:
+                capture_interval.observe(now - last)
+            last = now
+            frames_captured.inc()
+            replaced = self.frames.dropped
+            self.frames.put(Frame(index, now, image, self.camera, lease))
+            if self.frames.dropped != replaced:
+                self.dropped += 1
+                self._frames_dropped.inc()
+            index += 1
+        self.frames.close()
+
+    def stop(self):
+        self._stop_event.set()
+        if self.is_alive():
+            self.join(timeout=1.0)
+        if self.cap is not None:
+            self.cap.release()
+
+
+def release_all(frames):
+    for frame in frames:
+        frame.release()
+
+
+class MultiCapture:
+    """
+    Captures from every source at once and puts lists of frames, at most one per camera, in `frames`
+    """
+
+    def __init__(self, sources=config.CAMERA_SOURCES, window: float = config.BATCH_WINDOW):
+        self.window = window
+        # Every camera feeds one queue; if any camera fails it is closed and capture ends
+        self._incoming = LatestQueue(maxsize=2 * len(sources), on_drop=Frame.release)
+        self.cameras = [CaptureThread(source, camera, self._incoming) for camera, source in enumerate(sources)]
+        self.frames = LatestQueue(maxsize=1, on_drop=release_all)
+        self._thread = threading.Thread(target=self._group, name="capture-batcher", daemon=True)
+        self._stop_event = threading.Event()
+
+    def open(self) -> bool:
+        return all(camera.open() for camera in self.cameras)
+
+    @property
+    def dropped(self) -> int:
+        return sum(camera.dropped for camera in self.cameras) + self.frames.dropped
+
+    def start(self):
+        for camera in self.cameras:
+            camera.start()
+        self._thread.start()
+
+    def is_alive(self) -> bool:
+        return self._thread.is_alive()
+
+    def _group(self):
+        while not self._stop_event.is_set() and not self._incoming.closed:
+            frame = self._incoming.get(timeout=0.1)
+            if frame is None:
+                continue
+            batch = {frame.camera: frame}
+            # Wait a little for the other cameras' frames from the same moment
+            deadline = frame.timestamp + self.window
+            while len(batch) < len(self.cameras):
+                remaining = deadline - time.monotonic()
+                if remaining <= 0:
+                    break
+                frame = self._incoming.get(timeout=remaining)
+                if frame is None:
+                    break
+                if frame.camera in batch:
+                    batch[frame.camera].release()  # superseded by a newer frame from the same camera
+                batch[frame.camera] = frame
+            self.frames.put([batch[camera] for camera in sorted(batch)])
+        self.frames.close()
+
+    def stop(self):
+        self._stop_event.set()
+        for camera in self.cameras:
+            camera.stop()
+        if self._thread.is_alive():
+            self._thread.join(timeout=1.0)
@@ -0,0 +1,226 @@
+"""
+Runtime settings shared by the detection and navigation scripts.
+
+Every value can be overridden with an environment variable of the same name
+prefixed with VISUALEYEZE_, e.g. VISUALEYEZE_MAX_RESULT_AGE=0.3
+"""
+import os
+
+
+def _env(name, default, cast=str):
+    value = os.environ.get(f"VISUALEYEZE_{name}")
+    if value is None:
+        return default
+    return cast(value)
+
+
+def _flag(value):
+    return value.lower() in ('1', 'true', 'yes', 'on')
+
+
+def _source(value):
+    # Camera indices are ints, anything else is a file path or stream URL
+    return int(value) if value.isdigit() else value
+
+
+# Camera to open (device index, video file or stream URL)
+CAMERA_SOURCE = _env('CAMERA_SOURCE', 0, _source)
+
+# Several cameras, comma separated (e.g. "0,1" or "0,rtsp://localhost:8554/down"); the first one faces forward
+CAMERA_SOURCES = _env('CAMERA_SOURCES', (CAMERA_SOURCE,),
+                      lambda v: tuple(_source(s.strip()) for s in v.split(',') if s.strip()))
+
+# Spoken name of each camera, used in feedback when there is more than one
+CAMERA_NAMES = _env('CAMERA_NAMES', ('front', 'down'), lambda v: tuple(n.strip() for n in v.split(',')))
+
+# Frames from different cameras captured within this many seconds go through the model as one batch
+BATCH_WINDOW = _env('BATCH_WINDOW', 0.03, float)
+
+# Results older than this (seconds since capture) are not announced
+MAX_RESULT_AGE = _env('MAX_RESULT_AGE', 0.5, float)
+
+# Hazard announcements not started within this many seconds are dropped
+ALERT_TTL = _env('ALERT_TTL', 1.0, float)
+
+# Subscribe to the shared inference service instead of loading a model and opening the camera
+USE_INFERENCE_SERVICE = _env('USE_INFERENCE_SERVICE', False, _flag)
+
+# host:port the inference service listens on
+SERVICE_ADDRESS = _env('SERVICE_ADDRESS', 'localhost:6000')
+
+# Number of frame slots in the service's shared-memory ring
+SERVICE_SLOTS = _env('SERVICE_SLOTS', 4, int)
+
+# Skip the forward pass while the scene is unchanged and carry the last detections forward
+MOTION_GATING = _env('MOTION_GATING', True, _flag)
+
+# Mean absolute thumbnail change (0-1), after compensating global motion, that forces a keyframe
+MOTION_THRESHOLD = _env('MOTION_THRESHOLD', 0.04, float)
+
+# Global shift, as a fraction of the frame, that forces a keyframe
+MOTION_MAX_SHIFT = _env('MOTION_MAX_SHIFT', 0.1, float)
+
+# Seconds after which a keyframe is refreshed even if nothing moved
+MAX_KEYFRAME_AGE = _env('MAX_KEYFRAME_AGE', 1.0, float)
+
+# Minimum IoU between a track's predicted box and a detection to continue the track
+TRACK_IOU_THRESHOLD = _env('TRACK_IOU_THRESHOLD', 0.3, float)
+
+# Seconds a track survives without a matching detection
+TRACK_MAX_AGE = _env('TRACK_MAX_AGE', 1.0, float)
+
+# Comma separated class names treated as hazards, empty for every class the model knows
+HAZARD_CLASSES = _env('HAZARD_CLASSES', (), lambda v: tuple(n.strip() for n in v.split(',') if n.strip()))
+
+# Per-frame inference budget in seconds for adaptive model selection, 0 keeps the starting tier
+TARGET_LATENCY = _env('TARGET_LATENCY', 0.1, float)
+
+# System CPU percentage above which the model manager steps down a tier
+CPU_LIMIT = _env('CPU_LIMIT', 90.0, float)
+
+# Seconds between runs of the large room classification model in indoor mode
+ROOM_MODEL_INTERVAL = _env('ROOM_MODEL_INTERVAL', 2.0, float)
+
+# Seconds between room belief updates in indoor mode
+ROOM_UPDATE_INTERVAL = _env('ROOM_UPDATE_INTERVAL', 0.5, float)
+
+# Seconds for old room evidence to lose half its weight
+ROOM_HALF_LIFE = _env('ROOM_HALF_LIFE', 3.0, float)
+
+# Score lead another room needs before the decided room changes
+ROOM_MARGIN = _env('ROOM_MARGIN', 0.15, float)
+
+# Indoor layout graph used for room-to-room routing
+INDOOR_LAYOUT = _env('INDOOR_LAYOUT', os.path.join(os.path.dirname(os.path.abspath(__file__)), 'layouts', 'house.json'))
+
+# Logging level for diagnostics (DEBUG, INFO, WARNING, ERROR)
+LOG_LEVEL = _env('LOG_LEVEL', 'INFO')
+
+# Where to export metrics, empty to disable the exporter
+METRICS_FILE = _env('METRICS_FILE', '')
+
+# 'jsonl' appends one snapshot per line, 'prometheus' rewrites a text exposition file
+METRICS_FORMAT = _env('METRICS_FORMAT', 'jsonl')
+
+# Seconds between metrics exports
+METRICS_INTERVAL = _env('METRICS_INTERVAL', 10.0, float)
+
+# Samples kept per histogram for percentiles
+METRICS_WINDOW = _env('METRICS_WINDOW', 1024, int)
+
+# Mapbox access token and API root (point the root at a local server to test without the network)
+MAPBOX_API_KEY = _env('MAPBOX_API_KEY', "sk.eyJ1Ijoia2VlMzMiLCJhIjoiY200bG03ZDJuMDNoMjJtc2NqeDdubHN1eiJ9.N2Vp8nb5VFjWdCk5K0_GPA")
+MAPBOX_BASE_URL = _env('MAPBOX_BASE_URL', 'https://api.mapbox.com')
+
+# Seconds to wait for a connection and for a response, and how many times to retry a failed request
+HTTP_CONNECT_TIMEOUT = _env('HTTP_CONNECT_TIMEOUT', 3.0, float)
+HTTP_READ_TIMEOUT = _env('HTTP_READ_TIMEOUT', 10.0, float)
+HTTP_RETRIES = _env('HTTP_RETRIES', 3, int)
+
+# On-disk cache of geocoding results and routes, empty to disable
+MAPBOX_CACHE = _env('MAPBOX_CACHE', os.path.join(os.path.expanduser('~'), '.cache', 'visualeyeze', 'mapbox.sqlite'))
+
+# Cache entries kept, and how long a geocode or route stays valid (seconds)
+CACHE_SIZE = _env('CACHE_SIZE', 2000, int)
+GEOCODE_TTL = _env('GEOCODE_TTL', 30 * 24 * 3600.0, float)
+ROUTE_TTL = _env('ROUTE_TTL', 7 * 24 * 3600.0, float)
+
+# Decimal places route endpoints are rounded to for the cache key (4 is about 11 m)
+ROUTE_CACHE_PRECISION = _env('ROUTE_CACHE_PRECISION', 4, int)
+
+# Where positions come from: "gpsd" or "gpsd://host:port", a serial GPS such as /dev/ttyUSB0,
+# a file of NMEA sentences to replay, or "ip" for the coarse IP-address lookup only
+LOCATION_SOURCE = _env('LOCATION_SOURCE', 'gpsd://localhost:2947')
+
+# Baud rate of a serial GPS, and how fast a replayed NMEA file plays relative to its recorded time
+GPS_BAUDRATE = _env('GPS_BAUDRATE', 9600, int)
+LOCATION_REPLAY_SPEED = _env('LOCATION_REPLAY_SPEED', 1.0, float)
+
+# Seconds without a fix before falling back to the IP lookup, which then repeats every LOCATION_INTERVAL seconds
+LOCATION_FALLBACK_AFTER = _env('LOCATION_FALLBACK_AFTER', 10.0, float)
+LOCATION_INTERVAL = _env('LOCATION_INTERVAL', 5.0, float)
+
+# Positions older than this (seconds) are not used to start a route
+LOCATION_MAX_AGE = _env('LOCATION_MAX_AGE', 5.0, float)
+
+# Acceleration (m/s^2) the position filter allows for; walking rarely changes speed faster than this
+LOCATION_ACCELERATION = _env('LOCATION_ACCELERATION', 1.0, float)
+
+# Meters from the route line before the wearer counts as off route and the route is fetched again
+OFF_ROUTE_DISTANCE = _env('OFF_ROUTE_DISTANCE', 30.0, float)
+
+# Meters before a maneuver at which it is announced, and from the end at which the wearer has arrived
+STEP_ANNOUNCE_DISTANCE = _env('STEP_ANNOUNCE_DISTANCE', 15.0, float)
+ARRIVAL_DISTANCE = _env('ARRIVAL_DISTANCE', 10.0, float)
+
+# Pedestrian graph built by `osm_router.py build`, empty if there is none
+OSM_GRAPH = _env('OSM_GRAPH', '')
+
+# 'mapbox', 'offline', or 'auto' to use the offline graph whenever Mapbox can't answer
+ROUTING_ENGINE = _env('ROUTING_ENGINE', 'auto')
+
+# Inference backend for the YOLO models: 'torch', 'onnx' or 'openvino'
+INFERENCE_BACKEND = _env('INFERENCE_BACKEND', 'torch')
+
+# Quantize exported models to INT8, calibrated on frames from CALIBRATION_DATA (a video or image directory)
+INT8 = _env('INT8', False, _flag)
+CALIBRATION_DATA = _env('CALIBRATION_DATA', '')
+CALIBRATION_FRAMES = _env('CALIBRATION_FRAMES', 200, int)
+
+# Crop inference to the walking corridor between periodic full-frame scans
+ROI_MODE = _env('ROI_MODE', False, _flag)
+
+# Walking corridor as x1,y1,x2,y2 fractions of the frame
+ROI_CORRIDOR = _env('ROI_CORRIDOR', (0.2, 0.0, 0.8, 1.0), lambda v: tuple(float(f) for f in v.split(',')))
+
+# Seconds between full-frame scans in ROI mode
+ROI_FULL_SCAN_INTERVAL = _env('ROI_FULL_SCAN_INTERVAL', 1.0, float)
+
+# The nearest hazard in the corridor (or, with none, the smallest box that could be one) is kept at least
+# this many pixels tall in the model input, within the input sizes of the model ladder
+ROI_MIN_OBJECT_PIXELS = _env('ROI_MIN_OBJECT_PIXELS', 64, int)
+ROI_MIN_IMGSZ = _env('ROI_MIN_IMGSZ', 160, int)
+ROI_MAX_IMGSZ = _env('ROI_MAX_IMGSZ', 640, int)
+
+# Speech recognizer for spoken commands: 'vosk' (on device), 'google' (online) or 'auto' (vosk if its model is installed)
+VOICE_ENGINE = _env('VOICE_ENGINE', 'auto')
+VOSK_MODEL = _env('VOSK_MODEL', os.path.join(os.path.expanduser('~'), '.cache', 'visualeyeze', 'vosk-model-small-en-us-0.15'))
+
+# Seconds a partial result must hold before it is taken, and trailing silence that ends a phrase
+VOICE_STABLE_TIME = _env('VOICE_STABLE_TIME', 0.15, float)
+VOICE_END_SILENCE = _env('VOICE_END_SILENCE', 0.3, float)
+
+# Named destinations for outdoor navigation, "name=address" pairs separated by semicolons
+SAVED_PLACES = _env('SAVED_PLACES', {}, lambda v: dict(
+    (name.strip().lower(), address.strip()) for name, address in
+    (pair.split('=', 1) for pair in v.split(';') if '=' in pair)))
+
+# Play announcements from pre-rendered audio (needs sounddevice), instead of synthesizing each one live
+PHRASE_AUDIO = _env('PHRASE_AUDIO', True, _flag)
+PHRASE_PACK = _env('PHRASE_PACK', os.path.join(os.path.expanduser('~'), '.cache', 'visualeyeze', 'phrases.pack'))
+
+# Seconds of rendered dynamic text (e.g. street names) kept in memory
+PHRASE_CACHE_SECONDS = _env('PHRASE_CACHE_SECONDS', 300.0, float)
+
+# Where the detection loops show their annotated frames: 'headless', 'window', 'mjpeg' or 'auto' (window if there is a display)
+DISPLAY_MODE = _env('DISPLAY_MODE', 'auto')
+
+# Preview frames drawn per second per camera, and the port of the hazard MJPEG stream (indoor uses the next one)
+PREVIEW_FPS = _env('PREVIEW_FPS', 10.0, float)
+PREVIEW_PORT = _env('PREVIEW_PORT', 8090, int)
+
+# Record per-frame detections and feedback decisions under this directory (one trace per run), off when empty
+TRACE_DIR = _env('TRACE_DIR', '')
+
+# Frames buffered before a trace write; at most this many are lost if the process dies
+TRACE_CHUNK_FRAMES = _env('TRACE_CHUNK_FRAMES', 512, int)
+
+# Camera mode to ask for: the models take 640 pixel inputs, so larger frames only cost decode time; 0 keeps the camera's default
+CAPTURE_WIDTH = _env('CAPTURE_WIDTH', 640, int)
+CAPTURE_HEIGHT = _env('CAPTURE_HEIGHT', 480, int)
+CAPTURE_FPS = _env('CAPTURE_FPS', 30.0, float)
+# Pixel format as a FourCC; MJPG lets most USB cameras reach full rate, empty keeps the default
+CAPTURE_FOURCC = _env('CAPTURE_FOURCC', 'MJPG')
+
+# Image buffers per camera, enough for every frame in flight between capture, inference, feedback and preview
+FRAME_POOL_SIZE = _env('FRAME_POOL_SIZE', 8, int)
@@ -0,0 +1,104 @@
+"""
+Columnar detection batches shared by the hazard and indoor scripts.
+
+A DetectionBatch keeps one frame's detections as parallel NumPy columns
+(boxes, scores, class ids) so filtering, distance estimation and hazard
+banding run as whole-array operations instead of per-box Python code.
+"""
+from typing import Dict, Iterable
+
+import numpy as np
+
+# Hazard levels, ordered by urgency
+HAZARD_NONE = 0
+HAZARD_AHEAD = 1
+HAZARD_CLOSE = 2
+
+# Estimated distance below which a detection is a hazard, and below which it is close
+HAZARD_RANGE = 4000
+CLOSE_RANGE = 1700
+
+# Fixed-width record layout for one detection
+DETECTION_DTYPE = np.dtype([
+    ('x1', np.float32), ('y1', np.float32), ('x2', np.float32), ('y2', np.float32),
+    ('conf', np.float32), ('cls', np.int32),
+])
+
+
+def names_array(names: Dict[int, str]) -> np.ndarray:
+    """Turn a model's {class_id: name} mapping into an array indexable by class id"""
+    array = np.empty(max(names) + 1, dtype=object)
+    for class_id, name in names.items():
+        array[class_id] = name
+    return array
+
+
+def hazard_levels(confidence: np.ndarray, distance: np.ndarray, min_confidence: float) -> np.ndarray:
+    """Band detections into hazard levels. Confidence is in percent."""
+    in_range = (confidence > min_confidence) & (distance < HAZARD_RANGE)
+    return np.where(in_range, np.where(distance <= CLOSE_RANGE, HAZARD_CLOSE, HAZARD_AHEAD), HAZARD_NONE)
+
+
+def min_hazard_height(actual_height: float = 1.7, focal_length: float = 700) -> float:
+    """Smallest box height, as a fraction of the frame height, that can still be within HAZARD_RANGE"""
+    return actual_height * focal_length / HAZARD_RANGE
+
+
+class DetectionBatch:
+    def __init__(self, boxes: np.ndarray, scores: np.ndarray, class_ids: np.ndarray, names: np.ndarray):
+        self.boxes = boxes          # (N, 4) float32, x1 y1 x2 y2 in pixels
+        self.scores = scores        # (N,) float32, 0-1
+        self.class_ids = class_ids  # (N,) int32
+        self.names = names          # class id -> name, from names_array()
+
+    @classmethod
+    def from_array(cls, data, names: np.ndarray) -> 'DetectionBatch':
+        """Build from raw (N, 6) rows of x1, y1, x2, y2, conf, cls as returned by YOLO"""
+        if hasattr(data, 'cpu'):
+            data = data.cpu().numpy()
+        data = np.asarray(data, dtype=np.float32).reshape(-1, 6)
+        return cls(data[:, :4], data[:, 4], data[:, 5].astype(np.int32), names)
+
+    @classmethod
+    def from_records(cls, records: np.ndarray, names: np.ndarray) -> 'DetectionBatch':
+        boxes = np.stack([records['x1'], records['y1'], records['x2'], records['y2']], axis=1)
+        return cls(boxes.reshape(-1, 4), records['conf'].copy(), records['cls'].copy(), names)
+
+    def __len__(self):
+        return len(self.scores)
+
+    def select(self, mask) -> 'DetectionBatch':
+        return DetectionBatch(self.boxes[mask], self.scores[mask], self.class_ids[mask], self.names)
+
+    def filter(self, min_confidence: float = 0.0, classes: Iterable[int] = None) -> 'DetectionBatch':
+        """Keep detections above a confidence (0-1) and, optionally, of the given class ids"""
+        mask = self.scores >= min_confidence
+        if classes is not None:
+            mask &= np.isin(self.class_ids, list(classes))
+        return self if mask.all() else self.select(mask)
+
+    def class_names(self) -> np.ndarray:
+        return self.names[self.class_ids]
+
+    def heights(self) -> np.ndarray:
+        return self.boxes[:, 3] - self.boxes[:, 1]
+
+    def distances(self, frame_height: int, actual_height: float = 1.7, focal_length: float = 700) -> np.ndarray:
+        """Pinhole distance estimate per box, inf for degenerate boxes"""
+        heights = self.heights()
+        with np.errstate(divide='ignore'):
+            return np.where(heights > 0, (actual_height * focal_length) / (heights / frame_height), np.inf)
+
+    def hazard_levels(self, frame_height: int, min_confidence: float) -> np.ndarray:
+        return hazard_levels(self.scores * 100, self.distances(frame_height), min_confidence)
+
+    def rows(self) -> np.ndarray:
+        """(N, 6) float rows in YOLO's x1, y1, x2, y2, conf, cls layout"""
+        return np.column_stack([self.boxes, self.scores, self.class_ids.astype(np.float32)])
+
+    def to_records(self) -> np.ndarray:
+        records = np.empty(len(self), dtype=DETECTION_DTYPE)
+        records['x1'], records['y1'], records['x2'], records['y2'] = self.boxes.T
+        records['conf'] = self.scores
+        records['cls'] = self.class_ids
+        return records
@@ -0,0 +1,171 @@
+"""
+Graph-based indoor routing over a layout file.
+
+A layout is a JSON graph of rooms, doors, corridors and stairs:
+
+    "nodes": {id: {"type": "room" | "door" | "corridor" | "stairs",
+                   "floor": int, "pos": [x, y], "label": optional spoken name}}
+    "edges": [[a, b], [a, b, length], ...]
+
+pos is in meters on the floor plan, x to the right and y downwards. An edge's
+length defaults to the distance between its two positions; edges between
+floors (stairs) need an explicit length.
+
+All-pairs shortest paths are computed once when a layout is loaded and cached
+next to the layout file, so answering a route is a walk over a predecessor
+table with no search, and each answer is memoized.
+"""
+import hashlib
+import heapq
+import json
+import math
+import os
+from typing import Dict, List, Optional, Tuple
+
+import numpy as np
+
+STEP_LENGTH = 0.762  # average step length in meters
+
+
+def meters_to_steps(distance_meters: float) -> int:
+    return int(distance_meters / STEP_LENGTH)
+
+
+def _dijkstra_all_pairs(adjacency: List[List[Tuple[int, float]]]):
+    n = len(adjacency)
+    dist = np.full((n, n), np.inf, dtype=np.float32)
+    pred = np.full((n, n), -1, dtype=np.int32)
+    for source in range(n):
+        row_dist, row_pred = dist[source], pred[source]
+        row_dist[source] = 0.0
+        heap = [(0.0, source)]
+        while heap:
+            d, u = heapq.heappop(heap)
+            if d > row_dist[u]:
+                continue
+            for v, w in adjacency[u]:
+                nd = d + w
+                if nd < row_dist[v]:
+                    row_dist[v] = nd
+                    row_pred[v] = u
+                    heapq.heappush(heap, (nd, v))
+    return dist, pred
+
+
+def _turn(previous: Optional[float], heading: float) -> str:
+    if previous is None:
+        return "Head"
+    # y points down, so a positive angle change is a clockwise (right) turn
+    change = (heading - previous + math.pi) % (2 * math.pi) - math.pi
+    if abs(change) < math.radians(30):
+        return "Go straight"
+    if abs(change) > math.radians(150):
+        return "Turn around"
+    return "Turn right" if change > 0 else "Turn left"
+
+
+class IndoorRouter:
+    def __init__(self, layout: Dict):
+        self.name = layout.get('name', 'layout')
+        self.ids = list(layout['nodes'])
+        self.nodes = [layout['nodes'][node_id] for node_id in self.ids]
+        self.index = {node_id: i for i, node_id in enumerate(self.ids)}
+
+        self.lengths = {}
+        self.adjacency = [[] for _ in self.ids]
+        for edge in layout['edges']:
+            a, b = self.index[edge[0]], self.index[edge[1]]
+            length = float(edge[2]) if len(edge) > 2 else math.dist(self.nodes[a]['pos'], self.nodes[b]['pos'])
+            self.lengths[a, b] = self.lengths[b, a] = length
+            self.adjacency[a].append((b, length))
+            self.adjacency[b].append((a, length))
+
+        self.dist = None
+        self.pred = None
+        self._routes = {}
+
+    @classmethod
+    def load(cls, path: str) -> 'IndoorRouter':
+        with open(path, 'rb') as f:
+            raw = f.read()
+        router = cls(json.loads(raw))
+        router.build_tables(cache_path=path + '.routes.npz', digest=hashlib.sha1(raw).hexdigest())
+        return router
+
+    def build_tables(self, cache_path: str = None, digest: str = None):
+        """Compute (or load from cache) the all-pairs distance and predecessor tables"""
+        if cache_path and os.path.exists(cache_path):
+            cached = np.load(cache_path)
+            if str(cached['digest']) == digest:
+                self.dist, self.pred = cached['dist'], cached['pred']
+                return
+        self.dist, self.pred = _dijkstra_all_pairs(self.adjacency)
+        if cache_path:
+            try:
+                np.savez(cache_path, dist=self.dist, pred=self.pred, digest=np.array(digest))
+            except OSError:
+                pass  # read-only install, recompute next time
+
+    @property
+    def rooms(self) -> List[str]:
+        return [node_id for node_id, node in zip(self.ids, self.nodes) if node['type'] == 'room']
+
+    def label(self, node_id: str) -> str:
+        node = self.nodes[self.index[node_id]]
+        return node.get('label', node_id.replace('_', ' '))
+
+    def find_room(self, spoken: str) -> Optional[str]:
+        """Match a spoken room name against room ids and labels"""
+        spoken = spoken.strip().lower()
+        for room in self.rooms:
+            if spoken in (room, room.replace('_', ' '), self.label(room).lower()):
+                return room
+        return None
+
+    def distance(self, source: str, target: str) -> float:
+        return float(self.dist[self.index[source], self.index[target]])
+
+    def path(self, source: str, target: str) -> List[str]:
+        s, t = self.index[source], self.index[target]
+        if not np.isfinite(self.dist[s, t]):
+            return []
+        nodes = [t]
+        while nodes[-1] != s:
+            nodes.append(int(self.pred[s, nodes[-1]]))
+        return [self.ids[i] for i in reversed(nodes)]
+
+    def route(self, source: str, target: str) -> List[Tuple[str, float]]:
+        """
+        Step-by-step directions as (instruction, distance in meters) tuples,
+        the same shape OutdoorNav1 gets from Mapbox. Empty if there is no route.
+        """
+        key = (source, target)
+        if key not in self._routes:
+            self._routes[key] = self._steps(self.path(source, target))
+        return self._routes[key]
+
+    def _steps(self, path: List[str]) -> List[Tuple[str, float]]:
+        steps = []
+        heading = None
+        previous_type = None
+        for u, v in zip(path, path[1:]):
+            a, b = self.nodes[self.index[u]], self.nodes[self.index[v]]
+            length = self.lengths[self.index[u], self.index[v]]
+            if a['floor'] != b['floor']:
+                direction = "up" if b['floor'] > a['floor'] else "down"
+                steps.append((f"Take the stairs {direction} to floor {b['floor']}", length))
+                heading, previous_type = None, 'stairs'
+                continue
+
+            new_heading = math.atan2(b['pos'][1] - a['pos'][1], b['pos'][0] - a['pos'][0])
+            turn = _turn(heading, new_heading)
+            heading = new_heading
+            if turn == "Go straight" and b['type'] == 'corridor' and previous_type == 'corridor':
+                # Keep walking along the same corridor
+                steps[-1] = (steps[-1][0], steps[-1][1] + length)
+                continue
+
+            preposition = {'door': 'through', 'room': 'into', 'corridor': 'along'}.get(b['type'], 'towards')
+            steps.append((f"{turn} {preposition} the {self.label(v)}", length))
+            previous_type = b['type']
+        return steps
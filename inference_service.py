@@ -0,0 +1,318 @@
+"""
+Resident YOLO inference service.
+
+One process owns the cameras and every loaded model. Hazard.py and
+IndoorIntegrated.py subscribe to a model's detection stream over a local
+socket instead of loading their own weights and opening the cameras
+themselves. Every camera in CAMERA_SOURCES is captured, and frames taken
+together go through each model as one batch. Frames are published through
+one shared-memory ring per camera, so only the small detection arrays,
+tagged with their camera index, travel over the socket.
+
+Run it with:  python inference_service.py [weights ...]
+"""
+import logging
+import sys
+import threading
+import time
+from multiprocessing import resource_tracker
+from multiprocessing.connection import Client, Listener
+from multiprocessing.shared_memory import SharedMemory
+
+import numpy as np
+
+import config
+from backends import load_model
+from metrics import metrics, setup_logging
+from motion import KeyframeScheduler
+from pipeline import Frame, LatestQueue
+
+AUTHKEY = b'visualeyeze'
+
+log = logging.getLogger(__name__)
+
+
+def parse_address(address: str):
+    host, port = address.rsplit(':', 1)
+    return host, int(port)
+
+
+class FrameRing:
+    """
+    Fixed number of frame slots in shared memory. Each slot has a sequence
+    number that is cleared while the slot is written, so readers can detect
+    a frame that was overwritten under them.
+    """
+
+    def __init__(self, shm: SharedMemory, shape, slots: int, owner: bool):
+        self.shm = shm
+        self.shape = tuple(shape)
+        self.slots = slots
+        self.owner = owner
+        self.seq = np.ndarray((slots,), dtype=np.int64, buffer=shm.buf)
+        self.frames = np.ndarray((slots,) + self.shape, dtype=np.uint8,
+                                 buffer=shm.buf, offset=self.seq.nbytes)
+
+    @classmethod
+    def create(cls, shape, slots: int):
+        size = slots * 8 + slots * int(np.prod(shape))
+        ring = cls(SharedMemory(create=True, size=size), shape, slots, owner=True)
+        ring.seq[:] = -1
+        return ring
+
+    @classmethod
+    def attach(cls, name: str, shape, slots: int):
+        shm = SharedMemory(name=name)
+        # Only the creating process may unlink the segment
+        if sys.platform != 'win32':
+            resource_tracker.unregister(shm._name, 'shared_memory')
+        return cls(shm, shape, slots, owner=False)
+
+    @property
+    def name(self) -> str:
+        return self.shm.name
+
+    def write(self, frame: Frame) -> int:
+        slot = frame.index % self.slots
+        self.seq[slot] = -1
+        self.frames[slot] = frame.image
+        self.seq[slot] = frame.index
+        return slot
+
+    def read(self, slot: int, index: int):
+        """Copy a frame out of the ring, or return None if it has already been overwritten"""
+        if self.seq[slot] != index:
+            return None
+        image = self.frames[slot].copy()
+        if self.seq[slot] != index:
+            return None
+        return image
+
+    def close(self):
+        # Drop our views before closing, SharedMemory refuses to close with exported buffers
+        del self.seq, self.frames
+        self.shm.close()
+        if self.owner:
+            self.shm.unlink()
+
+
+class ModelRegistry:
+    """Loads each set of weights once and keeps it resident"""
+
+    def __init__(self):
+        self._models = {}
+        self._lock = threading.Lock()
+
+    def get(self, weights: str):
+        with self._lock:
+            if weights not in self._models:
+                log.info("Loading model %s", weights)
+                self._models[weights] = load_model(weights)
+            return self._models[weights]
+
+
+class Subscriber(threading.Thread):
+    """
+    Sends detections for one model to one client, skipping ahead if the client falls behind.
+    A paused subscriber stays connected but gets nothing, and its model isn't run for it.
+    """
+
+    def __init__(self, conn, weights: str, cameras: int = 1):
+        super().__init__(name=f"subscriber-{weights}", daemon=True)
+        self.conn = conn
+        self.weights = weights
+        # Room for one message per camera, so a batch isn't overwritten before it is sent
+        self.queue = LatestQueue(maxsize=cameras)
+        self.paused = False
+
+    def run(self):
+        while not self.queue.closed:
+            message = self.queue.get(timeout=0.1)
+            try:
+                while self.conn.poll():
+                    self.paused = self.conn.recv()['paused']
+                if message is not None and not self.paused:
+                    self.conn.send(message)
+            except (EOFError, OSError):
+                break
+        self.queue.close()
+        self.conn.close()
+
+
+class InferenceService:
+    def __init__(self, address: str = config.SERVICE_ADDRESS, sources=config.CAMERA_SOURCES,
+                 slots: int = config.SERVICE_SLOTS):
+        self.address = parse_address(address)
+        self.sources = sources
+        self.slots = slots
+        self.registry = ModelRegistry()
+        self.subscribers = []
+        self.schedulers = {}  # (weights, camera) -> KeyframeScheduler
+        self._inference_time = metrics.histogram('inference_seconds')
+        self._lock = threading.Lock()
+        self.rings = []  # one per camera
+
+    def _accept(self, listener: Listener):
+        while True:
+            try:
+                conn = listener.accept()
+            except OSError:
+                break  # listener closed
+            try:
+                request = conn.recv()
+            except (EOFError, OSError):
+                conn.close()
+                continue
+            weights = request['subscribe']
+            model = self.registry.get(weights)
+            conn.send({
+                'names': model.names,
+                'rings': [(ring.name, ring.shape) for ring in self.rings],
+                'slots': self.slots,
+            })
+            subscriber = Subscriber(conn, weights, len(self.rings))
+            subscriber.start()
+            with self._lock:
+                self.subscribers.append(subscriber)
+            log.info("Client subscribed to %s", weights)
+
+    def serve_forever(self, preload=()):
+        from capture import MultiCapture, release_all
+
+        capture = MultiCapture(self.sources)
+        if not capture.open():
+            log.error("Unable to access the camera.")
+            return
+        capture.start()
+
+        # The rings are sized by each camera's first frame
+        shapes = {}
+        deadline = time.monotonic() + 5.0
+        while len(shapes) < len(self.sources) and time.monotonic() < deadline:
+            for frame in capture.frames.get(timeout=0.1) or ():
+                shapes.setdefault(frame.camera, frame.image.shape)
+                frame.release()
+        if len(shapes) < len(self.sources):
+            log.error("Unable to read the camera feed.")
+            capture.stop()
+            return
+        self.rings = [FrameRing.create(shapes[camera], self.slots) for camera in range(len(self.sources))]
+
+        listener = Listener(self.address, authkey=AUTHKEY)
+        threading.Thread(target=self._accept, args=(listener,), name="accept", daemon=True).start()
+        log.info("Inference service listening on %s:%d", *self.address)
+        # Warm up models in the background so the first subscriber doesn't wait for them
+        for weights in preload:
+            threading.Thread(target=self.registry.get, args=(weights,), daemon=True).start()
+
+        try:
+            while not capture.frames.closed:
+                frames = capture.frames.get(timeout=0.1)
+                if frames:
+                    try:
+                        self._publish(frames)
+                    finally:
+                        # Subscribers read from the rings, the capture buffers can be reused
+                        release_all(frames)
+        except KeyboardInterrupt:
+            pass
+        finally:
+            listener.close()
+            capture.stop()
+            for ring in self.rings:
+                ring.close()
+
+    def _publish(self, frames):
+        with self._lock:
+            self.subscribers = [s for s in self.subscribers if not s.queue.closed]
+            subscribers = [s for s in self.subscribers if not s.paused]
+        if not subscribers:
+            return
+
+        slots = [self.rings[frame.camera].write(frame) for frame in frames]
+        # One batched forward pass per model over the cameras that need it, shared by all of its subscribers
+        for weights in {s.weights for s in subscribers}:
+            boxes = [None] * len(frames)
+            pending = []
+            for i, frame in enumerate(frames):
+                scheduler = self.schedulers.get((weights, frame.camera))
+                if scheduler is None and config.MOTION_GATING:
+                    scheduler = self.schedulers[weights, frame.camera] = KeyframeScheduler()
+                if scheduler is not None and not scheduler.should_infer(frame.image):
+                    boxes[i] = scheduler.propagate()
+                else:
+                    pending.append(i)
+            if pending:
+                start = time.perf_counter()
+                results = self.registry.get(weights).predict([frames[i].image for i in pending], verbose=False)
+                self._inference_time.observe(time.perf_counter() - start)
+                for i, result in zip(pending, results):
+                    boxes[i] = result.boxes.data.cpu().numpy()
+                    scheduler = self.schedulers.get((weights, frames[i].camera))
+                    if scheduler is not None:
+                        scheduler.keyframe(frames[i].image, boxes[i])
+            for frame, slot, frame_boxes in zip(frames, slots, boxes):
+                message = (frame.camera, frame.index, frame.timestamp, slot, frame_boxes)
+                for subscriber in subscribers:
+                    if subscriber.weights == weights:
+                        subscriber.queue.put(message)
+
+
+class DetectionClient(threading.Thread):
+    """
+    Subscribes to one model's detections. `results` holds the newest
+    (Frame, boxes) pair of each camera, where boxes is an (N, 6) array of
+    x1, y1, x2, y2, conf, cls and Frame.camera says which camera it came from.
+    """
+
+    def __init__(self, weights: str, address: str = config.SERVICE_ADDRESS, connect_timeout: float = 30.0):
+        super().__init__(name=f"detections-{weights}", daemon=True)
+        # The service may still be opening the camera when we are started alongside it
+        deadline = time.monotonic() + connect_timeout
+        while True:
+            try:
+                self.conn = Client(parse_address(address), authkey=AUTHKEY)
+                break
+            except ConnectionRefusedError:
+                if time.monotonic() > deadline:
+                    raise
+                time.sleep(0.2)
+        self.conn.send({'subscribe': weights})
+        info = self.conn.recv()
+        self.names = info['names']
+        self.rings = [FrameRing.attach(name, shape, info['slots']) for name, shape in info['rings']]
+        self.results = LatestQueue(maxsize=len(self.rings))
+        self._stop_event = threading.Event()
+
+    def run(self):
+        while not self._stop_event.is_set():
+            try:
+                if not self.conn.poll(0.1):
+                    continue
+                camera, index, timestamp, slot, boxes = self.conn.recv()
+            except (EOFError, OSError):
+                log.error("Lost connection to the inference service.")
+                break
+            image = self.rings[camera].read(slot, index)
+            if image is not None:
+                self.results.put((Frame(index, timestamp, image, camera), boxes))
+        self.results.close()
+
+    def pause(self, paused: bool = True):
+        """Stop (or resume) receiving detections while staying subscribed"""
+        self.conn.send({'paused': paused})
+
+    def stop(self):
+        self._stop_event.set()
+        if self.is_alive():
+            self.join(timeout=1.0)
+        self.conn.close()
+        for ring in self.rings:
+            ring.close()
+
+
+if __name__ == "__main__":
+    setup_logging()
+    metrics.start_exporter()
+    service = InferenceService()
+    service.serve_forever(preload=sys.argv[1:])
@@ -0,0 +1,409 @@
+"""
+Position fixes for outdoor navigation, read locally instead of looked up per step.
+
+A LocationProvider thread reads fixes from LOCATION_SOURCE. That is either
+gpsd's JSON stream, NMEA sentences from a serial GPS, or an NMEA file
+replayed at its recorded pace. Each fix goes through a constant-velocity
+Kalman filter in local meters, which smooths the jitter of a consumer
+receiver and rejects the occasional jump. The filtered fix is then put on
+every subscriber's queue. Receivers report at 1-10 Hz, so navigation
+updates arrive as local events. When the source gives no fix for
+LOCATION_FALLBACK_AFTER seconds (no gpsd, no sky view), the provider falls
+back to the IP-address lookup every LOCATION_INTERVAL seconds. That only
+resolves to a city and is reported with a matching accuracy.
+
+    python location.py --source track.nmea
+"""
+import argparse
+import json
+import logging
+import math
+import socket
+import threading
+import time
+from typing import Iterator, NamedTuple, Optional
+
+import numpy as np
+
+import config
+from metrics import metrics
+from pipeline import LatestQueue
+
+log = logging.getLogger(__name__)
+
+EARTH_RADIUS = 6371000.0  # meters
+
+# Horizontal error of a receiver per unit of HDOP, and of a fix that doesn't say (meters)
+UERE = 5.0
+DEFAULT_ACCURACY = 15.0
+IP_ACCURACY = 5000.0
+
+
+class Fix(NamedTuple):
+    lon: float
+    lat: float
+    accuracy: float  # meters, one standard deviation
+    timestamp: float  # time.monotonic() when it was received
+    source: str
+
+    @property
+    def coords(self) -> str:
+        """As the "longitude,latitude" string the routing code uses"""
+        return f"{self.lon},{self.lat}"
+
+
+def _degrees(value: str, hemisphere: str) -> float:
+    # NMEA packs degrees and minutes together: ddmm.mmmm or dddmm.mmmm
+    point = value.index('.') if '.' in value else len(value)
+    degrees = float(value[:point - 2]) + float(value[point - 2:]) / 60.0
+    return -degrees if hemisphere in ('S', 'W') else degrees
+
+
+def _seconds(hhmmss: str) -> Optional[float]:
+    if len(hhmmss) < 6:
+        return None
+    return int(hhmmss[:2]) * 3600 + int(hhmmss[2:4]) * 60 + float(hhmmss[4:])
+
+
+def parse_nmea(line: str) -> Optional[dict]:
+    """
+    A GGA or RMC sentence as {'kind', 'time', 'lon', 'lat', 'hdop'}; None for other
+    sentences, a bad checksum, or no fix
+    """
+    line = line.strip()
+    if not line.startswith('$'):
+        return None
+    body, _, checksum = line[1:].partition('*')
+    if checksum:
+        calculated = 0
+        for char in body.encode('ascii', 'replace'):
+            calculated ^= char
+        if checksum[:2].upper() != f"{calculated:02X}":
+            return None
+    fields = body.split(',')
+    kind = fields[0][2:]
+    try:
+        if kind == 'GGA' and len(fields) > 8:
+            if fields[6] in ('', '0'):
+                return None
+            return {'kind': kind, 'time': _seconds(fields[1]), 'lat': _degrees(fields[2], fields[3]),
+                    'lon': _degrees(fields[4], fields[5]), 'hdop': float(fields[8]) if fields[8] else None}
+        if kind == 'RMC' and len(fields) > 6:
+            if fields[2] != 'A':
+                return None
+            return {'kind': kind, 'time': _seconds(fields[1]), 'lat': _degrees(fields[3], fields[4]),
+                    'lon': _degrees(fields[5], fields[6]), 'hdop': None}
+    except ValueError:
+        return None
+    return None
+
+
+class NmeaSource:
+    """
+    Fixes from NMEA sentences, off a serial device or replayed from a file. GGA is used
+    once seen, since it carries HDOP; RMC only until then, so each epoch counts once.
+    """
+
+    def __init__(self, path: str, baudrate: int = config.GPS_BAUDRATE, speed: float = config.LOCATION_REPLAY_SPEED):
+        self.path = path
+        self.baudrate = baudrate
+        self.speed = speed
+        self.device = path.startswith('/dev/') or path.upper().startswith('COM')
+        self.name = 'gps' if self.device else 'replay'
+
+    def _lines(self, stopping: threading.Event) -> Iterator[Optional[str]]:
+        if self.device:
+            import serial
+            with serial.Serial(self.path, self.baudrate, timeout=1.0) as port:
+                while not stopping.is_set():
+                    line = port.readline()
+                    yield line.decode('ascii', 'replace') if line else None
+        else:
+            with open(self.path, errors='replace') as f:
+                yield from f
+
+    def fixes(self, stopping: threading.Event) -> Iterator[Optional[Fix]]:
+        """
+        Fixes as they arrive, and None for every line that isn't one, or about once a second
+        when nothing is received; a receiver without a fix still talks, just without positions
+        """
+        seen_gga = False
+        last_time = None
+        for line in self._lines(stopping):
+            if stopping.is_set():
+                return
+            sentence = parse_nmea(line) if line else None
+            if sentence is None or (sentence['kind'] == 'RMC' and seen_gga):
+                yield None
+                continue
+            seen_gga = seen_gga or sentence['kind'] == 'GGA'
+            if not self.device and sentence['time'] is not None:
+                # Replay at the recorded pace, so the filter sees real intervals
+                if last_time is not None and self.speed > 0:
+                    gap = (sentence['time'] - last_time) % 86400  # past midnight
+                    stopping.wait(min(gap, 5.0) / self.speed)
+                last_time = sentence['time']
+            hdop = sentence['hdop']
+            accuracy = hdop * UERE if hdop else DEFAULT_ACCURACY
+            yield Fix(sentence['lon'], sentence['lat'], accuracy, time.monotonic(), self.name)
+
+
+class GpsdSource:
+    """Fixes from gpsd's JSON watch stream"""
+
+    name = 'gpsd'
+
+    def __init__(self, host: str = 'localhost', port: int = 2947):
+        self.host = host
+        self.port = port
+
+    def fixes(self, stopping: threading.Event) -> Iterator[Optional[Fix]]:
+        """Fixes as they arrive, and None for every other report, or each second without one"""
+        with socket.create_connection((self.host, self.port), timeout=config.HTTP_CONNECT_TIMEOUT) as sock:
+            sock.settimeout(1.0)
+            sock.sendall(b'?WATCH={"enable":true,"json":true}\n')
+            # Split lines ourselves; a file object over the socket is unusable after a timeout
+            pending = b''
+            while not stopping.is_set():
+                try:
+                    data = sock.recv(4096)
+                except socket.timeout:
+                    yield None
+                    continue
+                if not data:
+                    raise ConnectionError("gpsd closed the connection")
+                *lines, pending = (pending + data).split(b'\n')
+                now = time.monotonic()
+                for line in lines:
+                    # Reports without a position (mode < 2 while acquiring, sky reports) come out as None
+                    yield _report(line, now)
+
+
+def _report(line: bytes, now: float) -> Optional[Fix]:
+    """A fix from one line of gpsd JSON, if it is a TPV report with a position"""
+    try:
+        report = json.loads(line)
+    except ValueError:
+        return None
+    if report.get('class') != 'TPV' or report.get('mode', 0) < 2 or 'lat' not in report:
+        return None
+    if 'eph' in report:
+        accuracy = report['eph']
+    elif 'epx' in report and 'epy' in report:
+        accuracy = math.hypot(report['epx'], report['epy'])
+    else:
+        accuracy = DEFAULT_ACCURACY
+    return Fix(report['lon'], report['lat'], accuracy, now, GpsdSource.name)
+
+
+def ip_fix() -> Optional[Fix]:
+    """One lookup of this machine's IP address location; city level at best"""
+    import geocoder
+    location = geocoder.ip('me')
+    if not location.ok:
+        return None
+    return Fix(location.latlng[1], location.latlng[0], IP_ACCURACY, time.monotonic(), 'ip')
+
+
+def open_source(spec: str = config.LOCATION_SOURCE):
+    """The fix source a LOCATION_SOURCE value names, or None for IP lookups only"""
+    if spec in ('', 'ip'):
+        return None
+    if spec == 'gpsd' or spec.startswith('gpsd://'):
+        host, _, port = spec[len('gpsd://'):].partition(':')
+        return GpsdSource(host or 'localhost', int(port) if port else 2947)
+    return NmeaSource(spec)
+
+
+class PositionFilter:
+    """
+    Constant-velocity Kalman filter over local meters. Starts over when the source
+    changes, after a long gap, or when fixes keep landing far from the prediction.
+    """
+
+    def __init__(self, acceleration: float = config.LOCATION_ACCELERATION, max_gap: float = 30.0):
+        self.acceleration = acceleration
+        self.max_gap = max_gap
+        self.origin = None
+        self.rejected = 0
+        self._source = None
+        self._time = None
+        self._state = np.zeros(4)  # x, y, vx, vy
+        self._covariance = np.eye(4)
+
+    def reset(self):
+        self.origin = None
+
+    def _start(self, fix: Fix):
+        self.origin = (fix.lon, fix.lat)
+        self._scale = math.cos(math.radians(fix.lat)) * math.radians(1) * EARTH_RADIUS, math.radians(1) * EARTH_RADIUS
+        self._state = np.zeros(4)
+        # Unknown velocity: a couple of meters per second either way
+        self._covariance = np.diag([fix.accuracy ** 2, fix.accuracy ** 2, 4.0, 4.0])
+        self._source = fix.source
+        self._time = fix.timestamp
+        self.rejected = 0
+
+    def update(self, fix: Fix) -> Fix:
+        if self.origin is None or fix.source != self._source or fix.timestamp - self._time > self.max_gap:
+            self._start(fix)
+            return fix
+        dt = max(fix.timestamp - self._time, 0.0)
+        transition = np.eye(4)
+        transition[0, 2] = transition[1, 3] = dt
+        noise = np.zeros((4, 4))
+        q = self.acceleration ** 2
+        for position, velocity in ((0, 2), (1, 3)):
+            noise[position, position] = q * dt ** 4 / 4
+            noise[position, velocity] = noise[velocity, position] = q * dt ** 3 / 2
+            noise[velocity, velocity] = q * dt ** 2
+        state = transition @ self._state
+        covariance = transition @ self._covariance @ transition.T + noise
+
+        measured = np.array([(fix.lon - self.origin[0]) * self._scale[0], (fix.lat - self.origin[1]) * self._scale[1]])
+        residual = measured - state[:2]
+        innovation = covariance[:2, :2] + np.eye(2) * fix.accuracy ** 2
+        inverse = np.linalg.inv(innovation)
+        if residual @ inverse @ residual > 16.0:
+            # Beyond 4 sigma: a multipath jump, unless it keeps happening
+            self.rejected += 1
+            if self.rejected < 3:
+                return self._fix(fix)
+            self._start(fix)
+            return fix
+        self.rejected = 0
+        gain = covariance[:, :2] @ inverse
+        self._state = state + gain @ residual
+        self._covariance = (np.eye(4) - gain @ np.eye(4)[:2]) @ covariance
+        self._time = fix.timestamp
+        return self._fix(fix)
+
+    def _fix(self, fix: Fix) -> Fix:
+        x, y = self._state[:2]
+        accuracy = math.sqrt(max(self._covariance[0, 0], self._covariance[1, 1]))
+        return Fix(float(self.origin[0] + x / self._scale[0]), float(self.origin[1] + y / self._scale[1]),
+                   accuracy, fix.timestamp, fix.source)
+
+
+class LocationProvider(threading.Thread):
+    """Reads, filters and publishes fixes; subscribe() for a queue of them, or read `latest`"""
+
+    def __init__(self, source: str = config.LOCATION_SOURCE,
+                 fallback_after: float = config.LOCATION_FALLBACK_AFTER,
+                 ip_interval: float = config.LOCATION_INTERVAL):
+        super().__init__(name="location", daemon=True)
+        self.source = open_source(source)
+        self.fallback_after = fallback_after
+        self.ip_interval = ip_interval
+        self.filter = PositionFilter()
+        self.latest = None
+        self._subscribers = []
+        self._lock = threading.Lock()
+        self._new_fix = threading.Condition(self._lock)
+        self._stop_event = threading.Event()
+        self._next_ip = 0.0
+        self.fixes = metrics.counter('location_fixes')
+        self.fix_interval = metrics.histogram('location_fix_interval_seconds')
+        metrics.gauge('location_accuracy_meters', lambda: self.latest.accuracy if self.latest else None)
+
+    def subscribe(self, maxsize: int = 1) -> LatestQueue:
+        queue = LatestQueue(maxsize)
+        with self._lock:
+            self._subscribers.append(queue)
+        return queue
+
+    def unsubscribe(self, queue: LatestQueue):
+        """Stop publishing to `queue` and close it, which wakes up a reader waiting on it"""
+        with self._lock:
+            if queue in self._subscribers:
+                self._subscribers.remove(queue)
+        queue.close()
+
+    def current(self, timeout: float = 0.0, max_age: float = config.LOCATION_MAX_AGE) -> Optional[Fix]:
+        """The latest fix if it is recent, otherwise the next one within `timeout` seconds"""
+        with self._new_fix:
+            fresh = lambda: self.latest is not None and time.monotonic() - self.latest.timestamp <= max_age
+            self._new_fix.wait_for(lambda: fresh() or self._stop_event.is_set(), timeout)
+            return self.latest if fresh() else None
+
+    def _publish(self, fix: Fix):
+        if self.latest is not None:
+            self.fix_interval.observe(fix.timestamp - self.latest.timestamp)
+        fix = self.filter.update(fix)
+        self.fixes.inc()
+        with self._new_fix:
+            self.latest = fix
+            subscribers = list(self._subscribers)
+            self._new_fix.notify_all()
+        for queue in subscribers:
+            queue.put(fix)
+
+    def _fallback(self):
+        """An IP lookup if one is due; blocks this thread only"""
+        if time.monotonic() < self._next_ip:
+            return
+        self._next_ip = time.monotonic() + self.ip_interval
+        try:
+            fix = ip_fix()
+        except Exception as e:
+            log.warning("IP location lookup failed: %s", e)
+            return
+        if fix is not None:
+            self._publish(fix)
+
+    def run(self):
+        last_fix = time.monotonic()
+        while not self._stop_event.is_set():
+            if self.source is None:
+                self._fallback()
+                self._stop_event.wait(1.0)
+                continue
+            try:
+                for fix in self.source.fixes(self._stop_event):
+                    if fix is not None:
+                        last_fix = fix.timestamp
+                        self._publish(fix)
+                    elif time.monotonic() - last_fix > self.fallback_after:
+                        self._fallback()
+            except (OSError, ImportError) as e:
+                log.warning("No fixes from %s (%s), falling back to IP lookups", self.source.name, e)
+            if isinstance(self.source, NmeaSource) and not self.source.device:
+                break  # end of the replay
+            # Cover the time until the source is tried again
+            retry = time.monotonic() + self.fallback_after
+            while not self._stop_event.is_set() and time.monotonic() < retry:
+                self._fallback()
+                self._stop_event.wait(1.0)
+        with self._lock:
+            for queue in self._subscribers:
+                queue.close()
+            self._new_fix.notify_all()
+
+    def stop(self):
+        self._stop_event.set()
+        if self.is_alive():
+            self.join(timeout=2.0)
+
+
+def main():
+    parser = argparse.ArgumentParser(description=__doc__, formatter_class=argparse.RawDescriptionHelpFormatter)
+    parser.add_argument('--source', default=config.LOCATION_SOURCE)
+    args = parser.parse_args()
+
+    logging.basicConfig(level=logging.INFO)
+    provider = LocationProvider(args.source)
+    fixes = provider.subscribe(maxsize=64)
+    provider.start()
+    try:
+        while True:
+            fix = fixes.get()
+            if fix is None:
+                break
+            print(f"{fix.lat:.6f},{fix.lon:.6f} +/- {fix.accuracy:.1f} m ({fix.source})")
+    except KeyboardInterrupt:
+        pass
+    provider.stop()
+
+
+if __name__ == "__main__":
+    main()
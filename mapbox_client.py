@@ -0,0 +1,197 @@
+"""
+Mapbox geocoding and walking directions over a pooled HTTP session.
+
+One keep-alive requests.Session is shared by every call, so only the first
+request pays for DNS and the TLS handshake. Requests have explicit connect
+and read timeouts and are retried with exponential backoff on connection
+errors, 429 and 5xx. Geocoding results and routes are kept in a small
+SQLite cache on disk with LRU eviction and a per-entry TTL; routes are keyed
+on origin and destination rounded to ROUTE_CACHE_PRECISION decimal places,
+so asking for the same trip again answers without touching the network.
+
+base_url can point at a local server that mimics the two endpoints.
+"""
+import json
+import logging
+import os
+import sqlite3
+import threading
+import time
+from typing import List, Optional, Tuple
+from urllib.parse import quote
+
+import requests
+from requests.adapters import HTTPAdapter
+from urllib3.util.retry import Retry
+
+import config
+from metrics import metrics
+
+log = logging.getLogger(__name__)
+
+RETRY_STATUSES = (429, 500, 502, 503, 504)
+
+
+class ResponseCache:
+    """
+    Key/value store in SQLite with least-recently-used eviction and a TTL per entry
+    """
+
+    def __init__(self, path: str, max_entries: int = config.CACHE_SIZE):
+        self.max_entries = max_entries
+        if path != ':memory:':
+            os.makedirs(os.path.dirname(os.path.abspath(path)), exist_ok=True)
+        self._db = sqlite3.connect(path, check_same_thread=False)
+        self._lock = threading.Lock()
+        with self._lock, self._db:
+            self._db.execute("CREATE TABLE IF NOT EXISTS entries ("
+                             "key TEXT PRIMARY KEY, value TEXT, expires REAL, accessed REAL)")
+            self._db.execute("CREATE INDEX IF NOT EXISTS entries_accessed ON entries (accessed)")
+
+    def get(self, key: str):
+        now = time.time()
+        with self._lock, self._db:
+            row = self._db.execute("SELECT value, expires FROM entries WHERE key = ?", (key,)).fetchone()
+            if row is None:
+                return None
+            if row[1] < now:
+                self._db.execute("DELETE FROM entries WHERE key = ?", (key,))
+                return None
+            self._db.execute("UPDATE entries SET accessed = ? WHERE key = ?", (now, key))
+        return json.loads(row[0])
+
+    def put(self, key: str, value, ttl: float):
+        now = time.time()
+        with self._lock, self._db:
+            self._db.execute("INSERT OR REPLACE INTO entries VALUES (?, ?, ?, ?)",
+                             (key, json.dumps(value), now + ttl, now))
+            # Drop the least recently used entries beyond the limit
+            self._db.execute("DELETE FROM entries WHERE key IN (SELECT key FROM entries "
+                             "ORDER BY accessed DESC LIMIT -1 OFFSET ?)", (self.max_entries,))
+
+    def __len__(self):
+        with self._lock:
+            return self._db.execute("SELECT COUNT(*) FROM entries").fetchone()[0]
+
+    def close(self):
+        with self._lock:
+            self._db.close()
+
+
+def round_coords(coords: str, precision: int) -> str:
+    """Round a "longitude,latitude" string for use in a cache key"""
+    return ','.join(f"{float(value):.{precision}f}" for value in coords.split(','))
+
+
+class MapboxClient:
+    def __init__(self, api_key: str = config.MAPBOX_API_KEY, base_url: str = config.MAPBOX_BASE_URL,
+                 cache: Optional[ResponseCache] = None, retries: int = config.HTTP_RETRIES,
+                 timeout: Tuple[float, float] = (config.HTTP_CONNECT_TIMEOUT, config.HTTP_READ_TIMEOUT),
+                 backoff: float = 0.3):
+        self.api_key = api_key
+        self.base_url = base_url.rstrip('/')
+        self.timeout = timeout
+        if cache is None and config.MAPBOX_CACHE:
+            cache = ResponseCache(config.MAPBOX_CACHE)
+        self.cache = cache
+
+        retry = Retry(total=retries, connect=retries, read=retries, status=retries,
+                      backoff_factor=backoff, status_forcelist=RETRY_STATUSES,
+                      allowed_methods=frozenset(['GET']), raise_on_status=False)
+        self.session = requests.Session()
+        adapter = HTTPAdapter(max_retries=retry, pool_maxsize=4)
+        self.session.mount('https://', adapter)
+        self.session.mount('http://', adapter)
+
+        self.round_trip = metrics.histogram('http_round_trip_seconds')
+        self.cache_hits = metrics.counter('mapbox_cache_hits')
+        self.cache_misses = metrics.counter('mapbox_cache_misses')
+
+    def _get(self, path: str, params: dict) -> Optional[dict]:
+        params = dict(params, access_token=self.api_key)
+        start = time.perf_counter()
+        try:
+            response = self.session.get(self.base_url + path, params=params, timeout=self.timeout)
+        except requests.RequestException as e:
+            log.error("Request to %s failed: %s", path, e)
+            return None
+        finally:
+            self.round_trip.observe(time.perf_counter() - start)
+        if response.status_code != 200:
+            log.error("HTTP Error: %s %s", response.status_code, response.text)
+            return None
+        try:
+            data = response.json()
+        except ValueError as e:  # e.g. a captive portal's login page
+            log.error("Unreadable response from %s: %s", path, e)
+            return None
+        if not isinstance(data, dict):
+            log.error("Unexpected response from %s: %.100r", path, data)
+            return None
+        return data
+
+    def _cached(self, key: str):
+        if self.cache is None:
+            return None
+        value = self.cache.get(key)
+        if value is None:
+            self.cache_misses.inc()
+        else:
+            self.cache_hits.inc()
+        return value
+
+    def geocode(self, address: str) -> Optional[str]:
+        """Coordinates of an address as "longitude,latitude", or None if nothing matched"""
+        key = 'geocode:' + ' '.join(address.lower().split())
+        cached = self._cached(key)
+        if cached is not None:
+            return cached
+        data = self._get(f"/geocoding/v5/mapbox.places/{quote(address)}.json", {})
+        if data is None:
+            return None
+        if not data.get('features'):
+            log.error("No matching location found.")
+            return None
+        coordinates = data['features'][0]['geometry']['coordinates']
+        coords = f"{coordinates[0]},{coordinates[1]}"  # longitude,latitude
+        if self.cache is not None:
+            self.cache.put(key, coords, config.GEOCODE_TTL)
+        return coords
+
+    def directions(self, origin: str, destination: str) -> Optional[dict]:
+        """
+        Walking route as {'coordinates': [[lon, lat], ...], 'steps': [[instruction, meters], ...]},
+        or None on failure
+        """
+        precision = config.ROUTE_CACHE_PRECISION
+        key = f"directions:{round_coords(origin, precision)};{round_coords(destination, precision)}"
+        cached = self._cached(key)
+        if cached is not None:
+            return cached
+        data = self._get(f"/directions/v5/mapbox/walking/{origin};{destination}",
+                         {'geometries': 'geojson', 'overview': 'full', 'steps': 'true'})
+        if data is None:
+            return None
+        if not data.get('routes'):
+            log.error("No routes found.")
+            return None
+        best = data['routes'][0]
+        route = {
+            'coordinates': best['geometry']['coordinates'],
+            'steps': [[step['maneuver']['instruction'], step['distance']] for step in best['legs'][0]['steps']],
+        }
+        if self.cache is not None:
+            self.cache.put(key, route, config.ROUTE_TTL)
+        return route
+
+    def walking_route(self, origin: str, destination: str) -> Optional[List[Tuple[str, float]]]:
+        """Walking directions as (instruction, distance in meters) tuples, or None on failure"""
+        route = self.directions(origin, destination)
+        if route is None:
+            return None
+        return [tuple(step) for step in route['steps']]
+
+    def close(self):
+        self.session.close()
+        if self.cache is not None:
+            self.cache.close()
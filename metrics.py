@@ -0,0 +1,162 @@
+"""
+Always-on, low-overhead telemetry for the detection and navigation loops.
+
+Counters and histograms live in preallocated Python lists: recording a
+sample is a list store and two integer updates, well under a microsecond,
+so the hot paths can call them on every frame. Percentiles are only
+computed when a snapshot is taken, which the exporter thread does every
+METRICS_INTERVAL seconds, appending a JSON line or rewriting a Prometheus
+text file.
+
+    from metrics import metrics
+    inference_time = metrics.histogram('inference_seconds')
+    inference_time.observe(elapsed)
+"""
+import json
+import logging
+import math
+import os
+import threading
+import time
+
+import numpy as np
+
+import config
+
+log = logging.getLogger(__name__)
+
+
+class Counter:
+    __slots__ = ('value',)
+
+    def __init__(self):
+        self.value = 0
+
+    def inc(self, amount: int = 1):
+        self.value += amount
+
+
+class Histogram:
+    """The last `size` samples in a ring, plus all-time count and sum"""
+    __slots__ = ('values', 'size', 'count', 'total')
+
+    def __init__(self, size: int):
+        self.values = [0.0] * size
+        self.size = size
+        self.count = 0
+        self.total = 0.0
+
+    def observe(self, value: float):
+        self.values[self.count % self.size] = value
+        self.count += 1
+        self.total += value
+
+    def window(self) -> np.ndarray:
+        return np.array(self.values[:min(self.count, self.size)])
+
+
+class Metrics:
+    def __init__(self, window: int = config.METRICS_WINDOW):
+        self.window = window
+        self.counters = {}
+        self.histograms = {}
+        self.gauges = {}  # name -> callable evaluated at snapshot time
+        self._exporter = None
+
+    def counter(self, name: str) -> Counter:
+        if name not in self.counters:
+            self.counters[name] = Counter()
+        return self.counters[name]
+
+    def histogram(self, name: str) -> Histogram:
+        if name not in self.histograms:
+            self.histograms[name] = Histogram(self.window)
+        return self.histograms[name]
+
+    def gauge(self, name: str, read):
+        self.gauges[name] = read
+
+    def snapshot(self) -> dict:
+        histograms = {}
+        for name, histogram in list(self.histograms.items()):
+            values = histogram.window()
+            summary = {'count': histogram.count, 'sum': _number(histogram.total)}
+            if len(values):
+                p50, p95, p99 = np.percentile(values, [50, 95, 99])
+                summary.update(mean=_number(values.mean()), p50=_number(p50), p95=_number(p95),
+                               p99=_number(p99), max=_number(values.max()))
+            histograms[name] = summary
+        return {
+            'time': time.time(),
+            'counters': {name: c.value for name, c in list(self.counters.items())},
+            'gauges': {name: _number(read()) for name, read in list(self.gauges.items())},
+            'histograms': histograms,
+        }
+
+    def start_exporter(self, path: str = config.METRICS_FILE, fmt: str = config.METRICS_FORMAT,
+                       interval: float = config.METRICS_INTERVAL):
+        """Export snapshots from a background thread. Does nothing without a path."""
+        if not path or self._exporter is not None:
+            return
+        self._exporter = threading.Thread(target=self._export_loop, args=(path, fmt, interval),
+                                          name="metrics-exporter", daemon=True)
+        self._exporter.start()
+
+    def _export_loop(self, path: str, fmt: str, interval: float):
+        while True:
+            time.sleep(interval)
+            try:
+                self.export(path, fmt)
+            except OSError as e:
+                log.warning("Could not export metrics to %s: %s", path, e)
+
+    def export(self, path: str, fmt: str = 'jsonl'):
+        snapshot = self.snapshot()
+        if fmt == 'prometheus':
+            # Rewrite atomically so a scraper never sees a half-written file
+            tmp_path = path + '.tmp'
+            with open(tmp_path, 'w') as f:
+                f.write(to_prometheus(snapshot))
+            os.replace(tmp_path, path)
+        else:
+            with open(path, 'a') as f:
+                f.write(json.dumps(snapshot, allow_nan=False) + '\n')
+
+
+def _number(value):
+    """A float, or None for a missing or non-finite value so the JSON lines stay valid JSON"""
+    if value is None:
+        return None
+    value = float(value)
+    return value if math.isfinite(value) else None
+
+
+def to_prometheus(snapshot: dict, prefix: str = 'visualeyeze') -> str:
+    lines = []
+    for name, value in snapshot['counters'].items():
+        # The TYPE line names the sample exactly, _total suffix included
+        lines.append(f"# TYPE {prefix}_{name}_total counter")
+        lines.append(f"{prefix}_{name}_total {value}")
+    for name, value in snapshot['gauges'].items():
+        if value is None:
+            continue
+        lines.append(f"# TYPE {prefix}_{name} gauge")
+        lines.append(f"{prefix}_{name} {value}")
+    for name, summary in snapshot['histograms'].items():
+        # _sum and _count are the summary's own series and share its TYPE line
+        lines.append(f"# TYPE {prefix}_{name} summary")
+        for quantile in ('p50', 'p95', 'p99'):
+            if summary.get(quantile) is not None:
+                lines.append(f'{prefix}_{name}{{quantile="0.{quantile[1:]}"}} {summary[quantile]}')
+        lines.append(f"{prefix}_{name}_sum {summary['sum'] if summary['sum'] is not None else 'NaN'}")
+        lines.append(f"{prefix}_{name}_count {summary['count']}")
+    return '\n'.join(lines) + '\n'
+
+
+def setup_logging(level: str = config.LOG_LEVEL):
+    logging.basicConfig(level=getattr(logging, level.upper(), logging.INFO),
+                        format="%(asctime)s %(levelname)s %(name)s: %(message)s")
+
+
+# Process-wide registry shared by every module
+metrics = Metrics()
@@ -0,0 +1,165 @@
+"""
+Latency-budgeted model selection.
+
+ModelManager stands in for a YOLO model: predict() runs whichever rung of a
+ladder of (weights, input size) pairs currently fits the frame-time budget.
+It measures real per-frame inference time and system CPU load, steps down
+when over budget, and steps back up only once the measured cost of the next
+rung fits again, with a dwell period and a hysteresis band so it doesn't
+oscillate. A rung's measurement expires after `retry_after` seconds, so one
+slow spell (a CPU spike, the first inference after loading) doesn't keep
+the manager below it for good. Weights for a new rung load on a background thread while the
+current rung keeps serving frames.
+
+PeriodicDetector covers the cascade case: a large model that only needs to
+run now and then (room classification) on its own thread, next to a small
+model that runs every frame for hazards.
+"""
+import logging
+import threading
+import time
+
+import psutil
+
+import config
+from backends import load_model
+from pipeline import LatestQueue, Stage
+
+log = logging.getLogger(__name__)
+
+# Cheapest first
+DEFAULT_LADDER = [
+    ('yolov8n.pt', 320),
+    ('yolov8n.pt', 480),
+    ('yolov8n.pt', 640),
+    ('yolov8s.pt', 640),
+    ('yolov8m.pt', 640),
+    ('yolov8x.pt', 640),
+]
+
+
+class ModelManager:
+    def __init__(self, start_weights: str, ladder=None,
+                 target_latency: float = config.TARGET_LATENCY,
+                 cpu_limit: float = config.CPU_LIMIT,
+                 hysteresis: float = 0.2, dwell_frames: int = 30, retry_after: float = 30.0):
+        self.ladder = ladder or DEFAULT_LADDER
+        self.target_latency = target_latency
+        self.cpu_limit = cpu_limit
+        self.hysteresis = hysteresis
+        self.dwell_frames = dwell_frames
+        self.retry_after = retry_after
+        # Start on the largest input size for the requested weights
+        levels = [i for i, (w, _) in enumerate(self.ladder) if w == start_weights]
+        if not levels:
+            raise ValueError(f"{start_weights} is not in the model ladder "
+                             f"({', '.join(sorted({w for w, _ in self.ladder}))}); pass a ladder that includes it")
+        self.level = max(levels)
+        self._models = {start_weights: load_model(start_weights)}
+        self._loading = set()
+        self._lock = threading.Lock()
+        self.latency = {}  # ladder level -> EMA of inference seconds
+        self._measured = {}  # ladder level -> monotonic time of its last measurement
+        self._frames_on_level = 0
+        self.switches = 0
+        psutil.cpu_percent(interval=None)  # prime the CPU counter
+
+    @property
+    def names(self):
+        return self._models[self.ladder[self.level][0]].names
+
+    @property
+    def weights(self) -> str:
+        return self.ladder[self.level][0]
+
+    @property
+    def imgsz(self) -> int:
+        return self.ladder[self.level][1]
+
+    def predict(self, image, imgsz: int = None, **kwargs):
+        """Run the current rung; a smaller `imgsz` (e.g. for a cropped region) is honoured, a larger one capped"""
+        level = self.level
+        weights, tier_imgsz = self.ladder[level]
+        imgsz = tier_imgsz if imgsz is None else min(imgsz, tier_imgsz)
+        start = time.perf_counter()
+        results = self._models[weights].predict(image, imgsz=imgsz, **kwargs)
+        # The budget is per frame; a batch from several cameras shares the call's time
+        frames = len(image) if isinstance(image, (list, tuple)) else 1
+        self.record(level, (time.perf_counter() - start) / max(frames, 1), frames)
+        return results
+
+    def record(self, level: int, elapsed: float, frames: int = 1):
+        """Account `frames` frames that took `elapsed` seconds each on `level`"""
+        previous = self.latency.get(level)
+        self.latency[level] = elapsed if previous is None else 0.8 * previous + 0.2 * elapsed
+        self._measured[level] = time.monotonic()
+        self._frames_on_level += frames
+        if self.target_latency > 0 and self._frames_on_level >= self.dwell_frames:
+            self._adapt()
+
+    def _adapt(self):
+        latency = self.latency[self.level]
+        cpu = psutil.cpu_percent(interval=None)
+        if (latency > self.target_latency * (1 + self.hysteresis) or cpu > self.cpu_limit) and self.level > 0:
+            self._switch(self.level - 1)
+        elif (latency < self.target_latency * (1 - self.hysteresis) and cpu < self.cpu_limit
+              and self.level + 1 < len(self.ladder)):
+            # Only climb if the next rung was measured to fit, or its measurement is missing or too old
+            upper = self.level + 1
+            if time.monotonic() - self._measured.get(upper, float('-inf')) > self.retry_after:
+                self.latency.pop(upper, None)  # measure it afresh rather than averaging with the old spell
+            if self.latency.get(upper, 0.0) < self.target_latency:
+                self._switch(upper)
+
+    def _switch(self, level: int):
+        weights = self.ladder[level][0]
+        with self._lock:
+            if weights not in self._models:
+                if weights not in self._loading:
+                    self._loading.add(weights)
+                    threading.Thread(target=self._load, args=(weights, level), daemon=True).start()
+                return
+        self.level = level
+        self._frames_on_level = 0
+        self.switches += 1
+        log.info("Model tier: %s @ %dpx", weights, self.ladder[level][1])
+
+    def _load(self, weights: str, level: int):
+        model = load_model(weights)
+        with self._lock:
+            self._models[weights] = model
+            self._loading.discard(weights)
+        self._switch(level)
+
+
+class PeriodicDetector:
+    """
+    Runs a model on a background thread at most every `interval` seconds and keeps its newest boxes
+    """
+
+    def __init__(self, weights: str, interval: float = config.ROOM_MODEL_INTERVAL):
+        self.weights = weights
+        self.interval = interval
+        self.boxes = None
+        self.model = None
+        self._frames = LatestQueue(maxsize=1)
+        self._last_submit = float('-inf')
+        self._stage = Stage(f"periodic-{weights}", self._frames, self._run)
+        self._stage.start()
+
+    def submit(self, image, now: float = None):
+        now = time.monotonic() if now is None else now
+        if now - self._last_submit >= self.interval:
+            self._last_submit = now
+            # Copy, the caller may hand its capture buffer back before the model gets to it
+            self._frames.put(image.copy())
+
+    def _run(self, image):
+        if self.model is None:
+            self.model = load_model(self.weights)
+        results = self.model.predict(image, verbose=False)
+        self.boxes = results[0].boxes.data.cpu().numpy()
+
+    def stop(self):
+        self._stage.stop()
+        self._frames.close()
@@ -0,0 +1,89 @@
+"""
+Motion-gated keyframe scheduling.
+
+Running YOLO on every frame is wasted work while the wearer stands still in
+front of an unchanged scene. KeyframeScheduler compares each frame with the
+last keyframe on a small grayscale thumbnail, estimates the global shift
+between them with phase correlation and only asks for a new forward pass
+when the scene changed beyond that shift, moved too far, or the keyframe got
+too old. In between, the keyframe's boxes are carried forward by the
+estimated shift.
+"""
+import time
+
+import cv2
+import numpy as np
+
+import config
+
+
+class KeyframeScheduler:
+    def __init__(self, threshold: float = config.MOTION_THRESHOLD,
+                 max_shift: float = config.MOTION_MAX_SHIFT,
+                 max_staleness: float = config.MAX_KEYFRAME_AGE,
+                 size=(64, 48)):
+        self.threshold = threshold
+        self.max_shift = max_shift
+        self.max_staleness = max_staleness
+        self.size = size
+        self._window = cv2.createHanningWindow(size, cv2.CV_32F)
+        self._reference = None
+        self._current = None
+        self._reference_time = 0.0
+        self._boxes = None
+        self._scale = (1.0, 1.0)
+        self.shift = (0.0, 0.0)  # estimated shift since the keyframe, in thumbnail pixels
+        self.keyframes = 0
+        self.skipped = 0
+
+    def _thumbnail(self, image: np.ndarray) -> np.ndarray:
+        gray = cv2.cvtColor(image, cv2.COLOR_BGR2GRAY) if image.ndim == 3 else image
+        return cv2.resize(gray, self.size, interpolation=cv2.INTER_AREA).astype(np.float32)
+
+    def should_infer(self, image: np.ndarray, now: float = None) -> bool:
+        """
+        True if `image` needs a real forward pass, False if propagate() is good enough
+        """
+        now = time.monotonic() if now is None else now
+        self._current = self._thumbnail(image)
+        if self._reference is None or now - self._reference_time > self.max_staleness:
+            return True
+
+        (dx, dy), _ = cv2.phaseCorrelate(self._reference, self._current, self._window)
+        if abs(dx) > self.max_shift * self.size[0] or abs(dy) > self.max_shift * self.size[1]:
+            return True
+
+        # Whatever global motion doesn't explain is new content
+        shift = np.float32([[1, 0, dx], [0, 1, dy]])
+        aligned = cv2.warpAffine(self._reference, shift, self.size, borderMode=cv2.BORDER_REPLICATE)
+        change = float(np.mean(cv2.absdiff(aligned, self._current))) / 255.0
+        if change > self.threshold:
+            return True
+
+        self.shift = (dx, dy)
+        self.skipped += 1
+        return False
+
+    def keyframe(self, image: np.ndarray, boxes: np.ndarray, now: float = None):
+        """
+        Record a frame that went through the model together with its (N, 6) detections
+        """
+        self._reference = self._current if self._current is not None else self._thumbnail(image)
+        self._reference_time = time.monotonic() if now is None else now
+        self._boxes = np.asarray(boxes, dtype=np.float32)
+        self._scale = (image.shape[1] / self.size[0], image.shape[0] / self.size[1])
+        self.shift = (0.0, 0.0)
+        self.keyframes += 1
+
+    def propagate(self) -> np.ndarray:
+        """
+        Keyframe detections moved by the shift estimated in the last should_infer() call
+        """
+        boxes = self._boxes.copy()
+        boxes[:, [0, 2]] += self.shift[0] * self._scale[0]
+        boxes[:, [1, 3]] += self.shift[1] * self._scale[1]
+        return boxes
+
+    def keyframe_ratio(self) -> float:
+        total = self.keyframes + self.skipped
+        return self.keyframes / total if total else 1.0
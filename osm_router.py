@@ -0,0 +1,242 @@
+"""
+Offline walking routes from a local OpenStreetMap extract.
+
+`build` streams an .osm XML file once, keeps the ways a pedestrian can use
+and writes a compact graph: node coordinates and a CSR adjacency (offsets,
+neighbours, lengths, street name ids) as .npy files next to a names.json.
+Loading memory-maps those arrays, so opening a city-sized graph costs a few
+file opens rather than a parse. Routes are found with A* under a straight
+line distance heuristic and come back in the same shape as MapboxClient:
+(instruction, meters) steps plus the route coordinates.
+
+    python osm_router.py build city.osm graph/
+    python osm_router.py route graph/ 13.3889,52.5170 13.3777,52.5163
+"""
+import heapq
+import json
+import math
+import os
+import sys
+import xml.etree.ElementTree as ET
+from typing import List, Optional, Tuple
+
+import numpy as np
+
+EARTH_RADIUS = 6371000.0  # meters
+
+WALKABLE = {
+    'footway', 'path', 'pedestrian', 'steps', 'living_street', 'residential', 'service', 'track',
+    'unclassified', 'tertiary', 'tertiary_link', 'secondary', 'secondary_link', 'primary',
+    'primary_link', 'cycleway', 'bridleway', 'corridor',
+}
+NO_ACCESS = {'no', 'private'}
+COMPASS = ('north', 'northeast', 'east', 'southeast', 'south', 'southwest', 'west', 'northwest')
+ARRAYS = ('coords', 'offsets', 'neighbors', 'lengths', 'names')
+
+
+def _walkable(tags: dict) -> bool:
+    highway = tags.get('highway')
+    if highway is None:
+        return tags.get('foot') in ('yes', 'designated')
+    if tags.get('foot') in NO_ACCESS or (tags.get('access') in NO_ACCESS and tags.get('foot') is None):
+        return False
+    return highway in WALKABLE or tags.get('foot') in ('yes', 'designated')
+
+
+def _distance(lon1, lat1, lon2, lat2):
+    """Equirectangular distance in meters, exact enough between neighbouring nodes"""
+    x = np.radians(lon2 - lon1) * np.cos(np.radians((lat1 + lat2) / 2))
+    y = np.radians(lat2 - lat1)
+    return EARTH_RADIUS * np.sqrt(x * x + y * y)
+
+
+def build(osm_path: str, out_dir: str):
+    """Extract the pedestrian graph from an .osm file into out_dir"""
+    node_coords = {}
+    ways = []  # (node ids, name id)
+    names = ['']
+    name_ids = {'': 0}
+
+    for _, element in ET.iterparse(osm_path, events=('end',)):
+        if element.tag == 'node':
+            node_coords[int(element.get('id'))] = (float(element.get('lon')), float(element.get('lat')))
+            element.clear()
+        elif element.tag == 'way':
+            tags = {tag.get('k'): tag.get('v') for tag in element.iter('tag')}
+            if _walkable(tags):
+                name = tags.get('name', '')
+                if name not in name_ids:
+                    name_ids[name] = len(names)
+                    names.append(name)
+                ways.append(([int(nd.get('ref')) for nd in element.iter('nd')], name_ids[name]))
+            element.clear()
+        elif element.tag == 'relation':
+            element.clear()
+
+    # Renumber only the nodes walkable ways use
+    index = {}
+    sources, targets, edge_names = [], [], []
+    for refs, name_id in ways:
+        refs = [ref for ref in refs if ref in node_coords]
+        for a, b in zip(refs, refs[1:]):
+            if a == b:
+                continue
+            for ref in (a, b):
+                if ref not in index:
+                    index[ref] = len(index)
+            sources += (index[a], index[b])
+            targets += (index[b], index[a])
+            edge_names += (name_id, name_id)
+
+    coords = np.empty((len(index), 2), dtype=np.float64)
+    for ref, i in index.items():
+        coords[i] = node_coords[ref]
+    sources = np.asarray(sources, dtype=np.int32)
+    targets = np.asarray(targets, dtype=np.int32)
+    order = np.argsort(sources, kind='stable')
+    sources, targets = sources[order], targets[order]
+    lengths = _distance(coords[sources, 0], coords[sources, 1], coords[targets, 0], coords[targets, 1])
+    offsets = np.zeros(len(index) + 1, dtype=np.int64)
+    np.cumsum(np.bincount(sources, minlength=len(index)), out=offsets[1:])
+
+    os.makedirs(out_dir, exist_ok=True)
+    arrays = {
+        'coords': coords,
+        'offsets': offsets,
+        'neighbors': targets,
+        'lengths': lengths.astype(np.float32),
+        'names': np.asarray(edge_names, dtype=np.int32)[order],
+    }
+    for name, array in arrays.items():
+        np.save(os.path.join(out_dir, name + '.npy'), array)
+    with open(os.path.join(out_dir, 'names.json'), 'w') as f:
+        json.dump(names, f)
+    return len(index), len(targets)
+
+
+def _bearing(a, b) -> float:
+    """Compass bearing from a to b in degrees, 0 = north, clockwise"""
+    x = math.radians(b[0] - a[0]) * math.cos(math.radians((a[1] + b[1]) / 2))
+    y = math.radians(b[1] - a[1])
+    return math.degrees(math.atan2(x, y)) % 360
+
+
+def _turn(change: float) -> str:
+    change = (change + 180) % 360 - 180
+    if abs(change) < 20:
+        return "Continue straight"
+    if abs(change) > 150:
+        return "Make a U-turn"
+    side = "right" if change > 0 else "left"
+    return f"Turn slightly {side}" if abs(change) < 45 else f"Turn {side}"
+
+
+class OfflineRouter:
+    def __init__(self, graph_dir: str):
+        arrays = {name: np.load(os.path.join(graph_dir, name + '.npy'), mmap_mode='r') for name in ARRAYS}
+        self.coords = arrays['coords']
+        self.offsets = arrays['offsets']
+        self.neighbors = arrays['neighbors']
+        self.lengths = arrays['lengths']
+        self.edge_names = arrays['names']
+        with open(os.path.join(graph_dir, 'names.json')) as f:
+            self.names = json.load(f)
+
+    def nearest(self, lon: float, lat: float) -> int:
+        return int(np.argmin(_distance(lon, lat, self.coords[:, 0], self.coords[:, 1])))
+
+    def _edges(self, u: int):
+        start, end = self.offsets[u], self.offsets[u + 1]
+        return zip(self.neighbors[start:end].tolist(), self.lengths[start:end].tolist(),
+                   self.edge_names[start:end].tolist())
+
+    def shortest_path(self, source: int, target: int) -> Optional[List[Tuple[int, int]]]:
+        """A* from source to target; the path as (node, name id of the edge into it) pairs"""
+        tlon, tlat = self.coords[target].tolist()
+        cos_lat = math.cos(math.radians(tlat))
+        scale = math.radians(1) * EARTH_RADIUS
+
+        def heuristic(node):
+            lon, lat = self.coords[node].tolist()
+            return scale * math.hypot((lon - tlon) * cos_lat, lat - tlat)
+
+        best = {source: 0.0}
+        came_from = {source: (None, 0)}
+        heap = [(heuristic(source), 0.0, source)]
+        while heap:
+            _, cost, u = heapq.heappop(heap)
+            if u == target:
+                path = []
+                while u is not None:
+                    previous, name_id = came_from[u]
+                    path.append((u, name_id))
+                    u = previous
+                return path[::-1]
+            if cost > best[u]:
+                continue
+            for v, length, name_id in self._edges(u):
+                new_cost = cost + length
+                if new_cost < best.get(v, math.inf):
+                    best[v] = new_cost
+                    came_from[v] = (u, name_id)
+                    heapq.heappush(heap, (new_cost + heuristic(v), new_cost, v))
+        return None
+
+    def directions(self, origin: str, destination: str) -> Optional[dict]:
+        """
+        Same shape as MapboxClient.directions:
+        {'coordinates': [[lon, lat], ...], 'steps': [[instruction, meters], ...]}
+        """
+        source = self.nearest(*(float(v) for v in origin.split(',')))
+        target = self.nearest(*(float(v) for v in destination.split(',')))
+        path = self.shortest_path(source, target)
+        if path is None:
+            return None
+        coordinates = [self.coords[node].tolist() for node, _ in path]
+        return {'coordinates': coordinates, 'steps': self._steps(path, coordinates)}
+
+    def walking_route(self, origin: str, destination: str) -> Optional[List[Tuple[str, float]]]:
+        route = self.directions(origin, destination)
+        if route is None:
+            return None
+        return [tuple(step) for step in route['steps']]
+
+    def _steps(self, path, coordinates) -> List[List]:
+        # One step per run of edges along the same street
+        steps = []
+        name_id = None
+        heading = None
+        for i in range(1, len(path)):
+            a, b = coordinates[i - 1], coordinates[i]
+            length = _distance(a[0], a[1], b[0], b[1])
+            bearing = _bearing(a, b)
+            if path[i][1] != name_id:
+                name = self.names[path[i][1]]
+                if heading is None:
+                    text = f"Head {COMPASS[int((bearing + 22.5) // 45) % 8]}"
+                    preposition = "on"
+                else:
+                    text = _turn(bearing - heading)
+                    preposition = "onto"
+                steps.append([f"{text} {preposition} {name}" if name else text, 0.0])
+                name_id = path[i][1]
+            steps[-1][1] += float(length)
+            heading = bearing
+        steps.append(["You have arrived at your destination", 0.0])
+        return steps
+
+
+def main():
+    if len(sys.argv) == 4 and sys.argv[1] == 'build':
+        nodes, edges = build(sys.argv[2], sys.argv[3])
+        print(f"Wrote {nodes} nodes and {edges} directed edges to {sys.argv[3]}")
+    elif len(sys.argv) == 5 and sys.argv[1] == 'route':
+        route = OfflineRouter(sys.argv[2]).walking_route(sys.argv[3], sys.argv[4])
+        for instruction, distance in route or []:
+            print(f"{instruction} ({distance:.0f} m)")
+    else:
+        print(__doc__)
+
+
+if __name__ == "__main__":
+    main()
@@ -0,0 +1,324 @@
+"""
+Pre-rendered audio for the fixed announcements.
+
+Hazard warnings come from a small, fixed set of sentences (a template per
+hazard level over the model's class names), so they are synthesized once
+into a phrase pack: a single file with a JSON index followed by 16-bit mono
+PCM, memory-mapped when loaded. SpeechService plays them through a
+PortAudio output stream that is always running, so an announcement starts
+within one audio block of being picked. Leading and trailing silence is
+trimmed when the pack is built. Text that isn't in the pack, such as street
+names, is synthesized when it is first spoken and kept in an LRU cache.
+
+    python phrase_cache.py build --weights yolov8n.pt
+    python phrase_cache.py build --phrases-file phrases.json
+"""
+import argparse
+import collections
+import contextlib
+import json
+import logging
+import os
+import subprocess
+import sys
+import tempfile
+import threading
+import wave
+from typing import Dict, Iterable, List, Optional
+
+import numpy as np
+
+import config
+
+log = logging.getLogger(__name__)
+
+MAGIC = b'VEPHRASE'
+SAMPLE_RATE = 22050  # espeak's native rate
+
+
+def read_wav(path: str, sample_rate: int = SAMPLE_RATE) -> np.ndarray:
+    """Mono int16 samples at `sample_rate` from a 16-bit WAV file"""
+    with wave.open(path, 'rb') as f:
+        if f.getsampwidth() != 2:
+            raise ValueError(f"{path}: expected 16-bit samples")
+        samples = np.frombuffer(f.readframes(f.getnframes()), dtype=np.int16)
+        rate, channels = f.getframerate(), f.getnchannels()
+    if channels > 1:
+        samples = samples.reshape(-1, channels).mean(axis=1)
+    if rate != sample_rate:
+        positions = np.arange(0, len(samples), rate / sample_rate)
+        samples = np.interp(positions, np.arange(len(samples)), samples)
+    return np.asarray(samples, dtype=np.int16)
+
+
+def trim_silence(samples: np.ndarray, threshold: int = 200, pad: int = SAMPLE_RATE // 100) -> np.ndarray:
+    """Cut leading and trailing silence, keeping `pad` samples on each side"""
+    loud = np.flatnonzero(np.abs(samples.astype(np.int32)) > threshold)
+    if not len(loud):
+        return samples[:0]
+    return samples[max(loud[0] - pad, 0):loud[-1] + pad]
+
+
+def synthesize(engine, texts: Iterable[str], sample_rate: int = SAMPLE_RATE) -> Dict[str, np.ndarray]:
+    """
+    Render each text with a pyttsx3 engine, in one run of its event loop. Texts the
+    engine's driver can't write as WAV (e.g. AIFF on macOS) are left out.
+    """
+    texts = list(texts)
+    clips = {}
+    with tempfile.TemporaryDirectory() as directory:
+        paths = [os.path.join(directory, f"{i}.wav") for i in range(len(texts))]
+        for text, path in zip(texts, paths):
+            engine.save_to_file(text, path)
+        engine.runAndWait()
+        for text, path in zip(texts, paths):
+            try:
+                clips[text] = trim_silence(read_wav(path, sample_rate))
+            except (OSError, EOFError, ValueError, wave.Error) as e:
+                log.warning("Could not render %r: %s", text, e)
+    return clips
+
+
+class PhrasePack:
+    """Read-only, memory-mapped phrase pack; empty when the file doesn't exist"""
+
+    def __init__(self, path: str = config.PHRASE_PACK):
+        self.path = path
+        self.index = {}  # text -> (start, end) in samples
+        self.sample_rate = SAMPLE_RATE
+        self.voice = None  # (rate, volume) the phrases were spoken with
+        self.audio = np.empty(0, dtype=np.int16)
+        if os.path.exists(path):
+            self._load()
+
+    def _load(self):
+        with open(self.path, 'rb') as f:
+            if f.read(len(MAGIC)) != MAGIC:
+                raise ValueError(f"{self.path} is not a phrase pack")
+            size = int.from_bytes(f.read(8), 'little')
+            header = json.loads(f.read(size))
+        self.index = {text: tuple(span) for text, span in header['phrases'].items()}
+        self.sample_rate = header['sample_rate']
+        self.voice = tuple(header['voice'])
+        if header['samples']:
+            self.audio = np.memmap(self.path, dtype=np.int16, mode='r', offset=header['offset'],
+                                   shape=(header['samples'],))
+
+    def __contains__(self, text: str) -> bool:
+        return text in self.index
+
+    def __len__(self) -> int:
+        return len(self.index)
+
+    def get(self, text: str) -> Optional[np.ndarray]:
+        span = self.index.get(text)
+        return None if span is None else self.audio[span[0]:span[1]]
+
+    def missing(self, texts: Iterable[str], voice) -> List[str]:
+        """Texts that aren't in the pack, or all of them if it was spoken with another voice"""
+        if self.voice != tuple(voice):
+            return list(texts)
+        return [text for text in texts if text not in self.index]
+
+
+def write_pack(path: str, clips: Dict[str, np.ndarray], voice, sample_rate: int = SAMPLE_RATE):
+    """Write a pack atomically, so readers never see half a file"""
+    phrases, start = {}, 0
+    for text, samples in clips.items():
+        phrases[text] = (start, start + len(samples))
+        start += len(samples)
+    header = {'sample_rate': sample_rate, 'voice': list(voice), 'samples': start, 'phrases': phrases, 'offset': 0}
+    # The offset depends on the header's own length; pad it so the audio is 8-byte aligned
+    size = len(json.dumps(header).encode()) + 32
+    header['offset'] = -(-(len(MAGIC) + 8 + size) // 8) * 8
+    encoded = json.dumps(header).encode().ljust(header['offset'] - len(MAGIC) - 8)
+
+    directory = os.path.dirname(os.path.abspath(path))
+    os.makedirs(directory, exist_ok=True)
+    fd, tmp_path = tempfile.mkstemp(dir=directory, suffix='.tmp')
+    with os.fdopen(fd, 'wb') as f:
+        f.write(MAGIC)
+        f.write(len(encoded).to_bytes(8, 'little'))
+        f.write(encoded)
+        for samples in clips.values():
+            f.write(np.asarray(samples, dtype='<i2').tobytes())
+    os.replace(tmp_path, path)
+
+
+@contextlib.contextmanager
+def _build_lock(path: str):
+    """Exclusive lock on `path`.lock, so concurrent builds don't drop each other's phrases"""
+    os.makedirs(os.path.dirname(os.path.abspath(path)), exist_ok=True)
+    with open(path + '.lock', 'a+b') as f:
+        try:
+            import fcntl
+        except ImportError:  # Windows
+            import msvcrt
+            while True:
+                try:
+                    msvcrt.locking(f.fileno(), msvcrt.LK_LOCK, 1)
+                    break
+                except OSError:  # gave up after its own 10 s of retries
+                    pass
+            try:
+                yield
+            finally:
+                f.seek(0)
+                msvcrt.locking(f.fileno(), msvcrt.LK_UNLCK, 1)
+            return
+        fcntl.flock(f, fcntl.LOCK_EX)
+        try:
+            yield
+        finally:
+            fcntl.flock(f, fcntl.LOCK_UN)
+
+
+def build(path: str, texts: Iterable[str], rate: int = 200, volume: float = 1.0) -> int:
+    """
+    Add `texts` to the pack at `path`, keeping what is already there, and return how
+    many were synthesized
+    """
+    import pyttsx3
+    texts = [text.strip() for text in texts if text.strip()]
+    voice = (rate, volume)
+    missing = PhrasePack(path).missing(texts, voice)
+    if not missing:
+        return 0
+    engine = pyttsx3.init()
+    engine.setProperty('rate', rate)
+    engine.setProperty('volume', volume)
+    rendered = synthesize(engine, missing)
+    with _build_lock(path):
+        # Another process may have written the pack while these were rendered; merge into its latest
+        pack = PhrasePack(path)
+        clips = {}
+        if pack.voice == voice:
+            clips = {text: np.array(pack.get(text)) for text in pack.index}
+        clips.update(rendered)
+        write_pack(path, clips, voice)
+    return len(rendered)
+
+
+def build_in_background(path: str, texts: Iterable[str], rate: int, volume: float) -> subprocess.Popen:
+    """Build the pack in another interpreter, its own TTS engine doesn't compete with the speaking one"""
+    fd, phrases_file = tempfile.mkstemp(suffix='.json')
+    with os.fdopen(fd, 'w') as f:
+        json.dump(list(texts), f)
+    return subprocess.Popen([sys.executable, os.path.abspath(__file__), 'build', '--pack', path,
+                             '--phrases-file', phrases_file, '--rate', str(rate), '--volume', str(volume),
+                             '--remove-phrases-file'])
+
+
+class ClipCache:
+    """LRU of rendered dynamic text, bounded by total samples"""
+
+    def __init__(self, max_seconds: float = config.PHRASE_CACHE_SECONDS, sample_rate: int = SAMPLE_RATE):
+        self.max_samples = int(max_seconds * sample_rate)
+        self._clips = collections.OrderedDict()
+        self._samples = 0
+
+    def get(self, text: str) -> Optional[np.ndarray]:
+        clip = self._clips.get(text)
+        if clip is not None:
+            self._clips.move_to_end(text)
+        return clip
+
+    def put(self, text: str, clip: np.ndarray):
+        if text in self._clips:
+            self._samples -= len(self._clips.pop(text))
+        self._clips[text] = clip
+        self._samples += len(clip)
+        while self._samples > self.max_samples and len(self._clips) > 1:
+            _, evicted = self._clips.popitem(last=False)
+            self._samples -= len(evicted)
+
+    def __len__(self) -> int:
+        return len(self._clips)
+
+
+class PcmPlayer:
+    """
+    Plays one clip at a time on an output stream that keeps running between clips,
+    so starting a clip costs no device setup
+    """
+
+    def __init__(self, sample_rate: int = SAMPLE_RATE, blocksize: int = 256):
+        import sounddevice
+        self._lock = threading.Lock()
+        self._clip = None
+        self._position = 0
+        self._done = threading.Event()
+        self._done.set()
+        self.stream = sounddevice.OutputStream(samplerate=sample_rate, channels=1, dtype='int16',
+                                               blocksize=blocksize, latency='low', callback=self._callback)
+        self.stream.start()
+
+    @property
+    def output_latency(self) -> float:
+        """Seconds from handing a sample to the stream until it reaches the speaker"""
+        return self.stream.latency
+
+    def _callback(self, outdata, frames, time_info, status):
+        with self._lock:
+            if self._clip is None:
+                outdata.fill(0)
+                return
+            chunk = self._clip[self._position:self._position + frames]
+            outdata[:len(chunk), 0] = chunk
+            outdata[len(chunk):] = 0
+            self._position += len(chunk)
+            if self._position >= len(self._clip):
+                self._clip = None
+                self._done.set()
+
+    def play(self, clip: np.ndarray):
+        with self._lock:
+            self._clip = clip
+            self._position = 0
+            self._done.clear()
+
+    def stop(self):
+        with self._lock:
+            self._clip = None
+            self._done.set()
+
+    def is_playing(self) -> bool:
+        return not self._done.is_set()
+
+    def close(self):
+        self.stop()
+        self.stream.close()
+
+
+def main():
+    parser = argparse.ArgumentParser(description=__doc__, formatter_class=argparse.RawDescriptionHelpFormatter)
+    commands = parser.add_subparsers(dest='command', required=True)
+    build_parser = commands.add_parser('build', help="add announcements to the phrase pack")
+    build_parser.add_argument('--pack', default=config.PHRASE_PACK)
+    build_parser.add_argument('--weights', help="add the hazard and indoor announcements for this model's classes")
+    build_parser.add_argument('--phrases-file', help="JSON list of texts to add")
+    build_parser.add_argument('--remove-phrases-file', action='store_true', help=argparse.SUPPRESS)
+    build_parser.add_argument('--rate', type=int, default=200)
+    build_parser.add_argument('--volume', type=float, default=1.0)
+    args = parser.parse_args()
+
+    logging.basicConfig(level=logging.INFO)
+    texts = []
+    if args.phrases_file:
+        with open(args.phrases_file) as f:
+            texts += json.load(f)
+        if args.remove_phrases_file:
+            os.remove(args.phrases_file)
+    if args.weights:
+        from ultralytics import YOLO
+        import Hazard
+        import IndoorIntegrated
+        from detections import names_array
+        names = names_array(YOLO(args.weights).names)
+        texts += Hazard.feedback_phrases(names) + IndoorIntegrated.feedback_phrases(names)
+    added = build(args.pack, texts, args.rate, args.volume)
+    log.info("Added %d phrases to %s (%d in total)", added, args.pack, len(PhrasePack(args.pack)))
+
+
+if __name__ == "__main__":
+    main()
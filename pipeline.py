@@ -0,0 +1,103 @@
+"""
+Building blocks for running capture, inference and feedback as separate stages.
+"""
+import threading
+import time
+from collections import deque
+from typing import Any, NamedTuple
+
+import numpy as np
+
+
+class Frame(NamedTuple):
+    index: int
+    timestamp: float  # time.monotonic() when the frame was read
+    image: np.ndarray
+    camera: int = 0  # index into CAMERA_SOURCES
+    lease: Any = None  # capture.Lease when `image` is a pooled buffer
+
+    def release(self):
+        """
+        Hand a pooled image back to the capture for reuse. Whoever ends up with the frame
+        calls this once it is done with the image; copy anything needed for longer.
+        """
+        if self.lease is not None:
+            self.lease.release()
+
+
+class InferenceResult(NamedTuple):
+    frame: Frame
+    result: Any  # ultralytics Results for this frame
+    detections: Any  # DetectionBatch
+
+    def age(self) -> float:
+        """Seconds since the underlying frame was captured"""
+        return time.monotonic() - self.frame.timestamp
+
+
+class LatestQueue:
+    """
+    Bounded queue where the newest item wins: putting into a full queue
+    drops the oldest item instead of blocking the producer.
+    """
+
+    def __init__(self, maxsize: int = 1, on_drop=None):
+        self._items = deque(maxlen=maxsize)
+        self._cond = threading.Condition()
+        self._closed = False
+        self.dropped = 0
+        self.on_drop = on_drop  # called with each item pushed out unread, e.g. to release its frame
+
+    def put(self, item):
+        dropped = None
+        with self._cond:
+            if len(self._items) == self._items.maxlen:
+                self.dropped += 1
+                dropped = self._items[0]
+            self._items.append(item)
+            self._cond.notify()
+        if dropped is not None and self.on_drop is not None:
+            self.on_drop(dropped)
+
+    def get(self, timeout: float = None):
+        """
+        Return the oldest queued item, or None on timeout or once the queue is closed and empty
+        """
+        with self._cond:
+            self._cond.wait_for(lambda: self._items or self._closed, timeout)
+            if not self._items:
+                return None
+            return self._items.popleft()
+
+    def close(self):
+        with self._cond:
+            self._closed = True
+            self._cond.notify_all()
+
+    @property
+    def closed(self) -> bool:
+        return self._closed and not self._items
+
+    def __len__(self):
+        return len(self._items)
+
+
+class Stage(threading.Thread):
+    """
+    Worker thread that feeds every item from `source` through `handler` until stopped
+    """
+
+    def __init__(self, name: str, source: LatestQueue, handler):
+        super().__init__(name=name, daemon=True)
+        self.source = source
+        self.handler = handler
+        self._stop_event = threading.Event()
+
+    def run(self):
+        while not self._stop_event.is_set() and not self.source.closed:
+            item = self.source.get(timeout=0.1)
+            if item is not None:
+                self.handler(item)
+
+    def stop(self):
+        self._stop_event.set()
@@ -0,0 +1,189 @@
+"""
+Debug preview of the detection loops, kept off the inference path.
+
+The detection loops hand every frame and its detections to Preview.submit(),
+which returns at once unless a preview frame is due: at most PREVIEW_FPS per
+camera, and never in headless mode. Due frames are copied and drawn on the
+preview's own thread. DISPLAY_MODE picks where they go:
+
+    headless  nothing is drawn or shown; for glasses without a screen
+    window    an OpenCV window, shown from the main thread through show()
+    mjpeg     a multipart JPEG stream on http://localhost:PREVIEW_PORT/<camera>
+    auto      window when a display is available, headless otherwise
+"""
+import http.server
+import logging
+import os
+import sys
+import threading
+import time
+
+import cv2
+import numpy as np
+
+import config
+from metrics import metrics
+
+log = logging.getLogger(__name__)
+
+MODES = ('headless', 'window', 'mjpeg')
+
+
+def resolve_mode(mode: str = config.DISPLAY_MODE) -> str:
+    if mode in MODES:
+        return mode
+    if mode != 'auto':
+        raise ValueError(f"Unknown display mode {mode!r}, expected 'auto' or one of {MODES}")
+    if sys.platform.startswith('linux') and not (os.environ.get('DISPLAY') or os.environ.get('WAYLAND_DISPLAY')):
+        return 'headless'
+    return 'window'
+
+
+def draw_detections(image: np.ndarray, detections, label: str = None) -> np.ndarray:
+    """Boxes, class names and scores drawn on `image` in place, plus an optional caption"""
+    for name, score, (x1, y1, x2, y2) in zip(detections.class_names(), detections.scores.tolist(),
+                                             detections.boxes.astype(int).tolist()):
+        cv2.rectangle(image, (x1, y1), (x2, y2), (255, 0, 0), 2)
+        cv2.putText(image, f"{name} {score:.2f}", (x1, y1 - 10), cv2.FONT_HERSHEY_SIMPLEX, 0.5, (255, 0, 0), 2)
+    if label:
+        cv2.putText(image, label, (10, 30), cv2.FONT_HERSHEY_SIMPLEX, 1, (0, 255, 0), 2)
+    return image
+
+
+class Preview(threading.Thread):
+    def __init__(self, title: str, mode: str = config.DISPLAY_MODE, fps: float = config.PREVIEW_FPS,
+                 port: int = config.PREVIEW_PORT):
+        super().__init__(name="preview", daemon=True)
+        self.title = title
+        self.mode = resolve_mode(mode)
+        self.interval = 1.0 / fps if fps > 0 else 0.0
+        self.port = port
+        self._cond = threading.Condition()
+        self._due = {}  # camera -> time the next preview frame may be taken
+        self._pending = {}  # camera -> (image, detections, label) waiting to be drawn
+        self._rendered = {}  # camera -> annotated image, or JPEG bytes in mjpeg mode
+        self._version = 0
+        self._shown = 0
+        self._stop_event = threading.Event()
+        self._server = None
+        self.render_time = metrics.histogram('preview_render_seconds')
+        self.frames = metrics.counter('preview_frames')
+
+    @property
+    def enabled(self) -> bool:
+        return self.mode != 'headless'
+
+    def start(self):
+        if not self.enabled:
+            return
+        if self.mode == 'mjpeg':
+            self._serve()
+            if not self.enabled:
+                return
+        super().start()
+        log.info("Preview: %s at up to %.0f fps", self.mode, 1.0 / self.interval if self.interval else 0)
+
+    def submit(self, camera: int, image: np.ndarray, detections, label: str = None):
+        """Offer a frame for the preview; cheap unless one is due"""
+        if not self.enabled:
+            return
+        now = time.monotonic()
+        if now < self._due.get(camera, 0.0):
+            return
+        self._due[camera] = now + self.interval
+        # Copy now, the capture may reuse the buffer before the preview thread gets to it
+        with self._cond:
+            self._pending[camera] = (image.copy(), detections, label)
+            self._cond.notify_all()
+
+    def run(self):
+        while not self._stop_event.is_set():
+            with self._cond:
+                self._cond.wait_for(lambda: self._pending or self._stop_event.is_set())
+                pending, self._pending = self._pending, {}
+            for camera, (image, detections, label) in pending.items():
+                start = time.perf_counter()
+                rendered = draw_detections(image, detections, label)
+                if self.mode == 'mjpeg':
+                    rendered = cv2.imencode('.jpg', rendered, [cv2.IMWRITE_JPEG_QUALITY, 70])[1].tobytes()
+                self.render_time.observe(time.perf_counter() - start)
+                self.frames.inc()
+                with self._cond:
+                    self._rendered[camera] = rendered
+                    self._version += 1
+                    self._cond.notify_all()
+
+    def show(self, timeout: float = 0.1) -> bool:
+        """
+        Call from the main thread: waits up to `timeout` for a new preview frame and shows
+        it in window mode. Returns False once 'q' is pressed in the window.
+        """
+        if self.mode != 'window':
+            if timeout:
+                self._stop_event.wait(timeout)
+            return True
+        with self._cond:
+            if not self._cond.wait_for(lambda: self._version != self._shown or self._stop_event.is_set(), timeout):
+                return True
+            self._shown = self._version
+            rendered = dict(self._rendered)
+        for camera, image in rendered.items():
+            cv2.imshow(f"{self.title} {camera + 1}" if len(rendered) > 1 else self.title, image)
+        return not (cv2.waitKey(1) & 0xFF == ord('q'))
+
+    def close_windows(self):
+        with self._cond:
+            self._rendered.clear()
+        if self.mode == 'window':
+            cv2.destroyAllWindows()
+
+    def stop(self):
+        self._stop_event.set()
+        with self._cond:
+            self._cond.notify_all()
+        if self._server is not None:
+            self._server.shutdown()
+        self.close_windows()
+
+    def _latest_jpeg(self, camera: int, after: int):
+        """The newest JPEG for `camera` once there is one newer than version `after`"""
+        with self._cond:
+            self._cond.wait_for(lambda: (self._version != after and camera in self._rendered)
+                                or self._stop_event.is_set(), timeout=1.0)
+            return self._rendered.get(camera), self._version
+
+    def _serve(self):
+        preview = self
+
+        class Handler(http.server.BaseHTTPRequestHandler):
+            def do_GET(self):
+                camera = self.path.strip('/')
+                camera = int(camera) if camera.isdigit() else 0
+                self.send_response(200)
+                self.send_header('Content-Type', 'multipart/x-mixed-replace; boundary=frame')
+                self.end_headers()
+                version, sent = -1, None
+                try:
+                    while not preview._stop_event.is_set():
+                        jpeg, version = preview._latest_jpeg(camera, version)
+                        if jpeg is None or jpeg is sent:
+                            continue
+                        sent = jpeg
+                        self.wfile.write(b"--frame\r\nContent-Type: image/jpeg\r\n")
+                        self.wfile.write(f"Content-Length: {len(jpeg)}\r\n\r\n".encode())
+                        self.wfile.write(jpeg + b"\r\n")
+                except (BrokenPipeError, ConnectionResetError):
+                    pass  # viewer went away
+
+            def log_message(self, format, *args):
+                log.debug(format, *args)
+
+        try:
+            self._server = http.server.ThreadingHTTPServer(('localhost', self.port), Handler)
+        except OSError as e:
+            log.warning("Can't serve the preview on port %d (%s), running headless", self.port, e)
+            self.mode = 'headless'
+            return
+        self._server.daemon_threads = True
+        threading.Thread(target=self._server.serve_forever, name="preview-http", daemon=True).start()
+        log.info("Preview stream on http://localhost:%d/", self.port)
@@ -0,0 +1,98 @@
+"""
+Walking-corridor region of interest and input size per frame.
+
+Only boxes at least min_hazard_height() of the frame tall can ever be
+announced, and they are mostly in front of the wearer. CorridorPlanner
+crops each frame to the walking corridor, widened to keep the hazards
+found on the previous frame fully in view. It picks the smallest input
+size at which the smallest box that could still be a hazard, or a smaller
+hazard already in the corridor, stays ROI_MIN_OBJECT_PIXELS tall; sizing
+for a close, tall box would shrink every further hazard below that. The
+size is clamped to ROI_MIN_IMGSZ..ROI_MAX_IMGSZ, the range of the model
+ladder. Every
+ROI_FULL_SCAN_INTERVAL seconds a frame goes through whole at full size, so
+hazards entering from the sides or from further away are picked up.
+
+The corridor keeps the full frame height by default: a box cut off at the
+top of a crop would look shorter, and so further away, than it is.
+"""
+import math
+import time
+from typing import NamedTuple, Optional, Tuple
+
+import numpy as np
+
+import config
+from detections import HAZARD_NONE, min_hazard_height
+
+
+class RoiPlan(NamedTuple):
+    crop: Optional[Tuple[int, int, int, int]]  # x1, y1, x2, y2 in pixels, None for the full frame
+    imgsz: Optional[int]  # None for the model's own input size
+
+    def apply(self, image: np.ndarray) -> np.ndarray:
+        if self.crop is None:
+            return image
+        x1, y1, x2, y2 = self.crop
+        return image[y1:y2, x1:x2]
+
+    def to_frame(self, boxes: np.ndarray) -> np.ndarray:
+        """Shift (N, 6) boxes detected in the crop back into full-frame pixels"""
+        if self.crop is None or not len(boxes):
+            return boxes
+        boxes = boxes.copy()
+        boxes[:, [0, 2]] += self.crop[0]
+        boxes[:, [1, 3]] += self.crop[1]
+        return boxes
+
+
+class CorridorPlanner:
+    def __init__(self, corridor=config.ROI_CORRIDOR, full_scan_interval: float = config.ROI_FULL_SCAN_INTERVAL,
+                 min_object_pixels: int = config.ROI_MIN_OBJECT_PIXELS, min_imgsz: int = config.ROI_MIN_IMGSZ,
+                 max_imgsz: int = config.ROI_MAX_IMGSZ, margin: float = 0.1):
+        self.corridor = np.asarray(corridor, dtype=np.float32)  # x1, y1, x2, y2 as fractions of the frame
+        self.full_scan_interval = full_scan_interval
+        self.min_object_pixels = min_object_pixels
+        self.min_imgsz = min_imgsz
+        self.max_imgsz = max_imgsz
+        self.margin = margin
+        self._boxes = np.empty((0, 4), dtype=np.float32)  # hazards from the previous frame
+        self._last_full_scan = float('-inf')
+        self.full_scans = 0
+        self.crops = 0
+
+    def plan(self, shape, now: float = None) -> RoiPlan:
+        now = time.monotonic() if now is None else now
+        if now - self._last_full_scan >= self.full_scan_interval:
+            self._last_full_scan = now
+            self.full_scans += 1
+            return RoiPlan(None, None)
+
+        height, width = shape[:2]
+        region = self.corridor * np.array([width, height, width, height], dtype=np.float32)
+        target = min_hazard_height() * height
+        in_corridor = self._boxes[(self._boxes[:, 0] < region[2]) & (self._boxes[:, 2] > region[0])]
+        if len(in_corridor):
+            # Recall depends on the smallest hazard in the walking path staying visible, not the nearest
+            target = min(target, float((in_corridor[:, 3] - in_corridor[:, 1]).min()))
+        if len(self._boxes):
+            # Keep last frame's hazards, with some room to move, inside the crop
+            padded = self._boxes + self.margin * np.array([-width, -height, width, height], dtype=np.float32)
+            region = np.concatenate([np.minimum(region[:2], padded[:, :2].min(axis=0)),
+                                     np.maximum(region[2:], padded[:, 2:].max(axis=0))])
+        x1, y1 = np.maximum(region[:2], 0).astype(int).tolist()
+        x2, y2 = np.minimum(region[2:], [width, height]).astype(int).tolist()
+        self.crops += 1
+
+        # Smallest input, in multiples of the 32 pixel stride, that keeps the target box big enough
+        scale = self.min_object_pixels / max(target, 1.0)
+        imgsz = math.ceil(max(x2 - x1, y2 - y1) * scale / 32) * 32
+        return RoiPlan((x1, y1, x2, y2), min(max(imgsz, self.min_imgsz), self.max_imgsz))
+
+    def observe(self, boxes: np.ndarray, levels: np.ndarray):
+        """Remember this frame's hazards (full-frame boxes) for the next plan"""
+        self._boxes = np.asarray(boxes, dtype=np.float32).reshape(-1, 4)[np.asarray(levels) != HAZARD_NONE]
+
+    def crop_ratio(self) -> float:
+        total = self.full_scans + self.crops
+        return self.crops / total if total else 0.0
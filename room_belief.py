@@ -0,0 +1,71 @@
+"""
+Temporally smoothed room classification.
+
+Classifying the room from a single frame flips whenever a chair drops out of
+view. RoomBelief turns room_rules into a class-by-room incidence matrix and
+keeps an exponentially decayed score per room, fed by the objects seen in
+each update. Updates run at a fixed lower rate, and the decided room only
+changes when another room beats it by a margin.
+"""
+import time
+from typing import Dict, List, Optional
+
+import numpy as np
+
+import config
+from detections import DetectionBatch
+
+
+class RoomBelief:
+    def __init__(self, room_rules: Dict[str, List[str]], names: np.ndarray,
+                 interval: float = config.ROOM_UPDATE_INTERVAL,
+                 half_life: float = config.ROOM_HALF_LIFE,
+                 margin: float = config.ROOM_MARGIN):
+        self.rooms = list(room_rules)
+        self.interval = interval
+        self.half_life = half_life
+        self.margin = margin
+
+        # incidence[class_id, room] is the weight one sighting of that class adds to the room
+        self.incidence = np.zeros((len(names), len(self.rooms)), dtype=np.float32)
+        for r, required_objects in enumerate(room_rules.values()):
+            for name in required_objects:
+                self.incidence[names == name, r] = 1.0 / len(required_objects)
+
+        self.scores = np.zeros(len(self.rooms), dtype=np.float32)
+        self.current = None  # index into self.rooms
+        self._last_update = None
+
+    @property
+    def room(self) -> Optional[str]:
+        return None if self.current is None else self.rooms[self.current]
+
+    @property
+    def confidence(self) -> float:
+        return 0.0 if self.current is None else float(self.scores[self.current])
+
+    def update(self, detections: DetectionBatch, now: float = None) -> Optional[str]:
+        """
+        Fold in one frame's detections. Returns the new room when the decision changes, else None.
+        """
+        now = time.monotonic() if now is None else now
+        if self._last_update is not None and now - self._last_update < self.interval:
+            return None
+        elapsed = self.interval if self._last_update is None else now - self._last_update
+        self._last_update = now
+
+        # Strongest confidence per class seen in this frame
+        present = np.zeros(len(self.incidence), dtype=np.float32)
+        np.maximum.at(present, detections.class_ids, detections.scores)
+        evidence = present @ self.incidence
+
+        decay = 0.5 ** (elapsed / self.half_life)
+        self.scores = decay * self.scores + (1 - decay) * evidence
+
+        best = int(np.argmax(self.scores))
+        if self.scores[best] <= 0 or best == self.current:
+            return None
+        if self.current is None or self.scores[best] - self.scores[self.current] >= self.margin:
+            self.current = best
+            return self.rooms[best]
+        return None
@@ -0,0 +1,134 @@
+"""
+Progress tracking along an outdoor walking route.
+
+RouteFollower keeps the full route polyline in local meters and, for each
+new position, projects it onto the nearby segments found through a uniform
+grid over the segments' bounding boxes. That gives the distance walked along
+the route and the distance off it without looking at the whole line. Steps
+start at the cumulative sum of the step distances, so which maneuver comes
+next is a bisect over those offsets. Nothing here touches the network; the
+caller fetches a new route only when the wearer is off route.
+"""
+import bisect
+import math
+from typing import Dict, List, NamedTuple, Optional, Sequence, Tuple
+
+import numpy as np
+
+import config
+
+EARTH_RADIUS = 6371000.0  # meters
+
+
+class Progress(NamedTuple):
+    along: float  # meters walked along the route
+    deviation: float  # meters from the route line
+    step: int  # index of the step being walked
+    off_route: bool
+    arrived: bool
+
+
+class RouteFollower:
+    def __init__(self, coordinates: Sequence[Sequence[float]], steps: Sequence[Tuple[str, float]],
+                 off_route_distance: float = config.OFF_ROUTE_DISTANCE,
+                 announce_distance: float = config.STEP_ANNOUNCE_DISTANCE,
+                 arrival_distance: float = config.ARRIVAL_DISTANCE):
+        self.steps = [tuple(step) for step in steps]
+        self.off_route_distance = off_route_distance
+        self.announce_distance = announce_distance
+        self.arrival_distance = arrival_distance
+
+        # Equirectangular projection around the start, accurate to well under a meter over a walk
+        lonlat = np.asarray(coordinates, dtype=np.float64)
+        self.origin = lonlat[0]
+        self._scale = np.array([math.cos(math.radians(self.origin[1])), 1.0]) * math.radians(1) * EARTH_RADIUS
+        points = self.project(lonlat)
+        if len(points) == 1:
+            points = np.vstack([points, points])
+        self.starts = points[:-1]
+        self.vectors = points[1:] - points[:-1]
+        self.lengths_sq = np.maximum((self.vectors ** 2).sum(axis=1), 1e-9)
+        lengths = np.sqrt((self.vectors ** 2).sum(axis=1))
+        self.offsets = np.concatenate([[0.0], np.cumsum(lengths)[:-1]])  # distance along at each segment start
+        self.length = float(lengths.sum())
+
+        # Where each step begins along the route
+        self.step_starts = np.concatenate([[0.0], np.cumsum([distance for _, distance in self.steps])[:-1]]).tolist()
+
+        self.cell = max(off_route_distance, 10.0)
+        self.grid = self._build_grid(points)
+        self.along = 0.0
+        self.next_step = 0  # first step not announced yet
+
+    def project(self, lonlat) -> np.ndarray:
+        """Longitude/latitude pairs to meters east and north of the route start"""
+        return (np.asarray(lonlat, dtype=np.float64) - self.origin) * self._scale
+
+    def _build_grid(self, points: np.ndarray) -> Dict[Tuple[int, int], List[int]]:
+        low = np.floor(np.minimum(points[:-1], points[1:]) / self.cell).astype(int)
+        high = np.floor(np.maximum(points[:-1], points[1:]) / self.cell).astype(int)
+        grid = {}
+        for segment, ((x0, y0), (x1, y1)) in enumerate(zip(low.tolist(), high.tolist())):
+            for cx in range(x0, x1 + 1):
+                for cy in range(y0, y1 + 1):
+                    grid.setdefault((cx, cy), []).append(segment)
+        return grid
+
+    def _candidates(self, point: np.ndarray) -> np.ndarray:
+        cx, cy = np.floor(point / self.cell).astype(int).tolist()
+        found = set()
+        for dx in (-1, 0, 1):
+            for dy in (-1, 0, 1):
+                found.update(self.grid.get((cx + dx, cy + dy), ()))
+        return np.fromiter(found, dtype=np.intp, count=len(found))
+
+    def update(self, lon: float, lat: float) -> Progress:
+        point = self.project([lon, lat])
+        segments = self._candidates(point)
+        if not len(segments):
+            return Progress(self.along, math.inf, self.current_step, True, False)
+
+        starts, vectors = self.starts[segments], self.vectors[segments]
+        t = np.clip(((point - starts) * vectors).sum(axis=1) / self.lengths_sq[segments], 0.0, 1.0)
+        nearest = starts + vectors * t[:, None]
+        deviation = np.sqrt(((nearest - point) ** 2).sum(axis=1))
+        along = self.offsets[segments] + t * np.sqrt(self.lengths_sq[segments])
+        # Where the route passes by twice, prefer the pass that doesn't go backwards
+        penalty = deviation + np.where(along < self.along - self.off_route_distance, self.off_route_distance, 0.0)
+        best = int(np.argmin(penalty))
+
+        off_route = bool(deviation[best] > self.off_route_distance)
+        if not off_route:
+            self.along = max(self.along, float(along[best]))
+        arrived = not off_route and self.length - self.along <= self.arrival_distance
+        return Progress(self.along, float(deviation[best]), self.current_step, off_route, arrived)
+
+    @property
+    def current_step(self) -> int:
+        return max(bisect.bisect_right(self.step_starts, self.along) - 1, 0)
+
+    def due_steps(self) -> List[Tuple[str, float]]:
+        """
+        Steps reached since the last call, each with the meters left until the one after it.
+        The first step is due immediately.
+        """
+        due = []
+        reach = self.along + self.announce_distance
+        while self.next_step < len(self.steps) and self.step_starts[self.next_step] <= reach:
+            index = self.next_step
+            end = self.step_starts[index] + self.steps[index][1]
+            due.append((self.steps[index][0], max(end - max(self.along, self.step_starts[index]), 0.0)))
+            self.next_step += 1
+        return due
+
+    def remaining(self) -> float:
+        return max(self.length - self.along, 0.0)
+
+
+def parse_coords(coords: str) -> Optional[Tuple[float, float]]:
+    """A "longitude,latitude" string as a (lon, lat) pair"""
+    try:
+        lon, lat = (float(value) for value in coords.split(','))
+    except ValueError:
+        return None
+    return lon, lat
@@ -0,0 +1,264 @@
+"""
+Text-to-speech on a background thread with a priority queue.
+
+Callers hand messages to SpeechService.say() and return immediately. The most
+urgent message is spoken first, duplicates of a queued message are merged,
+messages whose time-to-live ran out are dropped, and a more urgent message
+cuts off a less urgent one that is already being spoken.
+
+With PHRASE_AUDIO on and an audio output available, messages are played as
+PCM: fixed announcements registered with prepare() from the phrase pack,
+anything else rendered on first use and kept in an LRU (see phrase_cache).
+Otherwise pyttsx3 speaks each message live.
+"""
+import heapq
+import itertools
+import logging
+import threading
+import time
+
+import config
+from metrics import metrics
+from phrase_cache import ClipCache, PcmPlayer, PhrasePack, build_in_background, synthesize
+
+log = logging.getLogger(__name__)
+
+# Lower value = more urgent
+PRIORITY_ALERT = 0    # e.g. "very close" hazards
+PRIORITY_WARNING = 1  # e.g. "ahead" hazards
+PRIORITY_INFO = 2     # prompts and navigation
+
+
+class SpeechService(threading.Thread):
+    def __init__(self, rate: int = 200, volume: float = 1.0):
+        super().__init__(name="speech", daemon=True)
+        self.rate = rate
+        self.volume = volume
+        self._heap = []
+        self._pending = {}  # message -> (priority, seq, queued_at, expires_at)
+        self._seq = itertools.count()
+        self._cond = threading.Condition()
+        self._current = None  # (priority, message, queued_at) being spoken
+        self._interrupt = False
+        self._engine = None
+        self._stop_event = threading.Event()
+        self._player = None
+        self._pack = None
+        self._clips = ClipCache()
+        self._wanted = []  # fixed announcements to have in the pack
+        self._builder = None
+
+        self.spoken = 0
+        self.coalesced = 0
+        self.dropped_stale = 0
+        self.preempted = 0
+        self.pack_hits = 0
+        self.rendered = 0  # messages synthesized while speaking
+        self.last_latency = 0.0
+        self.max_latency = 0.0
+        self._latency_total = 0.0
+        self._queue_wait = metrics.histogram('speech_queue_wait_seconds')
+
+    def say(self, message: str, priority: int = PRIORITY_INFO, ttl: float = 2.0):
+        """
+        Queue a message without blocking. It is dropped if not started within `ttl` seconds.
+        """
+        message = message.strip()
+        if not message:
+            return
+        now = time.monotonic()
+        queued_at, expires_at = now, now + ttl
+        with self._cond:
+            if self._current is not None and self._current[1] == message:
+                self.coalesced += 1
+                return
+            queued = self._pending.get(message)
+            if queued is not None:
+                self.coalesced += 1
+                queued_at, expires_at = queued[2], max(expires_at, queued[3])
+                if priority >= queued[0]:
+                    self._pending[message] = (queued[0], queued[1], queued_at, expires_at)
+                    return
+                # More urgent than before: requeue, the old heap entry is skipped on pop
+            seq = next(self._seq)
+            self._pending[message] = (priority, seq, queued_at, expires_at)
+            heapq.heappush(self._heap, (priority, seq, message))
+            self._cond.notify()
+
+    def clear(self, priority: int = PRIORITY_INFO):
+        """
+        Drop queued messages at `priority` or less urgent, and cut the current one short if it is one of them
+        """
+        with self._cond:
+            for message, queued in list(self._pending.items()):
+                if queued[0] >= priority:
+                    del self._pending[message]
+            if self._current is not None and self._current[0] >= priority:
+                self._interrupt = True
+            self._cond.notify_all()
+
+    def prepare(self, messages):
+        """
+        Register announcements that should be pre-rendered; missing ones are added to the
+        phrase pack in the background
+        """
+        with self._cond:
+            self._wanted = [message.strip() for message in messages if message.strip()]
+            self._cond.notify_all()
+
+    def queue_depth(self) -> int:
+        return len(self._pending)
+
+    def is_idle(self) -> bool:
+        return not self._pending and self._current is None
+
+    def wait_until_idle(self, timeout: float = None) -> bool:
+        """
+        Block until everything queued has been spoken, e.g. before listening on the microphone
+        """
+        with self._cond:
+            return self._cond.wait_for(self.is_idle, timeout)
+
+    def stats(self) -> dict:
+        return {
+            'queue_depth': self.queue_depth(),
+            'spoken': self.spoken,
+            'coalesced': self.coalesced,
+            'dropped_stale': self.dropped_stale,
+            'preempted': self.preempted,
+            'pack_hits': self.pack_hits,
+            'rendered': self.rendered,
+            'last_latency': self.last_latency,
+            'mean_latency': self._latency_total / self.spoken if self.spoken else 0.0,
+            'max_latency': self.max_latency,
+        }
+
+    def stop(self):
+        self._stop_event.set()
+        with self._cond:
+            self._cond.notify_all()
+
+    def _next_message(self):
+        """Pop the most urgent live message, dropping superseded and expired entries"""
+        while self._heap:
+            priority, seq, message = heapq.heappop(self._heap)
+            queued = self._pending.get(message)
+            if queued is None or queued[1] != seq:
+                continue
+            del self._pending[message]
+            if time.monotonic() > queued[3]:
+                self.dropped_stale += 1
+                continue
+            return priority, message, queued[2]
+        return None
+
+    def _on_utterance_started(self, name, output_latency: float = 0.0):
+        latency = time.monotonic() - self._current[2] + output_latency
+        self.spoken += 1
+        self.last_latency = latency
+        self.max_latency = max(self.max_latency, latency)
+        self._latency_total += latency
+        self._queue_wait.observe(latency)
+
+    def _on_word(self, name, location, length):
+        # Cut the current utterance short if something more urgent is waiting or it was cleared
+        with self._cond:
+            if self._interrupt or (self._heap and self._heap[0][0] < self._current[0]):
+                self._interrupt = False
+                self.preempted += 1
+                self._engine.stop()
+
+    def _open_player(self):
+        try:
+            return PcmPlayer()
+        except ImportError:
+            log.info("sounddevice not installed, speaking live")
+        except Exception as e:  # PortAudio reports missing devices with its own error type
+            log.warning("No audio output for phrase playback (%s), speaking live", e)
+        return None
+
+    def _update_pack(self):
+        """Pick up a finished background build, or start one for announcements not in the pack"""
+        if self._builder is not None:
+            if self._builder.poll() is None:
+                return
+            if self._builder.returncode == 0:
+                self._pack = PhrasePack(config.PHRASE_PACK)
+                log.info("Phrase pack loaded, %d phrases", len(self._pack))
+            self._builder = None
+        with self._cond:
+            wanted, self._wanted = self._wanted, []
+        if wanted and self._pack.missing(wanted, (self.rate, self.volume)):
+            self._builder = build_in_background(config.PHRASE_PACK, wanted, self.rate, self.volume)
+
+    def _clip(self, message: str):
+        voice = (self.rate, self.volume)
+        if self._pack.voice == voice and message in self._pack:
+            self.pack_hits += 1
+            return self._pack.get(message)
+        clip = self._clips.get(message)
+        if clip is None:
+            # Not a fixed announcement, render it once and keep it for next time
+            clip = synthesize(self._engine, [message]).get(message)
+            if clip is None:
+                return None
+            self.rendered += 1
+            self._clips.put(message, clip)
+        return clip
+
+    def _play(self, message: str) -> bool:
+        """Play a message as PCM until it ends or is cut short; False if it couldn't be rendered"""
+        clip = self._clip(message)
+        if clip is None:
+            return False
+        with self._cond:
+            self._on_utterance_started(message, self._player.output_latency)
+            self._player.play(clip)
+            while self._player.is_playing():
+                if self._stop_event.is_set() or self._interrupt or (self._heap and self._heap[0][0] < self._current[0]):
+                    self._interrupt = False
+                    self.preempted += 1
+                    self._player.stop()
+                    break
+                self._cond.wait(0.01)
+        return True
+
+    def run(self):
+        import pyttsx3
+
+        # pyttsx3 engines must be driven from the thread that created them
+        self._engine = pyttsx3.init()
+        self._engine.setProperty('rate', self.rate)
+        self._engine.setProperty('volume', self.volume)
+        if config.PHRASE_AUDIO:
+            self._player = self._open_player()
+        if self._player is not None:
+            self._pack = PhrasePack(config.PHRASE_PACK)
+        else:
+            self._engine.connect('started-utterance', self._on_utterance_started)
+            self._engine.connect('started-word', self._on_word)
+
+        while not self._stop_event.is_set():
+            if self._player is not None:
+                self._update_pack()
+            with self._cond:
+                # Wake up now and then while a pack build runs, to load it when it is done
+                self._cond.wait_for(lambda: self._heap or self._stop_event.is_set() or
+                                    (self._wanted and self._player is not None),
+                                    0.5 if self._builder is not None else None)
+                self._current = self._next_message()
+                if self._current is None:
+                    self._cond.notify_all()
+                    continue
+            try:
+                if self._player is None or not self._play(self._current[1]):
+                    self._engine.say(self._current[1])
+                    self._engine.runAndWait()
+            except RuntimeError:
+                log.error("Text-to-speech engine is busy.")
+            with self._cond:
+                self._current = None
+                self._interrupt = False
+                self._cond.notify_all()
+        if self._player is not None:
+            self._player.close()
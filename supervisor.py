@@ -0,0 +1,185 @@
+"""
+Warm-standby worker processes for the GUI.
+
+Every mode script runs in a worker process that is started once, imports
+its libraries and loads its models (warm_up), and then waits. Switching
+modes sends 'activate' to the workers of the new mode and 'pause' to the
+rest, instead of terminating interpreters and starting new ones, so a
+switch takes as long as a message round trip. Workers that die are
+restarted, and reactivated if their mode is the current one.
+
+A worker module provides warm_up() and serve(active, stopping), where
+`active` and `stopping` are threading.Events. This module only uses the
+standard library so importing it keeps the GUI quick to start; the heavy
+imports happen inside the worker processes.
+"""
+import importlib
+import logging
+import multiprocessing
+import os
+import threading
+import time
+
+log = logging.getLogger(__name__)
+
+# Worker name -> module
+WORKERS = {
+    'hazard': 'Hazard',
+    'indoor': 'IndoorIntegrated',
+    'outdoor': 'OutdoorNav1',
+}
+
+# Mode -> workers that run in it
+MODES = {
+    'indoor': ('indoor',),
+    'outdoor': ('outdoor', 'hazard'),
+}
+
+
+def worker_main(name: str, conn, env: dict):
+    """Entry point of a worker process"""
+    os.environ.update(env)
+    started = time.monotonic()
+    module = importlib.import_module(WORKERS[name])
+    from metrics import setup_logging
+    setup_logging()
+    module.warm_up()
+    conn.send(('ready', time.monotonic() - started))
+
+    active = threading.Event()
+    stopping = threading.Event()
+
+    def control():
+        while not stopping.is_set():
+            try:
+                command = conn.recv()
+            except (EOFError, OSError):
+                command = 'stop'
+            if command == 'activate':
+                active.set()
+                conn.send(('active', time.monotonic()))
+            elif command == 'pause':
+                active.clear()
+            elif command == 'stop':
+                active.clear()
+                stopping.set()
+
+    threading.Thread(target=control, name="control", daemon=True).start()
+    # The mode's own loop stays on the main thread, OpenCV windows need that
+    module.serve(active, stopping)
+
+
+class Worker:
+    def __init__(self, name: str, env: dict):
+        self.name = name
+        self.env = env
+        self.process = None
+        self.conn = None
+        self.ready = False
+        self.spawned_at = 0.0
+        self.cold_start = None  # seconds from spawn to models loaded
+        self.restarts = 0
+
+    def start(self):
+        context = multiprocessing.get_context('spawn')
+        self.conn, child_conn = context.Pipe()
+        self.process = context.Process(target=worker_main, args=(self.name, child_conn, self.env),
+                                       name=f"worker-{self.name}", daemon=True)
+        self.ready = False
+        self.spawned_at = time.monotonic()
+        self.process.start()
+
+    def alive(self) -> bool:
+        return self.process is not None and self.process.is_alive()
+
+    def send(self, command: str):
+        try:
+            self.conn.send(command)
+        except (BrokenPipeError, OSError):
+            pass  # dead, the next poll restarts it
+
+    def messages(self):
+        try:
+            while self.conn.poll():
+                yield self.conn.recv()
+        except (EOFError, OSError):
+            return
+
+    def stop(self, timeout: float = 3.0):
+        if self.process is None:
+            return
+        self.send('stop')
+        self.process.join(timeout)
+        if self.process.is_alive():
+            self.process.terminate()
+        self.process = None
+
+
+class Supervisor:
+    def __init__(self, env: dict = None):
+        env = env or {}
+        self.workers = {name: Worker(name, env) for name in WORKERS}
+        self.mode = None
+        self._switch_started = None
+        self._waiting = set()  # workers of the current mode that haven't confirmed activation
+        self.last_switch_latency = None
+
+    def start(self):
+        """Spawn every worker; they warm up in parallel in the background"""
+        for worker in self.workers.values():
+            worker.start()
+
+    def switch(self, mode: str):
+        self.mode = mode
+        self._switch_started = time.monotonic()
+        wanted = MODES.get(mode, ())
+        for name, worker in self.workers.items():
+            if name not in wanted:
+                worker.send('pause')
+        self._waiting = set(wanted)
+        for name in wanted:
+            if self.workers[name].ready:
+                self.workers[name].send('activate')
+
+    def poll(self):
+        """Handle worker messages and restart crashed workers; call this periodically"""
+        wanted = MODES.get(self.mode, ())
+        for name, worker in self.workers.items():
+            for kind, value in worker.messages():
+                if kind == 'ready':
+                    worker.ready = True
+                    worker.cold_start = value
+                    log.info("Worker %s ready after %.1f s", name, value)
+                    if name in wanted:
+                        worker.send('activate')
+                elif kind == 'active' and name in self._waiting:
+                    self._waiting.discard(name)
+                    if not self._waiting:
+                        self.last_switch_latency = time.monotonic() - self._switch_started
+                        log.info("Switched to %s mode in %.3f s", self.mode, self.last_switch_latency)
+            if worker.process is not None and not worker.alive():
+                # Back off when a worker keeps crashing, e.g. on a missing camera
+                if time.monotonic() - worker.spawned_at < min(2 ** worker.restarts, 30):
+                    continue
+                log.warning("Worker %s exited with code %s, restarting", name, worker.process.exitcode)
+                worker.restarts += 1
+                worker.start()
+                if name in wanted:
+                    self._waiting.add(name)
+
+    def pause_all(self):
+        self.mode = None
+        for worker in self.workers.values():
+            worker.send('pause')
+
+    def stop(self):
+        for worker in self.workers.values():
+            worker.stop()
+
+    def stats(self) -> dict:
+        return {
+            'mode': self.mode,
+            'last_switch_latency': self.last_switch_latency,
+            'workers': {name: {'ready': w.ready, 'cold_start': w.cold_start, 'restarts': w.restarts}
+                        for name, w in self.workers.items()},
+        }
@@ -0,0 +1,127 @@
+"""
+MapboxClient against a local stand-in for the two Mapbox endpoints.
+
+    python -m unittest tests.test_mapbox_client
+"""
+import http.server
+import json
+import threading
+import unittest
+from unittest import mock
+
+import config
+from mapbox_client import MapboxClient, ResponseCache
+
+
+class StandIn(http.server.BaseHTTPRequestHandler):
+    """
+    Answers geocoding and walking directions; `failures` lists paths that get a 503 first,
+    `portal` paths get an HTML page as if a captive portal answered
+    """
+
+    hits = {}
+    failures = set()
+    portal = set()
+
+    def do_GET(self):
+        path = self.path.split('?')[0]
+        StandIn.hits[path] = StandIn.hits.get(path, 0) + 1
+        if path in StandIn.failures:
+            StandIn.failures.discard(path)
+            self.send_response(503)
+            self.end_headers()
+            return
+        if path in StandIn.portal:
+            data = b"<html><body>Sign in to continue</body></html>"
+            self.send_response(200)
+            self.send_header('Content-Type', 'text/html')
+            self.send_header('Content-Length', str(len(data)))
+            self.end_headers()
+            self.wfile.write(data)
+            return
+        if path.startswith('/geocoding/'):
+            body = {'features': [{'geometry': {'coordinates': [-122.42, 37.77]}}]}
+        elif path.startswith('/directions/'):
+            body = {'routes': [{'geometry': {'coordinates': [[-122.42, 37.77], [-122.41, 37.78]]},
+                                'legs': [{'steps': [{'maneuver': {'instruction': "Head north"}, 'distance': 150.0}]}]}]}
+        else:
+            self.send_response(404)
+            self.end_headers()
+            return
+        data = json.dumps(body).encode()
+        self.send_response(200)
+        self.send_header('Content-Type', 'application/json')
+        self.send_header('Content-Length', str(len(data)))
+        self.end_headers()
+        self.wfile.write(data)
+
+    def log_message(self, format, *args):
+        pass
+
+
+class MapboxClientTest(unittest.TestCase):
+    @classmethod
+    def setUpClass(cls):
+        cls.server = http.server.ThreadingHTTPServer(('localhost', 0), StandIn)
+        threading.Thread(target=cls.server.serve_forever, daemon=True).start()
+        cls.base_url = f"http://localhost:{cls.server.server_address[1]}"
+
+    @classmethod
+    def tearDownClass(cls):
+        cls.server.shutdown()
+        cls.server.server_close()
+
+    def setUp(self):
+        StandIn.hits = {}
+        StandIn.failures = set()
+        StandIn.portal = set()
+        self.client = MapboxClient(api_key='test', base_url=self.base_url, cache=ResponseCache(':memory:', 2),
+                                   retries=2, backoff=0)
+
+    def tearDown(self):
+        self.client.close()
+
+    def geocode_hits(self, address):
+        return StandIn.hits.get(f"/geocoding/v5/mapbox.places/{address}.json", 0)
+
+    def test_cache_hit(self):
+        self.assertEqual(self.client.geocode('market'), "-122.42,37.77")
+        # Same address up to case and spacing: answered from the cache
+        self.assertEqual(self.client.geocode('  Market '), "-122.42,37.77")
+        self.assertEqual(self.geocode_hits('market'), 1)
+
+        self.client.directions("-122.42001,37.77001", "-122.41,37.78")
+        route = self.client.directions("-122.42002,37.77002", "-122.41,37.78")
+        self.assertEqual(route['steps'], [["Head north", 150.0]])
+        self.assertEqual(sum(hits for path, hits in StandIn.hits.items() if path.startswith('/directions/')), 1)
+
+    def test_ttl_expiry(self):
+        with mock.patch.object(config, 'GEOCODE_TTL', -1.0):
+            self.client.geocode('market')
+        self.client.geocode('market')
+        self.assertEqual(self.geocode_hits('market'), 2)
+
+    def test_eviction(self):
+        for address in ('first', 'second', 'third'):
+            self.client.geocode(address)
+        self.assertEqual(len(self.client.cache), 2)
+        # The least recently used entry went; the newer ones are still cached
+        self.client.geocode('third')
+        self.client.geocode('first')
+        self.assertEqual(self.geocode_hits('third'), 1)
+        self.assertEqual(self.geocode_hits('first'), 2)
+
+    def test_retry_after_server_error(self):
+        StandIn.failures.add('/geocoding/v5/mapbox.places/market.json')
+        self.assertEqual(self.client.geocode('market'), "-122.42,37.77")
+        self.assertEqual(self.geocode_hits('market'), 2)
+
+    def test_non_json_response(self):
+        StandIn.portal.add('/geocoding/v5/mapbox.places/market.json')
+        with self.assertLogs('mapbox_client', 'ERROR'):
+            self.assertIsNone(self.client.geocode('market'))
+        self.assertEqual(len(self.client.cache), 0)
+
+
+if __name__ == '__main__':
+    unittest.main()
@@ -0,0 +1,44 @@
+"""
+Input sizes chosen by the walking-corridor planner.
+
+    python -m unittest tests.test_roi
+"""
+import unittest
+
+import numpy as np
+
+from detections import HAZARD_CLOSE, min_hazard_height
+from roi import CorridorPlanner
+
+SHAPE = (480, 640, 3)
+
+
+class CorridorPlannerTest(unittest.TestCase):
+    def setUp(self):
+        self.planner = CorridorPlanner(corridor=(0.2, 0.0, 0.8, 1.0), full_scan_interval=1.0, min_object_pixels=64,
+                                       min_imgsz=160, max_imgsz=640)
+        self.assertEqual(self.planner.plan(SHAPE, now=0.0).crop, None)  # the first frame is a full scan
+
+    def smallest_hazard_pixels(self, plan, height):
+        x1, y1, x2, y2 = plan.crop
+        return height * plan.imgsz / max(x2 - x1, y2 - y1)
+
+    def test_minimum_height_hazard_stays_visible(self):
+        plan = self.planner.plan(SHAPE, now=0.1)
+        self.assertGreaterEqual(self.smallest_hazard_pixels(plan, min_hazard_height() * SHAPE[0]), 64)
+
+    def test_tall_hazard_does_not_shrink_the_input(self):
+        small = min_hazard_height() * SHAPE[0]
+        boxes = np.array([[250, 20, 400, 460],                 # a person filling most of the frame
+                          [300, 300 - small, 340, 300]], dtype=np.float32)  # one just tall enough to count
+        self.planner.observe(boxes, np.full(len(boxes), HAZARD_CLOSE))
+        plan = self.planner.plan(SHAPE, now=0.1)
+        self.assertGreaterEqual(self.smallest_hazard_pixels(plan, small), 64)
+
+    def test_full_scan_after_the_interval(self):
+        self.assertIsNotNone(self.planner.plan(SHAPE, now=0.5).crop)
+        self.assertEqual(self.planner.plan(SHAPE, now=1.0), (None, None))
+
+
+if __name__ == '__main__':
+    unittest.main()
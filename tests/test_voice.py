@@ -0,0 +1,56 @@
+"""
+Phrase matching of the on-device recognizer, fed decoder texts instead of audio.
+
+    python -m unittest tests.test_voice
+"""
+import unittest
+
+from voice import COMMANDS, PhraseMatcher, normalize
+
+
+class NormalizeTest(unittest.TestCase):
+    def test_lowercases_joins_and_deduplicates(self):
+        self.assertEqual(normalize(["Living_Room", "  living   room ", "Stop", ""]), ["living room", "stop"])
+
+
+class PhraseMatcherTest(unittest.TestCase):
+    def setUp(self):
+        self.matcher = PhraseMatcher(COMMANDS + ("kitchen", "living room", "go to kitchen", "go"), stable_time=0.15)
+
+    def test_final_result(self):
+        self.assertEqual(self.matcher.match("living room"), "living room")
+        self.assertEqual(self.matcher.match("[unk] kitchen [unk]"), "kitchen")
+        self.assertIsNone(self.matcher.match("bathroom"))
+        self.assertIsNone(self.matcher.match(""))
+
+    def test_stable_partial_is_taken(self):
+        self.assertIsNone(self.matcher.partial("stop", 0.1))
+        self.assertIsNone(self.matcher.partial("stop", 0.2))
+        self.assertEqual(self.matcher.partial("stop", 0.3), "stop")
+        self.assertTrue(self.matcher.heard)
+
+    def test_partial_that_keeps_changing_waits(self):
+        self.assertIsNone(self.matcher.partial("living", 0.1))
+        self.assertIsNone(self.matcher.partial("living room", 0.2))
+        self.assertIsNone(self.matcher.partial("living room", 0.3))
+        self.assertEqual(self.matcher.partial("living room", 0.4), "living room")
+
+    def test_prefix_of_a_longer_phrase_is_not_taken_early(self):
+        # "go" may still become "go to kitchen", so only the final result can decide it
+        for position in (0.1, 0.5, 1.0):
+            self.assertIsNone(self.matcher.partial("go", position))
+        self.assertEqual(self.matcher.match("go"), "go")
+
+    def test_out_of_grammar_partial_is_never_taken(self):
+        for position in (0.1, 0.5, 1.0):
+            self.assertIsNone(self.matcher.partial("[unk]", position))
+
+    def test_reset(self):
+        self.matcher.partial("stop", 0.1)
+        self.matcher.reset()
+        self.assertFalse(self.matcher.heard)
+        self.assertIsNone(self.matcher.partial("stop", 0.2))
+
+
+if __name__ == '__main__':
+    unittest.main()
@@ -1,19 +1,29 @@
 import tkinter as tk
 from tkinter import messagebox
+import logging
 import subprocess
 
+# Only the standard library is imported here so the window shows up at once;
+# the mode scripts load their models in warm worker processes
+from supervisor import Supervisor
+
 # Global variables for subprocesses
-hazard_process = None
-navigation_process = None
+inference_process = None
+
+# Detection scripts subscribe to the shared inference service instead of loading their own models
+supervisor = Supervisor(env={'VISUALEYEZE_USE_INFERENCE_SERVICE': '1'})
 
 # Function to handle power button toggle
 def toggle_power():
     if power_button.config('text')[-1] == 'Power ON':
         power_button.config(text='Power OFF', bg='red')
         set_controls_state('disabled')
+        # Pause the modes but keep the inference service up, the workers stay subscribed to it
         stop_all_processes()
     else:
         power_button.config(text='Power ON', bg='green')
+        # Restart the service only if it died in the meantime
+        start_inference_service()
         set_controls_state('normal')
 
 # Function to enable/disable controls
@@ -21,34 +31,43 @@ def set_controls_state(state):
     scale.config(state=state)
     additional_button.config(state=state)
 
-# Function to stop all running processes
+# Function to pause all modes; the workers stay loaded so switching back is instant
 def stop_all_processes():
-    global hazard_process, navigation_process
-    if hazard_process:
-        hazard_process.terminate()
-        hazard_process = None
-    if navigation_process:
-        navigation_process.terminate()
-        navigation_process = None
-
-# Function to run OutdoorNav1.py and Hazard.py scripts concurrently
-def run_outdoor_and_hazard_scripts():
-    global hazard_process, navigation_process
-    stop_all_processes()  # Ensure no scripts are already running
+    supervisor.pause_all()
+
+# Start the shared inference service once, it owns the camera and keeps the models loaded
+def start_inference_service():
+    global inference_process
+    if inference_process is None or inference_process.poll() is not None:
+        inference_process = subprocess.Popen(["python", "inference_service.py", "yolov8n.pt", "yolov8x.pt"])
+
+def stop_inference_service():
+    global inference_process
+    if inference_process:
+        inference_process.terminate()
+        inference_process = None
+
+# Start the inference service and the warm workers once the window is up
+def start_workers():
     try:
-        navigation_process = subprocess.Popen(["python", "OutdoorNav1.py"])
-        hazard_process = subprocess.Popen(["python", "Hazard.py"])
+        start_inference_service()
+        supervisor.start()
     except Exception as e:
-        messagebox.showerror("Error", f"Failed to run outdoor or hazard script: {str(e)}")
+        messagebox.showerror("Error", f"Failed to start the workers: {str(e)}")
+    poll_workers()
 
-# Function to run IndoorYolov8.py script
+# Relay worker messages and restart any worker that crashed
+def poll_workers():
+    supervisor.poll()
+    root.after(200, poll_workers)
+
+# Function to run OutdoorNav1.py and Hazard.py together
+def run_outdoor_and_hazard_scripts():
+    supervisor.switch('outdoor')
+
+# Function to run IndoorIntegrated.py
 def run_indoor_nav_script():
-    global navigation_process
-    stop_all_processes()  # Ensure no scripts are already running
-    try:
-        navigation_process = subprocess.Popen(["python", "IndoorIntegrated.py"])
-    except Exception as e:
-        messagebox.showerror("Error", f"Failed to run IndoorYolov8.py: {str(e)}")
+    supervisor.switch('indoor')
 
 # Function for slider change
 def on_slider_change(value):
@@ -65,35 +84,42 @@ def additional_function():
 
 # Gracefully stop all processes when closing the application
 def on_closing():
-    stop_all_processes()
+    supervisor.stop()
+    stop_inference_service()
     root.destroy()
 
-# Create the main window
-root = tk.Tk()
-root.title("visualEYEze")
-root.geometry("300x300")
+# Worker processes re-import this module, only the GUI process builds the window
+if __name__ == "__main__":
+    # Worker warm-up times and mode switch latency are logged
+    logging.basicConfig(level=logging.INFO)
+
+    # Create the main window
+    root = tk.Tk()
+    root.title("visualEYEze")
+    root.geometry("300x300")
 
-# Power button
-power_button = tk.Button(root, text="Power ON", bg='green', command=toggle_power)
-power_button.pack(pady=10)
+    # Power button
+    power_button = tk.Button(root, text="Power ON", bg='green', command=toggle_power)
+    power_button.pack(pady=10)
 
-# Slider to select mode
-scale = tk.Scale(root, from_=1, to=2, orient="horizontal", tickinterval=1, command=on_slider_change, label="Select Mode")
-scale.pack(pady=10)
+    # Slider to select mode
+    scale = tk.Scale(root, from_=1, to=2, orient="horizontal", tickinterval=1, command=on_slider_change, label="Select Mode")
+    scale.pack(pady=10)
 
-# Label to display current state
-label = tk.Label(root, text="State")
-label.pack(pady=5)
+    # Label to display current state
+    label = tk.Label(root, text="State")
+    label.pack(pady=5)
 
-# Additional function button
-additional_button = tk.Button(root, text="Voice activation button", command=additional_function)
-additional_button.pack(pady=10)
+    # Additional function button
+    additional_button = tk.Button(root, text="Voice activation button", command=additional_function)
+    additional_button.pack(pady=10)
 
-# Initially set controls to enabled
-set_controls_state('normal')
+    # Initially set controls to enabled
+    set_controls_state('normal')
 
-# Bind the close event to stop processes
-root.protocol("WM_DELETE_WINDOW", on_closing)
+    # Bind the close event to stop processes
+    root.protocol("WM_DELETE_WINDOW", on_closing)
 
-# Run the application
-root.mainloop()
+    # Run the application
+    root.after(0, start_workers)
+    root.mainloop()
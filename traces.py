@@ -0,0 +1,276 @@
+"""
+Detection traces: what the model saw and what was announced, per frame.
+
+With TRACE_DIR set, the hazard and indoor loops hand every frame that
+reaches the feedback step to a TraceRecorder. record() only builds two small
+fixed-width NumPy arrays and queues them. A writer thread appends them in
+chunks to two raw column files: frames.bin (FRAME_DTYPE, one record per
+frame) and detections.bin (TRACE_DETECTION_DTYPE, one record per box). The
+files go next to a meta.json with the dtypes and class names. At about 25
+bytes per frame and 27 per box, an hour at 30 fps with a handful of boxes
+per frame is under 20 MB. A crash loses at most the last chunk.
+
+load() memory-maps a trace. replay() runs it back through
+give_audio_feedback, or process_frame for indoor traces, with the recorded
+timestamps and no model. That is deterministic and runs at thousands of
+frames per second. It reports where the decisions differ from the recorded
+ones.
+
+    python traces.py info traces/hazard-20250101-120000
+    python traces.py replay traces/hazard-20250101-120000
+"""
+import argparse
+import itertools
+import json
+import logging
+import os
+import queue
+import sys
+import threading
+import time
+from types import SimpleNamespace
+from typing import List, Optional
+
+import numpy as np
+
+import config
+from detections import DetectionBatch, names_array
+
+log = logging.getLogger(__name__)
+
+VERSION = 1
+
+FRAME_DTYPE = np.dtype([
+    ('time', np.float64),      # time.monotonic() when feedback ran
+    ('captured', np.float64),  # when the frame was captured
+    ('stream', np.uint8),      # camera index, or STREAM_ROOM
+    ('flags', np.uint8),
+    ('height', np.uint16), ('width', np.uint16),
+    ('count', np.uint16),      # detections of this frame in detections.bin
+    ('room', np.int8),         # index into meta['rooms'] of the room decision, -1 for none
+])
+
+TRACE_DETECTION_DTYPE = np.dtype([
+    ('x1', np.float32), ('y1', np.float32), ('x2', np.float32), ('y2', np.float32),
+    ('conf', np.float32), ('cls', np.int16),
+    ('distance', np.float32),
+    ('announced', np.int8),  # hazard level announced for this box, 0 when nothing was said
+])
+
+# Frame flags
+FLAG_STALE = 1  # too old when it reached feedback, nothing was announced
+
+# Stream of the indoor room model's detections, recorded whenever they change
+STREAM_ROOM = 255
+
+FILES = {'frames': FRAME_DTYPE, 'detections': TRACE_DETECTION_DTYPE}
+
+
+def trace_path(mode: str, directory: str = config.TRACE_DIR) -> str:
+    """Create a new, empty directory for a trace; a restart within the same second gets a suffix"""
+    base = os.path.join(directory, f"{mode}-{time.strftime('%Y%m%d-%H%M%S')}")
+    os.makedirs(directory, exist_ok=True)
+    for attempt in itertools.count():
+        path = base if attempt == 0 else f"{base}-{attempt}"
+        try:
+            os.mkdir(path)
+            return path
+        except FileExistsError:
+            continue
+
+
+class TraceRecorder(threading.Thread):
+    def __init__(self, path: str, mode: str, names, rooms: List[str] = (),
+                 chunk_frames: int = config.TRACE_CHUNK_FRAMES, flush_interval: float = 1.0):
+        super().__init__(name="trace", daemon=True)
+        self.path = path
+        self.rooms = list(rooms)
+        self.chunk_frames = chunk_frames
+        self.flush_interval = flush_interval
+        self._queue = queue.SimpleQueue()
+        self.frames = 0
+        self.bytes = 0
+        os.makedirs(path, exist_ok=True)
+        names = names_array(names) if isinstance(names, dict) else names
+        meta = {
+            'version': VERSION,
+            'mode': mode,
+            'started': time.time(),
+            'names': [str(name) if name is not None else '' for name in names],
+            'rooms': self.rooms,
+            'frame_dtype': FRAME_DTYPE.descr,
+            'detection_dtype': TRACE_DETECTION_DTYPE.descr,
+        }
+        with open(os.path.join(path, 'meta.json'), 'w') as f:
+            json.dump(meta, f)
+        self._files = {name: open(os.path.join(path, name + '.bin'), 'ab') for name in FILES}
+
+    def record(self, stream: int, now: float, captured: float, shape, detections: DetectionBatch,
+               announced: np.ndarray = None, room: Optional[str] = None, flags: int = 0):
+        """Queue one frame; cheap enough for the feedback thread"""
+        frame = np.zeros(1, dtype=FRAME_DTYPE)
+        frame['time'], frame['captured'], frame['stream'], frame['flags'] = now, captured, stream, flags
+        frame['height'], frame['width'], frame['count'] = shape[0], shape[1], len(detections)
+        frame['room'] = self.rooms.index(room) if room in self.rooms else -1
+
+        boxes = np.empty(len(detections), dtype=TRACE_DETECTION_DTYPE)
+        boxes['x1'], boxes['y1'], boxes['x2'], boxes['y2'] = detections.boxes.T
+        boxes['conf'] = detections.scores
+        boxes['cls'] = detections.class_ids
+        boxes['distance'] = np.minimum(detections.distances(shape[0]), np.finfo(np.float32).max)
+        boxes['announced'] = 0 if announced is None else announced
+        self._queue.put((frame, boxes))
+
+    def run(self):
+        frames, boxes = [], []
+        deadline = time.monotonic() + self.flush_interval
+        while True:
+            try:
+                item = self._queue.get(timeout=max(deadline - time.monotonic(), 0.0))
+            except queue.Empty:
+                item = ()
+            if item is None or len(frames) >= self.chunk_frames or time.monotonic() >= deadline:
+                self._write(frames, boxes)
+                frames, boxes = [], []
+                deadline = time.monotonic() + self.flush_interval
+            if item is None:
+                break
+            if item:
+                frames.append(item[0])
+                boxes.append(item[1])
+
+    def _write(self, frames, boxes):
+        if not frames:
+            return
+        # Detections first: a frame is only complete once its boxes are on disk
+        for name, chunk in (('detections', boxes), ('frames', frames)):
+            data = np.concatenate(chunk).tobytes()
+            self._files[name].write(data)
+            self._files[name].flush()
+            self.bytes += len(data)
+        self.frames += len(frames)
+
+    def stop(self):
+        self._queue.put(None)
+        self.join()
+        for f in self._files.values():
+            f.close()
+        log.info("Trace %s: %d frames, %.1f MB", self.path, self.frames, self.bytes / (1024 * 1024))
+
+
+class Trace:
+    def __init__(self, path: str):
+        with open(os.path.join(path, 'meta.json')) as f:
+            self.meta = json.load(f)
+        self.names = np.array(self.meta['names'], dtype=object)
+        columns = {}
+        for name, dtype in FILES.items():
+            file = os.path.join(path, name + '.bin')
+            count = os.path.getsize(file) // dtype.itemsize
+            columns[name] = (np.memmap(file, dtype=dtype, mode='r', shape=(count,)) if count
+                             else np.empty(0, dtype=dtype))
+        self.frames, self.detections = columns['frames'], columns['detections']
+        # Where each frame's boxes start; drop a frame whose boxes didn't make it to disk
+        self.offsets = np.concatenate([[0], np.cumsum(self.frames['count'], dtype=np.int64)])
+        complete = int(np.searchsorted(self.offsets, len(self.detections), side='right')) - 1
+        self.frames = self.frames[:complete]
+
+    def __len__(self) -> int:
+        return len(self.frames)
+
+    def batch(self, i: int) -> DetectionBatch:
+        return DetectionBatch.from_records(self.detections[self.offsets[i]:self.offsets[i + 1]], self.names)
+
+    def announced(self, i: int) -> np.ndarray:
+        return np.asarray(self.detections['announced'][self.offsets[i]:self.offsets[i + 1]])
+
+    def summary(self) -> dict:
+        frames = self.frames
+        duration = float(frames['captured'][-1] - frames['captured'][0]) if len(frames) else 0.0
+        return {
+            'mode': self.meta['mode'],
+            'frames': len(frames),
+            'detections': int(self.offsets[len(frames)]),
+            'stale_frames': int(np.count_nonzero(frames['flags'] & FLAG_STALE)),
+            'announcements': int(np.count_nonzero(self.detections['announced'][:self.offsets[len(frames)]])),
+            'duration_seconds': duration,
+        }
+
+
+def load(path: str) -> Trace:
+    return Trace(path)
+
+
+def _replay_hazard(trace: Trace, speech):
+    import Hazard
+    Hazard.class_names = trace.names
+    Hazard.speech = speech
+    Hazard.trackers = {}
+    for i, frame in enumerate(trace.frames.tolist()):
+        now, _, stream, flags, height = frame[:5]
+        if flags & FLAG_STALE:
+            continue
+        announced = Hazard.give_audio_feedback(trace.batch(i), height, stream, now)
+        yield i, announced, None
+
+
+def _replay_indoor(trace: Trace, speech):
+    from IndoorIntegrated import RoomAndHazardClassifier
+    # Names only, so nothing loads a model
+    detector = SimpleNamespace(names=dict(enumerate(trace.meta['names'])))
+    classifier = RoomAndHazardClassifier(detector, speaker=speech)
+    room_model = None
+    for i, frame in enumerate(trace.frames.tolist()):
+        now, _, stream, flags, height = frame[:5]
+        if stream == STREAM_ROOM:
+            # Stand in for the background room model with its recorded output
+            if room_model is None:
+                room_model = classifier.room_detector = SimpleNamespace(boxes=None, submit=lambda image: None)
+            room_model.boxes = trace.batch(i).rows()
+            continue
+        results = classifier.process_frame(None, trace.batch(i).rows(), now)
+        announced = classifier.give_audio_feedback(results['detected_objects'], height, now)
+        yield i, announced, results['room_type']
+
+
+def replay(trace: Trace) -> dict:
+    """Feed a trace back through the feedback logic and compare with what was recorded"""
+    from benchmark import RecordingSpeech
+    speech = RecordingSpeech()
+    run = _replay_hazard if trace.meta['mode'] == 'hazard' else _replay_indoor
+    rooms = trace.meta['rooms']
+    replayed = changed_frames = room_changes = 0
+    started = time.perf_counter()
+    for i, announced, room in run(trace, speech):
+        replayed += 1
+        if not np.array_equal(announced, trace.announced(i)):
+            changed_frames += 1
+        recorded_room = trace.frames['room'][i]
+        if room is not None and room != (rooms[recorded_room] if recorded_room >= 0 else None):
+            room_changes += 1
+    elapsed = time.perf_counter() - started
+    return {
+        'frames': replayed,
+        'fps': replayed / elapsed if elapsed > 0 else 0.0,
+        'announcements': len(speech.messages),
+        'frames_with_different_announcements': changed_frames,
+        'frames_with_different_room': room_changes,
+    }
+
+
+def main():
+    parser = argparse.ArgumentParser(description=__doc__, formatter_class=argparse.RawDescriptionHelpFormatter)
+    commands = parser.add_subparsers(dest='command', required=True)
+    commands.add_parser('info', help="summarize a trace").add_argument('trace')
+    commands.add_parser('replay', help="replay a trace through the feedback logic").add_argument('trace')
+    args = parser.parse_args()
+
+    logging.basicConfig(level=logging.INFO)
+    trace = load(args.trace)
+    report = trace.summary() if args.command == 'info' else replay(trace)
+    json.dump(report, sys.stdout, indent=2)
+    print()
+
+
+if __name__ == "__main__":
+    main()
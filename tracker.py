@@ -0,0 +1,142 @@
+"""
+IoU-based multi-object tracker that remembers what has already been announced.
+
+Per-frame detections have no identity, so the same car would be announced on
+every frame it stays in view. HazardTracker links detections across frames
+into tracks with stable ids, predicting each track forward with a constant
+velocity model before matching. Each track remembers its last announced
+hazard level, and announce() only says yes when that level changes.
+"""
+import itertools
+import time
+from collections import deque
+from typing import List
+
+import numpy as np
+
+import config
+from detections import HAZARD_NONE
+
+
+def iou_matrix(a: np.ndarray, b: np.ndarray) -> np.ndarray:
+    """Pairwise IoU between (N, 4) and (M, 4) boxes in x1, y1, x2, y2 form"""
+    x1 = np.maximum(a[:, None, 0], b[None, :, 0])
+    y1 = np.maximum(a[:, None, 1], b[None, :, 1])
+    x2 = np.minimum(a[:, None, 2], b[None, :, 2])
+    y2 = np.minimum(a[:, None, 3], b[None, :, 3])
+    inter = np.clip(x2 - x1, 0, None) * np.clip(y2 - y1, 0, None)
+    area_a = (a[:, 2] - a[:, 0]) * (a[:, 3] - a[:, 1])
+    area_b = (b[:, 2] - b[:, 0]) * (b[:, 3] - b[:, 1])
+    return inter / np.maximum(area_a[:, None] + area_b[None, :] - inter, 1e-6)
+
+
+def match_detections(reference: np.ndarray, boxes: np.ndarray, threshold: float = 0.5):
+    """
+    Greedy same-class matching of two (N, 6) x1, y1, x2, y2, conf, cls arrays at IoU >= threshold.
+    Returns the number of matches and their summed IoU.
+    """
+    if not len(reference) or not len(boxes):
+        return 0, 0.0
+    iou = iou_matrix(reference[:, :4], boxes[:, :4])
+    iou[reference[:, None, 5] != boxes[None, :, 5]] = 0.0
+    used_reference, used = set(), set()
+    total = 0.0
+    for i, j in zip(*np.unravel_index(np.argsort(-iou, axis=None), iou.shape)):
+        if iou[i, j] < threshold:
+            break
+        if i not in used_reference and j not in used:
+            used_reference.add(i)
+            used.add(j)
+            total += float(iou[i, j])
+    return len(used), total
+
+
+class Track:
+    def __init__(self, track_id: int, box: np.ndarray, class_id: int, now: float):
+        self.id = track_id
+        self.class_id = class_id
+        self.box = box.astype(np.float32)
+        self.velocity = np.zeros(4, dtype=np.float32)  # pixels per second
+        self.first_seen = now
+        self.last_seen = now
+        self.hits = 1
+        self.level = HAZARD_NONE  # last announced hazard level
+        self.last_announced = None
+        self.distances = deque(maxlen=10)  # (time, distance)
+
+    def predict(self, now: float) -> np.ndarray:
+        return self.box + self.velocity * (now - self.last_seen)
+
+    def update(self, box: np.ndarray, now: float):
+        dt = now - self.last_seen
+        if dt > 0:
+            self.velocity = 0.5 * self.velocity + 0.5 * (box - self.box) / dt
+        self.box = box.astype(np.float32)
+        self.last_seen = now
+        self.hits += 1
+
+    def add_distance(self, distance: float, now: float):
+        self.distances.append((now, distance))
+
+    def distance_trend(self) -> float:
+        """Change in distance per second over recent frames, negative when approaching"""
+        if len(self.distances) < 2:
+            return 0.0
+        (t0, d0), (t1, d1) = self.distances[0], self.distances[-1]
+        return (d1 - d0) / (t1 - t0) if t1 > t0 else 0.0
+
+    def announce(self, level: int, now: float) -> bool:
+        """
+        Record the hazard level seen this frame. True if it should be spoken,
+        i.e. the level changed since the last announcement.
+        """
+        # Dropping out of range keeps the old level, so flicker doesn't re-announce
+        if level == HAZARD_NONE or level == self.level:
+            return False
+        self.level = level
+        self.last_announced = now
+        return True
+
+
+class HazardTracker:
+    def __init__(self, iou_threshold: float = config.TRACK_IOU_THRESHOLD,
+                 max_age: float = config.TRACK_MAX_AGE):
+        self.iou_threshold = iou_threshold
+        self.max_age = max_age
+        self.tracks: List[Track] = []
+        self._ids = itertools.count(1)
+
+    def update(self, boxes, class_ids, now: float = None) -> List[Track]:
+        """
+        Match this frame's (N, 4) boxes to tracks. Returns the track for each box, in order.
+        """
+        now = time.monotonic() if now is None else now
+        boxes = np.asarray(boxes, dtype=np.float32).reshape(-1, 4)
+        class_ids = np.asarray(class_ids, dtype=np.int64).reshape(-1)
+        self.tracks = [t for t in self.tracks if now - t.last_seen <= self.max_age]
+
+        assigned = [None] * len(boxes)
+        matched = set()
+        if self.tracks and len(boxes):
+            predicted = np.stack([t.predict(now) for t in self.tracks])
+            track_classes = np.array([t.class_id for t in self.tracks])
+            iou = iou_matrix(predicted, boxes)
+            iou[track_classes[:, None] != class_ids[None, :]] = 0.0
+
+            # Greedy assignment, best overlap first
+            for flat in np.argsort(iou, axis=None)[::-1]:
+                ti, di = np.unravel_index(flat, iou.shape)
+                if iou[ti, di] < self.iou_threshold:
+                    break
+                if assigned[di] is not None or ti in matched:
+                    continue
+                matched.add(ti)
+                self.tracks[ti].update(boxes[di], now)
+                assigned[di] = self.tracks[ti]
+
+        for di, track in enumerate(assigned):
+            if track is None:
+                track = Track(next(self._ids), boxes[di], int(class_ids[di]), now)
+                self.tracks.append(track)
+                assigned[di] = track
+        return assigned
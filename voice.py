@@ -0,0 +1,353 @@
+"""
+Spoken command recognition without a network round trip.
+
+With VOICE_ENGINE = 'vosk' (or 'auto' and a model at VOSK_MODEL) audio is
+decoded on the device by a Vosk recognizer restricted to a grammar of the
+phrases the caller can act on: room names, saved places and a few commands.
+Microphone chunks go to the decoder as they arrive, and a phrase is taken as
+soon as the partial result is a whole phrase, not the start of a longer
+one, and has held for VOICE_STABLE_TIME, or at the decoder's own endpoint
+VOICE_END_SILENCE after the speech stops, whichever comes first. Otherwise
+phrases go through Google's recognizer as before, with the microphone
+calibrated for ambient noise once rather than before every attempt.
+
+    python voice.py evaluate corpus/ --phrases kitchen "living room" stop
+    python voice.py evaluate corpus/ --layout layouts/house.json --engine google
+
+A corpus is a directory of WAV files and a labels.tsv with one
+"file.wav<TAB>expected phrase" line per recording.
+"""
+import argparse
+import json
+import logging
+import os
+import sys
+import time
+import wave
+from typing import Iterable, List, Optional
+
+import numpy as np
+import speech_recognition as sr
+
+import config
+
+log = logging.getLogger(__name__)
+
+SAMPLE_RATE = 16000
+CHUNK = 1600  # samples, 0.1 s
+UNKNOWN = '[unk]'
+
+# Commands understood everywhere
+COMMANDS = ('stop', 'cancel', 'exit', 'quit', 'repeat', 'where am i')
+
+_models = {}
+
+
+def _vosk_model(path: str):
+    # Loading takes a second or more, so every recognizer in the process shares one
+    if path not in _models:
+        import vosk
+        vosk.SetLogLevel(-1)
+        _models[path] = vosk.Model(path)
+    return _models[path]
+
+
+def vosk_available(path: str = config.VOSK_MODEL) -> bool:
+    if not path or not os.path.isdir(path):
+        return False
+    try:
+        import vosk  # noqa: F401
+    except ImportError:
+        return False
+    return True
+
+
+def normalize(phrases: Iterable[str]) -> List[str]:
+    """Lowercase phrases with single spaces, duplicates removed, in order"""
+    seen = {}
+    for phrase in phrases:
+        phrase = ' '.join(phrase.lower().replace('_', ' ').split())
+        if phrase:
+            seen.setdefault(phrase, None)
+    return list(seen)
+
+
+class PhraseMatcher:
+    """Turns a decoder's partial and final texts into one of `phrases`; knows nothing about audio"""
+
+    def __init__(self, phrases: Iterable[str], stable_time: float = config.VOICE_STABLE_TIME):
+        self.phrases = normalize(phrases)
+        self.stable_time = stable_time
+        # A partial can only be taken early when nothing longer could still follow it
+        self._complete = {p for p in self.phrases if not any(q.startswith(p + ' ') for q in self.phrases)}
+        self.reset()
+
+    def reset(self):
+        self.heard = False  # a partial result has come in
+        self._partial = ''
+        self._partial_since = 0.0
+
+    def match(self, text: str) -> Optional[str]:
+        """The phrase a final result names, ignoring out-of-grammar words, or None"""
+        text = ' '.join(word for word in text.split() if word != UNKNOWN)
+        return text if text in self.phrases else None
+
+    def partial(self, text: str, position: float) -> Optional[str]:
+        """The phrase once partial `text` is a whole phrase that has held for stable_time, else None"""
+        if text:
+            self.heard = True
+        if text != self._partial:
+            self._partial, self._partial_since = text, position
+        elif text in self._complete and position - self._partial_since >= self.stable_time:
+            return text
+        return None
+
+
+class GrammarRecognizer:
+    """Streaming Vosk decoder limited to `phrases`"""
+
+    def __init__(self, phrases: Iterable[str], model_path: str = config.VOSK_MODEL,
+                 sample_rate: int = SAMPLE_RATE, stable_time: float = config.VOICE_STABLE_TIME,
+                 end_silence: float = config.VOICE_END_SILENCE):
+        import vosk
+        self.matcher = PhraseMatcher(phrases, stable_time)
+        self.phrases = self.matcher.phrases
+        self.sample_rate = sample_rate
+        self.end_silence = end_silence
+        self._model = _vosk_model(model_path)
+        self._grammar = json.dumps(self.phrases + [UNKNOWN])
+        self._vosk = vosk
+        self.reset()
+
+    def reset(self):
+        self._decoder = self._vosk.KaldiRecognizer(self._model, self.sample_rate, self._grammar)
+        if hasattr(self._decoder, 'SetEndpointerDelays'):
+            # start timeout, trailing silence, maximum utterance length, in seconds
+            self._decoder.SetEndpointerDelays(10.0, self.end_silence, 10.0)
+        self.position = 0.0  # seconds of audio fed since reset
+        self.matcher.reset()
+
+    @property
+    def heard(self) -> bool:
+        """The decoder has produced a partial result"""
+        return self.matcher.heard
+
+    def feed(self, chunk: bytes):
+        """
+        Decode 16-bit mono PCM. Returns the phrase once decided, '' when the utterance
+        ended without one, and None while it is still going.
+        """
+        self.position += len(chunk) / (2 * self.sample_rate)
+        if self._decoder.AcceptWaveform(chunk):
+            text = json.loads(self._decoder.Result()).get('text', '')
+            if not text and not self.heard:
+                return None  # silence before the speech
+            return self.matcher.match(text) or ''
+
+        partial = json.loads(self._decoder.PartialResult()).get('partial', '')
+        return self.matcher.partial(partial, self.position)
+
+    def finish(self) -> str:
+        """The phrase, or '', for audio that ended before the decoder decided"""
+        return self.matcher.match(json.loads(self._decoder.FinalResult()).get('text', '')) or ''
+
+
+class VoiceCommands:
+    """
+    Listens on the microphone for one of `phrases`. `engine` is 'vosk', 'google'
+    or 'auto' (Vosk when its model is installed).
+    """
+
+    def __init__(self, phrases: Iterable[str], engine: str = config.VOICE_ENGINE,
+                 model_path: str = config.VOSK_MODEL):
+        self.phrases = normalize(phrases)
+        if engine == 'auto':
+            engine = 'vosk' if vosk_available(model_path) else 'google'
+        self.engine = engine
+        self.grammar = GrammarRecognizer(self.phrases, model_path) if engine == 'vosk' else None
+        self.recognizer = sr.Recognizer()
+        self._calibrated = False
+        self.latency = None  # seconds from the last chunk of the phrase to the decision
+        log.info("Voice commands through %s, %d phrases", engine, len(self.phrases))
+
+    def listen(self, timeout: float = 5.0, phrase_time_limit: float = 8.0, cancelled=None) -> Optional[str]:
+        """
+        The next phrase heard, lowercased. With the Google engine it can be anything;
+        None when nothing was said within `timeout` or it wasn't understood, or once
+        `cancelled()` is true. Vosk checks `cancelled` every audio chunk, Google only
+        after capturing.
+        """
+        if self.grammar is not None:
+            return self._listen_vosk(timeout, phrase_time_limit, cancelled)
+        return self._listen_google(timeout, phrase_time_limit, cancelled)
+
+    def _listen_vosk(self, timeout: float, phrase_time_limit: float, cancelled=None) -> Optional[str]:
+        grammar = self.grammar
+        grammar.reset()
+        with sr.Microphone(sample_rate=grammar.sample_rate, chunk_size=CHUNK) as source:
+            while cancelled is None or not cancelled():
+                chunk = source.stream.read(source.CHUNK)
+                received = time.perf_counter()
+                phrase = grammar.feed(chunk)
+                if phrase is not None:
+                    self.latency = time.perf_counter() - received
+                    return phrase or None
+                if not grammar.heard and grammar.position >= timeout:
+                    return None
+                if grammar.position >= timeout + phrase_time_limit:
+                    return grammar.finish() or None
+        return None
+
+    def _listen_google(self, timeout: float, phrase_time_limit: float, cancelled=None) -> Optional[str]:
+        with sr.Microphone() as source:
+            if not self._calibrated:
+                # The threshold adapts while listening, so calibrating once is enough
+                self.recognizer.adjust_for_ambient_noise(source)
+                self._calibrated = True
+            try:
+                audio = self.recognizer.listen(source, timeout=timeout, phrase_time_limit=phrase_time_limit)
+            except sr.WaitTimeoutError:
+                return None
+        if cancelled is not None and cancelled():
+            return None
+        started = time.perf_counter()
+        try:
+            phrase = self.recognizer.recognize_google(audio)
+        except sr.UnknownValueError:
+            return None
+        except sr.RequestError as e:
+            log.error("Speech recognition error: %s", e)
+            return None
+        finally:
+            self.latency = time.perf_counter() - started
+        return ' '.join(phrase.lower().split())
+
+
+def read_wav(path: str) -> bytes:
+    """16-bit mono PCM at SAMPLE_RATE from a WAV file"""
+    with wave.open(path, 'rb') as f:
+        if f.getsampwidth() != 2:
+            raise ValueError(f"{path}: expected 16-bit samples")
+        samples = np.frombuffer(f.readframes(f.getnframes()), dtype=np.int16)
+        rate, channels = f.getframerate(), f.getnchannels()
+    if channels > 1:
+        samples = samples.reshape(-1, channels).mean(axis=1)
+    if rate != SAMPLE_RATE:
+        positions = np.arange(0, len(samples), rate / SAMPLE_RATE)
+        samples = np.interp(positions, np.arange(len(samples)), samples)
+    return np.asarray(samples, dtype=np.int16).tobytes()
+
+
+def speech_end(pcm: bytes, frame: float = 0.02) -> float:
+    """Seconds into the audio where the last frame clearly louder than the background ends"""
+    samples = np.frombuffer(pcm, dtype=np.int16).astype(np.float32)
+    size = int(SAMPLE_RATE * frame)
+    count = len(samples) // size
+    if not count:
+        return 0.0
+    energy = np.sqrt((samples[:count * size].reshape(count, size) ** 2).mean(axis=1))
+    loud = np.flatnonzero(energy > max(np.percentile(energy, 10) * 4, 300.0))
+    return (loud[-1] + 1) * frame if len(loud) else 0.0
+
+
+def load_corpus(directory: str) -> List[tuple]:
+    corpus = []
+    with open(os.path.join(directory, 'labels.tsv')) as f:
+        for line in f:
+            if line.strip() and not line.startswith('#'):
+                name, expected = line.rstrip('\n').split('\t', 1)
+                corpus.append((os.path.join(directory, name), normalize([expected])[0]))
+    return corpus
+
+
+def _decide_vosk(grammar: GrammarRecognizer, pcm: bytes):
+    """
+    Stream `pcm` through the decoder. Returns the phrase, the audio position at the decision,
+    the total decode time and when decoding of the deciding chunk started.
+    """
+    grammar.reset()
+    step = CHUNK * 2
+    busy = 0.0
+    for offset in range(0, len(pcm), step):
+        started = time.perf_counter()
+        phrase = grammar.feed(pcm[offset:offset + step])
+        busy += time.perf_counter() - started
+        if phrase is not None:
+            return phrase, grammar.position, busy, started
+    started = time.perf_counter()
+    phrase = grammar.finish()
+    busy += time.perf_counter() - started
+    return phrase, grammar.position, busy, started
+
+
+def evaluate(corpus, phrases: List[str], engine: str = 'vosk', model_path: str = config.VOSK_MODEL) -> dict:
+    """
+    Accuracy and latency over a labelled corpus. Latency is measured as if the audio
+    arrived in real time: audio between the end of speech and the decision, plus the
+    time to decode the deciding chunk.
+    """
+    from benchmark import summarize
+    grammar = GrammarRecognizer(phrases, model_path) if engine == 'vosk' else None
+    recognizer = sr.Recognizer()
+    latencies, failures = [], []
+    correct = 0
+    audio_seconds = busy_seconds = 0.0
+    for path, expected in corpus:
+        pcm = read_wav(path)
+        end = speech_end(pcm)
+        if grammar is not None:
+            phrase, position, busy, started = _decide_vosk(grammar, pcm)
+            latency = max(position - end, 0.0) + (time.perf_counter() - started)
+        else:
+            audio = sr.AudioData(pcm, SAMPLE_RATE, 2)
+            started = time.perf_counter()
+            try:
+                phrase = ' '.join(recognizer.recognize_google(audio).lower().split())
+            except (sr.UnknownValueError, sr.RequestError):
+                phrase = ''
+            busy = latency = time.perf_counter() - started
+        audio_seconds += len(pcm) / (2 * SAMPLE_RATE)
+        busy_seconds += busy
+        latencies.append(latency)
+        if phrase == expected:
+            correct += 1
+        else:
+            failures.append({'file': os.path.basename(path), 'expected': expected, 'heard': phrase})
+        log.info("%s: %r (expected %r) after %.0f ms", os.path.basename(path), phrase, expected, latency * 1000)
+    return {
+        'engine': engine,
+        'files': len(corpus),
+        'accuracy': correct / len(corpus) if corpus else 0.0,
+        'latency': summarize(latencies),
+        'real_time_factor': busy_seconds / audio_seconds if audio_seconds else 0.0,
+        'failures': failures,
+    }
+
+
+def main():
+    parser = argparse.ArgumentParser(description=__doc__, formatter_class=argparse.RawDescriptionHelpFormatter)
+    commands = parser.add_subparsers(dest='command', required=True)
+    evaluate_parser = commands.add_parser('evaluate', help="accuracy and latency on recorded commands")
+    evaluate_parser.add_argument('corpus', help="directory with WAV files and labels.tsv")
+    evaluate_parser.add_argument('--phrases', nargs='*', default=[], help="grammar phrases besides the commands")
+    evaluate_parser.add_argument('--layout', help="add the room names of an indoor layout to the grammar")
+    evaluate_parser.add_argument('--engine', choices=('vosk', 'google'), default='vosk')
+    evaluate_parser.add_argument('--model', default=config.VOSK_MODEL)
+    args = parser.parse_args()
+
+    logging.basicConfig(level=logging.INFO)
+    corpus = load_corpus(args.corpus)
+    phrases = list(args.phrases) + list(COMMANDS)
+    if not args.phrases and not args.layout:
+        # No vocabulary given: the labels are the vocabulary
+        phrases += [expected for _, expected in corpus]
+    if args.layout:
+        from indoor_routing import IndoorRouter
+        router = IndoorRouter.load(args.layout)
+        phrases += [router.label(room) for room in router.rooms]
+    json.dump(evaluate(corpus, normalize(phrases), args.engine, args.model), sys.stdout, indent=2)
+    print()
+
+
+if __name__ == "__main__":
+    main()